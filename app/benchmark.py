@@ -0,0 +1,111 @@
+# End-to-end benchmark of the frame pipeline (decode -> detect -> swap -> restore/masks -> enhance), runnable on CPU
+# Usage Example
+# 'python -m app.benchmark' (All the presets on a synthetic 720p video, with small generated stand-in models)
+# 'python -m app.benchmark --presets swap swap_restorer --frames 120 --output results.json'
+# 'python -m app.benchmark --models installed --provider CUDA --video input.mp4' (The real models of model_assets)
+# 'python -m app.benchmark --baseline baseline.json --max-regression 10' (Fail when a preset is more than 10% slower)
+# 'python -m app.benchmark --compare baseline.json results.json'
+
+import os
+import sys
+import json
+import argparse
+
+# No display server is needed, but make sure Qt never tries to connect to one
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import torch
+
+from app.processors.pipeline_benchmark import PipelineBenchmark, PRESETS, compare_results, get_missing_models, prepare_standin_benchmark
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser("VisoMaster Pipeline Benchmark")
+    parser.add_argument("--presets", help="Presets to run (default: all)", nargs='+', choices=list(PRESETS), default=list(PRESETS))
+    parser.add_argument("--frames", help="Number of measured frames per preset", default=60, type=int)
+    parser.add_argument("--warmup", help="Number of frames processed before the measure starts", default=5, type=int)
+    parser.add_argument("--resolution", help="Resolution of the synthetic video, WIDTHxHEIGHT", default='1280x720', type=str)
+    parser.add_argument("--faces", help="Number of faces in the synthetic video", default=1, type=int)
+    parser.add_argument("--video", help="Benchmark this video instead of the synthetic one (with --models standin, the faces are expected where the synthetic video has them)", type=str)
+    parser.add_argument("--models", help="'standin': small generated models with the I/O of the real ones, no download needed. 'installed': the models of model_assets", choices=('standin', 'installed'), default='standin', type=str)
+    parser.add_argument("--provider", help="Execution provider", choices=('CUDA', 'TensorRT', 'TensorRT-Engine', 'CPU'), default='CPU', type=str)
+    parser.add_argument("--threads", help="Number of execution threads for the models", default=2, type=int)
+    parser.add_argument("--sync", help="Synchronize the GPU around every stage for accurate GPU stage timings", action='store_true')
+    parser.add_argument("--output", help="Results file", default='benchmark_results.json', type=str)
+    parser.add_argument("--work-dir", help="Folder of the synthetic video and of the stand-in models", default='benchmark_assets', type=str)
+    parser.add_argument("--in-process", help="Run the presets in this process instead of one process each (the peak memory is then the one of all the presets so far)", action='store_true')
+    parser.add_argument("--baseline", help="Results file to compare the results with", type=str)
+    parser.add_argument("--max-regression", help="With --baseline or --compare, exit with an error when the FPS of a preset dropped by more than this percentage", default=10.0, type=float)
+    parser.add_argument("--compare", help="Only compare two results files, without running the benchmark", nargs=2, metavar=('BASELINE', 'RESULTS'), type=str)
+    return parser.parse_args(argv)
+
+def load_results(file_path: str) -> dict:
+    with open(file_path, 'r', encoding='utf-8') as results_file:
+        return json.load(results_file)
+
+def print_preset_results(preset_name, preset_results):
+    frame_ms = preset_results['frame_ms']
+    peak_rss_mb = f"{preset_results['peak_rss_mb']:.0f} MB" if preset_results['peak_rss_mb'] is not None else 'n/a'
+    print(f"\n{preset_name}: {preset_results['fps']:.2f} fps, frame p50={frame_ms['p50']:.1f} ms p95={frame_ms['p95']:.1f} ms max={frame_ms['max']:.1f} ms, peak RSS {peak_rss_mb}")
+    for row in preset_results['stages']:
+        name = f"{row['stage']} ({row['model']})" if row['model'] else row['stage']
+        print(f"    {name:<40} p50={row['p50_ms']:.1f} ms  p95={row['p95_ms']:.1f} ms  max={row['max_ms']:.1f} ms")
+
+def print_comparison(baseline: dict, results: dict, max_regression: float) -> int:
+    lines, regressions = compare_results(baseline, results, max_regression / 100)
+    print(f"\nCompared with the baseline (commit {baseline.get('commit') or 'unknown'}):")
+    for line in lines:
+        print(line)
+    if regressions:
+        print(f"FPS regression above {max_regression}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        return print_comparison(load_results(args.compare[0]), load_results(args.compare[1]), args.max_regression)
+    if args.frames < 1:
+        print("--frames must be at least 1")
+        return 1
+    provider = args.provider
+    if provider != 'CPU' and not torch.cuda.is_available():
+        print(f"CUDA is not available, using CPU instead of {provider}")
+        provider = 'CPU'
+
+    try:
+        width, height = (int(value) for value in args.resolution.lower().split('x'))
+    except ValueError:
+        print(f"Invalid resolution: {args.resolution}")
+        return 1
+    if args.video and not os.path.isfile(args.video):
+        print(f"Video not found: {args.video}")
+        return 1
+
+    if args.models == 'standin':
+        print(f"Preparing the synthetic video and the stand-in models in {args.work_dir}")
+        video_path, model_paths = prepare_standin_benchmark(args.work_dir, width, height, args.frames + args.warmup, args.faces, args.video)
+    else:
+        missing_models = get_missing_models(args.presets)
+        if missing_models:
+            print(f"Models not found in model_assets: {', '.join(missing_models)}. Download them first or use --models standin")
+            return 1
+        if args.video:
+            video_path = args.video
+        else:
+            video_path, _ = prepare_standin_benchmark(args.work_dir, width, height, args.frames + args.warmup, args.faces)
+        model_paths = {}
+
+    benchmark = PipelineBenchmark(video_path, provider=provider, threads=args.threads, num_frames=args.frames, warmup_frames=args.warmup,
+                                  model_paths=model_paths, synchronize=args.sync, separate_processes=not args.in_process)
+    print(f"Benchmarking {', '.join(args.presets)} on {video_path} ({provider}, {args.frames} frames)")
+    results = benchmark.run(args.presets, progress_callback=print_preset_results)
+    with open(args.output, 'w', encoding='utf-8') as results_file:
+        json.dump(results, results_file, indent=4)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        return print_comparison(load_results(args.baseline), results, args.max_regression)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
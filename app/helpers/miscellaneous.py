@@ -1,4 +1,5 @@
 import os
+import glob
 import shutil
 import cv2
 import time
@@ -182,13 +183,34 @@ def benchmark(func):
         return result  # Return the result of the original function
     return wrapper
 
-def read_frame(capture_obj: cv2.VideoCapture, preview_mode=False):
+def open_video_capture(media_path: str, backend='OpenCV'):
+    """
+    Open a video file with the given decode backend ('OpenCV' or 'PyAV'). The returned capture is used like a cv2.VideoCapture, eg: with read_frame().
+    The PyAV backend seeks to frames with a cached keyframe index (see PyAVCapture), it falls back to OpenCV if PyAV is not installed
+    """
+    if backend == 'PyAV':
+        from app.helpers import pyav_capture # pylint: disable=import-outside-toplevel
+        if pyav_capture.av is not None:
+            return pyav_capture.PyAVCapture(media_path)
+        print("PyAV not installed; using the OpenCV decode backend.")
+    return cv2.VideoCapture(media_path)
+
+def get_preview_resolution(media_width: int, media_height: int, preview_height: int):
+    """(width, height) of the proxy preview frames, keeping the aspect ratio with even dimensions, or None if the media is not taller than preview_height"""
+    if not preview_height or media_height <= preview_height:
+        return None
+    width = int(round(media_width * preview_height / media_height / 2)) * 2
+    return max(width, 2), preview_height
+
+def read_frame(capture_obj: cv2.VideoCapture, preview_mode=False, preview_height=720):
     with lock:
         ret, frame = capture_obj.read()
     if ret and preview_mode:
-        pass
-        # width, height = get_scaled_resolution(capture_obj)
-        # frame = cv2.resize(fr2ame, dsize=(width, height), interpolation=cv2.INTER_LANCZOS4)
+        # Downscale the frame to the proxy preview resolution
+        height, width, _ = frame.shape
+        preview_resolution = get_preview_resolution(width, height, preview_height)
+        if preview_resolution:
+            frame = cv2.resize(frame, dsize=preview_resolution, interpolation=cv2.INTER_AREA)
     return ret, frame
 
 def read_image_file(image_path):
@@ -205,6 +227,13 @@ def read_image_file(image_path):
 
     return img  # Return BGR format
 
+def write_image_file(image_path, img) -> bool:
+    # Same as cv2.imwrite, but also works with non-ASCII paths on Windows (like read_image_file)
+    ret, buffer = cv2.imencode(Path(image_path).suffix, img)
+    if ret:
+        buffer.tofile(image_path)
+    return ret
+
 def get_output_file_path(original_media_path, output_folder, media_type='video'):
     date_and_time = datetime.now().strftime(r'%Y_%m_%d_%H_%M_%S')
     input_filename = os.path.basename(original_media_path)
@@ -218,6 +247,58 @@ def get_output_file_path(original_media_path, output_folder, media_type='video')
     output_file_path = os.path.join(output_folder, output_filename)
     return output_file_path
 
+def find_existing_output_file(original_media_path, output_folder, media_type='video'):
+    """Return an output file previously written for original_media_path by get_output_file_path() (any date and time), or None"""
+    stem = Path(original_media_path).stem
+    suffix = '.mp4' if media_type == 'video' else '.png'
+    pattern = f'{glob.escape(stem)}_[0-9][0-9][0-9][0-9]_[0-9][0-9]_[0-9][0-9]_[0-9][0-9]_[0-9][0-9]_[0-9][0-9]{suffix}'
+    existing_files = glob.glob(os.path.join(glob.escape(output_folder), pattern))
+    return existing_files[0] if existing_files else None
+
+def get_ffmpeg_video_writer_args(frame_width, frame_height, fps, output_file_path, audio_media_path=None, audio_start_time=0.0):
+    """
+    ffmpeg arguments to encode raw BGR frames written to stdin into an H.264 file.
+    If audio_media_path is given, its audio (starting at audio_start_time) is muxed in the same pass and cut to the length of the video
+    """
+    args = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-f", "rawvideo",             # Specify raw video input
+        "-pix_fmt", "bgr24",          # Pixel format of input frames
+        "-s", f"{frame_width}x{frame_height}",  # Frame resolution
+        "-r", str(fps),               # Frame rate
+        "-i", "pipe:",                # Input from stdin
+    ]
+    if audio_media_path:
+        args += [
+            "-ss", str(audio_start_time), "-i", audio_media_path,  # Audio source, seeked to the first frame
+            "-map", "0:v:0", "-map", "1:a:0?",
+            "-c:a", "copy",
+            "-shortest",
+        ]
+    args += [
+        "-vf", f"pad=ceil(iw/2)*2:ceil(ih/2)*2,format=yuvj420p",  # Padding and format conversion
+        "-c:v", "libx264",            # H.264 codec
+        "-crf", "18",                 # Quality setting
+        output_file_path              # Output file
+    ]
+    return args
+
+def get_ffmpeg_concat_args(list_file_path, output_file_path, audio_media_path=None, audio_start_time=0.0):
+    """ffmpeg arguments to join the video files listed in list_file_path (concat demuxer format) without re-encoding, muxing the audio of audio_media_path"""
+    args = ["ffmpeg",
+            '-hide_banner',
+            '-loglevel',    'error',
+            "-f", "concat", "-safe", "0", "-i", list_file_path]
+    if audio_media_path:
+        args += ["-ss", str(audio_start_time), "-i", audio_media_path,
+                 "-map", "0:v:0", "-map", "1:a:0?",
+                 "-shortest"]
+    args += ["-c", "copy",
+             output_file_path]
+    return args
+
 def is_ffmpeg_in_path():
     if not cmd_exist('ffmpeg'):
         print("FFMPEG Not found in your system!")
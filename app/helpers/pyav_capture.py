@@ -0,0 +1,130 @@
+import os
+import json
+import bisect
+from typing import List
+
+import cv2
+import numpy as np
+try:
+    import av
+except ImportError:
+    av = None
+
+import app.helpers.miscellaneous as misc_helpers
+
+class PyAVCapture:
+    """
+    Video capture decoding with PyAV (ffmpeg), usable in place of cv2.VideoCapture for the methods the app uses
+    (isOpened, read, set/get of the frame position and properties, release).
+    The presentation timestamps of every frame and the keyframes are indexed once per file and cached next to the
+    thumbnails, so setting CAP_PROP_POS_FRAMES seeks to the closest keyframe and decodes forward to the exact frame,
+    or just decodes forward when the frame is in the GOP being decoded.
+    """
+    def __init__(self, media_path: str):
+        self.media_path = media_path
+        self.container = None
+        self.stream = None
+        self.frame_pts: List[int] = []
+        self.keyframe_numbers: List[int] = []
+        self.position = 0 # Number of the next frame returned by read()
+        self.decoded_position = 0 # Number of the next frame returned by the decoder
+        self.frames = None
+        try:
+            self.container = av.open(media_path)
+            self.stream = self.container.streams.video[0]
+            # Let ffmpeg decode with frame and slice threads
+            self.stream.thread_type = 'AUTO'
+            self.load_index()
+        except Exception as e: # pylint: disable=broad-exception-caught
+            print(f"PyAV could not open {media_path}: {e}")
+            self.release()
+
+    def get_index_path(self) -> str:
+        thumbnail_dir = misc_helpers.ensure_thumbnail_dir()
+        return os.path.join(thumbnail_dir, f"{misc_helpers.get_hash_from_filename(self.media_path)}.keyframes.json")
+
+    def load_index(self):
+        index_path = self.get_index_path()
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as index_file:
+                index = json.load(index_file)
+            self.frame_pts, self.keyframe_numbers = index['frame_pts'], index['keyframe_numbers']
+            return
+        self.build_index()
+        with open(index_path, 'w', encoding='utf-8') as index_file:
+            json.dump({'frame_pts': self.frame_pts, 'keyframe_numbers': self.keyframe_numbers}, index_file)
+
+    def build_index(self):
+        # Only demux the packets (no decoding). Frame numbers follow the presentation order, ie the sorted pts
+        packets = [(packet.pts, packet.is_keyframe) for packet in self.container.demux(self.stream) if packet.pts is not None]
+        packets.sort()
+        self.frame_pts = [pts for pts, _ in packets]
+        self.keyframe_numbers = [frame_number for frame_number, (_, is_keyframe) in enumerate(packets) if is_keyframe] or [0]
+        self.container.seek(0)
+
+    def isOpened(self) -> bool: # pylint: disable=invalid-name
+        return self.container is not None
+
+    def get(self, prop_id: int) -> float:
+        if not self.isOpened():
+            return 0.0
+        if prop_id == cv2.CAP_PROP_FPS:
+            rate = self.stream.average_rate or self.stream.guessed_rate
+            return float(rate) if rate else 0.0
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.frame_pts))
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.stream.codec_context.width)
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.stream.codec_context.height)
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return 0.0
+
+    def set(self, prop_id: int, value) -> bool:
+        if prop_id != cv2.CAP_PROP_POS_FRAMES or not self.isOpened():
+            return False
+        # The seek itself is done by the next read()
+        self.position = max(0, min(int(value), len(self.frame_pts)))
+        return True
+
+    def get_keyframe_before(self, frame_number: int) -> int:
+        index = bisect.bisect_right(self.keyframe_numbers, frame_number) - 1
+        return self.keyframe_numbers[max(index, 0)]
+
+    def seek_to_position(self):
+        keyframe_number = self.get_keyframe_before(self.position)
+        if self.frames is not None and keyframe_number <= self.decoded_position <= self.position:
+            # The frame is ahead in the GOP being decoded, decoding forward is cheaper than seeking
+            return
+        self.container.seek(self.frame_pts[keyframe_number], stream=self.stream, backward=True, any_frame=False)
+        self.frames = self.container.decode(self.stream)
+        self.decoded_position = keyframe_number
+
+    def read(self, image: np.ndarray|None = None):
+        if not self.isOpened() or self.position >= len(self.frame_pts):
+            return False, None
+        try:
+            if self.decoded_position != self.position or self.frames is None:
+                self.seek_to_position()
+            target_pts = self.frame_pts[self.position]
+            for frame in self.frames:
+                if frame.pts is not None and frame.pts < target_pts:
+                    continue
+                self.position += 1
+                self.decoded_position = self.position
+                frame = frame.to_ndarray(format='bgr24')
+                if image is not None and image.shape == frame.shape:
+                    np.copyto(image, frame)
+                    return True, image
+                return True, frame
+        except Exception as e: # pylint: disable=broad-exception-caught
+            print(f"PyAV could not decode frame {self.position} of {self.media_path}: {e}")
+        self.frames = None
+        return False, None
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+        self.container = None
+        self.frames = None
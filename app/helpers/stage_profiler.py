@@ -0,0 +1,164 @@
+import csv
+import json
+import math
+import time
+import inspect
+import threading
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+from typing import Deque, Dict, List, Tuple
+
+import torch
+
+from app.helpers.trace_recorder import tracer
+
+# Columns of get_stats() rows and of the CSV export
+STATS_FIELDS = ('stage', 'model', 'count', 'p50_ms', 'p95_ms', 'max_ms', 'mean_ms')
+
+class StageTimer:
+    """Context manager recording the time spent in its block into the StageProfiler, and as a span of the trace when it is recording"""
+    __slots__ = ('profiler', 'stage', 'model', 'frame_number', 'start_time', 'traced')
+    def __init__(self, profiler: 'StageProfiler', stage: str, model: str, frame_number: int|None = None):
+        self.profiler = profiler
+        self.stage = stage
+        self.model = model
+        self.frame_number = frame_number
+        self.start_time = 0.0
+        self.traced = False
+
+    def __enter__(self):
+        if self.profiler.enabled and self.profiler.synchronize:
+            synchronize_device()
+        self.traced = tracer.should_record(self.frame_number)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler.enabled and self.profiler.synchronize:
+            synchronize_device()
+        end_time = time.perf_counter()
+        self.profiler.record(self.stage, end_time - self.start_time, self.model)
+        if self.traced:
+            tracer.add_span(self.stage, 'stage', self.start_time, end_time, self.frame_number, {'model': self.model} if self.model else None)
+        return False
+
+class StageProfiler:
+    """
+    Rolling timings of the named stages of the frame processing (decode, detect, swap, restore, paste-back, encode...),
+    per stage and per model. The last window samples of every (stage, model) are kept, get_stats() gives their p50, p95,
+    max and mean. The time of a stage includes the stages nested in it (eg: detect includes landmark with landmark detection).
+    It is disabled by default, the instrumented code then only checks the enabled flag.
+    With synchronize, the GPU is synchronized at the start and end of every stage, so that the asynchronous CUDA work is
+    counted in the stage that queued it instead of the next one that waits for it. It slows the processing down a bit.
+    """
+    def __init__(self, window=300):
+        self.enabled = False
+        self.synchronize = False
+        self.window = window
+        self.samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+
+    def stage(self, stage: str, model: str = '', frame_number: int|None = None):
+        """
+        Context manager timing its block as stage, eg: 'with profiler.stage('enhance', enhancer_type):'. frame_number is
+        the frame of the trace span (default: the frame of the thread, see TraceRecorder.set_frame())
+        """
+        if not self.enabled and not tracer.recording:
+            return _null_context
+        return StageTimer(self, stage, model or '', frame_number)
+
+    def record(self, stage: str, seconds: float, model: str = ''):
+        if not self.enabled:
+            return
+        key = (stage, model or '')
+        with self.lock:
+            samples = self.samples.get(key)
+            if samples is None:
+                samples = self.samples[key] = deque(maxlen=self.window)
+                self.counts[key] = 0
+            samples.append(seconds)
+            self.counts[key] += 1
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+
+    def get_stats(self) -> List[dict]:
+        """One row per (stage, model) in the order of their first record, with the total count and the stats of the rolling window in ms"""
+        with self.lock:
+            snapshot = [(key, sorted(samples), self.counts[key]) for key, samples in self.samples.items()]
+        stats = []
+        for (stage, model), samples, count in snapshot:
+            if not samples:
+                continue
+            stats.append({
+                'stage': stage,
+                'model': model,
+                'count': count,
+                'p50_ms': get_percentile(samples, 50) * 1000,
+                'p95_ms': get_percentile(samples, 95) * 1000,
+                'max_ms': samples[-1] * 1000,
+                'mean_ms': sum(samples) / len(samples) * 1000,
+            })
+        return stats
+
+    def export_json(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8') as stats_file:
+            json.dump({'window': self.window, 'synchronize': self.synchronize, 'stages': self.get_stats()}, stats_file, indent=4)
+
+    def export_csv(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8', newline='') as stats_file:
+            writer = csv.DictWriter(stats_file, fieldnames=STATS_FIELDS)
+            writer.writeheader()
+            for row in self.get_stats():
+                writer.writerow({name: round(value, 3) if isinstance(value, float) else value for name, value in row.items()})
+
+    def export(self, file_path: str):
+        """Export the stats as CSV if file_path ends with .csv, as JSON otherwise"""
+        if file_path.lower().endswith('.csv'):
+            self.export_csv(file_path)
+        else:
+            self.export_json(file_path)
+
+    def print_stats(self):
+        for row in self.get_stats():
+            name = f"{row['stage']} ({row['model']})" if row['model'] else row['stage']
+            print(f"{name:<40} n={row['count']:<6} p50={row['p50_ms']:.1f} ms  p95={row['p95_ms']:.1f} ms  max={row['max_ms']:.1f} ms")
+
+def get_percentile(sorted_samples: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of the sorted samples"""
+    index = max(0, min(len(sorted_samples) - 1, math.ceil(percentile / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+def synchronize_device():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+_null_context = nullcontext()
+
+profiler = StageProfiler()
+
+def profile_stage(stage: str, model_arg: str|None = None, model: str = ''):
+    """
+    Decorator timing every call of the function as stage in the profiler (and the trace). The model of the stats is the value of the
+    model_arg argument of the call (or of its default), or the fixed model. When the profiler and the trace are disabled the function is called directly
+    """
+    def decorator(func):
+        signature = inspect.signature(func) if model_arg else None
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled and not tracer.recording:
+                return func(*args, **kwargs)
+            stage_model = model
+            if model_arg:
+                bound_args = signature.bind(*args, **kwargs)
+                bound_args.apply_defaults()
+                stage_model = str(bound_args.arguments.get(model_arg, ''))
+            with StageTimer(profiler, stage, stage_model):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
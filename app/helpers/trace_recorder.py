@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+from functools import wraps
+from typing import Dict, List
+
+import torch
+
+class TraceSpan:
+    """Context manager for one span of the trace, also pushed as an NVTX range when NVTX is used"""
+    __slots__ = ('recorder', 'name', 'category', 'frame_number', 'args', 'start_time', 'recorded')
+    def __init__(self, recorder: 'TraceRecorder', name: str, category: str, frame_number: int|None = None, args: dict|None = None):
+        self.recorder = recorder
+        self.name = name
+        self.category = category
+        self.frame_number = frame_number
+        self.args = args
+        self.start_time = 0.0
+        self.recorded = False
+
+    def __enter__(self):
+        if self.recorder.use_nvtx:
+            torch.cuda.nvtx.range_push(self.name)
+        self.recorded = self.recorder.should_record(self.frame_number)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.recorded:
+            self.recorder.add_span(self.name, self.category, self.start_time, time.perf_counter(), self.frame_number, self.args)
+        if self.recorder.use_nvtx:
+            torch.cuda.nvtx.range_pop()
+        return False
+
+class TraceRecorder:
+    """
+    Timeline of the frame processing as Chrome trace events (chrome://tracing, https://ui.perfetto.dev): model calls,
+    processing stages, lock waits, decode and encode, on the thread that ran them.
+    Only the spans of the frames from start_frame to end_frame are recorded. The frame of a span is the one given to it,
+    or the frame the thread is processing (set_frame()). The spans of the threads that don't process frames (eg: the GUI
+    thread) are recorded from the first frame of the range until a worker starts a frame after the range.
+    The spans are also pushed as NVTX ranges when CUDA is available, for Nsight Systems, whether recording or not.
+    """
+    def __init__(self, max_events=1000000):
+        self.recording = False
+        self.use_nvtx = torch.cuda.is_available()
+        self.start_frame = 0
+        self.end_frame: int|None = None
+        # Set once a frame of the range, then a frame after the range, started processing
+        self.range_started = False
+        self.range_ended = False
+        self.max_events = max_events
+        self.events: List[dict] = []
+        self.thread_names: Dict[int, str] = {}
+        self.dropped_events = 0
+        self.origin_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.thread_local = threading.local()
+
+    def start(self, start_frame=0, end_frame: int|None = None):
+        """Clear the trace and record the frames from start_frame to end_frame (inclusive, None: until stop())"""
+        with self.lock:
+            self.events = []
+            self.thread_names = {}
+            self.dropped_events = 0
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.range_started = False
+        self.range_ended = False
+        self.origin_time = time.perf_counter()
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def is_frame_in_range(self, frame_number: int) -> bool:
+        return frame_number >= self.start_frame and (self.end_frame is None or frame_number <= self.end_frame)
+
+    def set_frame(self, frame_number: int|None):
+        """Frame processed by the calling thread, the frame of its spans"""
+        self.thread_local.frame_number = frame_number
+        if not self.recording or frame_number is None:
+            return
+        if self.is_frame_in_range(frame_number):
+            self.range_started = True
+        elif self.end_frame is not None and frame_number > self.end_frame and self.range_started:
+            self.range_ended = True
+
+    def should_record(self, frame_number: int|None = None) -> bool:
+        if not self.recording:
+            return False
+        if frame_number is None:
+            frame_number = getattr(self.thread_local, 'frame_number', None)
+        if frame_number is None:
+            return self.range_started and not self.range_ended
+        return self.is_frame_in_range(frame_number)
+
+    def span(self, name: str, category='', frame_number: int|None = None, **args):
+        """Context manager recording its block as a span, eg: 'with tracer.span('encode', 'io', frame_number):'"""
+        if not self.recording and not self.use_nvtx:
+            return _null_context
+        return TraceSpan(self, name, category, frame_number, args or None)
+
+    def record(self, name: str, category: str, start_time: float, end_time: float, frame_number: int|None = None, **args):
+        """Record a span measured by the caller (time.perf_counter() times)"""
+        if self.should_record(frame_number):
+            self.add_span(name, category, start_time, end_time, frame_number, args or None)
+
+    def add_span(self, name: str, category: str, start_time: float, end_time: float, frame_number: int|None = None, args: dict|None = None):
+        thread_id = threading.get_native_id()
+        if frame_number is None:
+            frame_number = getattr(self.thread_local, 'frame_number', None)
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start_time - self.origin_time) * 1e6,
+            'dur': (end_time - start_time) * 1e6,
+            'pid': os.getpid(),
+            'tid': thread_id,
+        }
+        if frame_number is not None or args:
+            event['args'] = {'frame': frame_number, **(args or {})}
+        with self.lock:
+            if len(self.events) >= self.max_events:
+                self.dropped_events += 1
+                return
+            self.events.append(event)
+            if thread_id not in self.thread_names:
+                self.thread_names[thread_id] = threading.current_thread().name
+
+    def range_push(self, name: str, category=''):
+        """Start a span ended by range_pop() on the same thread, like torch.cuda.nvtx.range_push()"""
+        stack = getattr(self.thread_local, 'span_stack', None)
+        if stack is None:
+            stack = self.thread_local.span_stack = []
+        span = TraceSpan(self, name, category)
+        span.__enter__()
+        stack.append(span)
+
+    def range_pop(self):
+        self.thread_local.span_stack.pop().__exit__(None, None, None)
+
+    def get_trace(self) -> dict:
+        """The recorded spans in the Chrome trace event format"""
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+            dropped_events = self.dropped_events
+        metadata_events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': 'VisoMaster'}}]
+        for thread_id, thread_name in thread_names.items():
+            metadata_events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id, 'args': {'name': thread_name}})
+        return {
+            'traceEvents': metadata_events + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'start_frame': self.start_frame, 'end_frame': self.end_frame, 'dropped_events': dropped_events},
+        }
+
+    def save(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8') as trace_file:
+            json.dump(self.get_trace(), trace_file)
+
+_null_context = nullcontext()
+
+tracer = TraceRecorder()
+
+def trace_span(name: str|None = None, category='model'):
+    """Decorator recording every call of the function as a span of the trace, named after the function by default"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.recording and not tracer.use_nvtx:
+                return func(*args, **kwargs)
+            with TraceSpan(tracer, span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class TracedLock:
+    """
+    Wrapper of a Lock or RLock recording the time spent waiting for it as a 'wait <name>' span, when it is contended
+    while recording. It is used like the wrapped lock
+    """
+    def __init__(self, lock, name: str):
+        self.lock = lock
+        self.name = name
+
+    def acquire(self, blocking=True, timeout=-1) -> bool:
+        if not tracer.recording or not blocking:
+            return self.lock.acquire(blocking, timeout)
+        if self.lock.acquire(False):
+            return True
+        start_time = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        tracer.record(f'wait {self.name}', 'lock', start_time, time.perf_counter())
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
@@ -4,12 +4,13 @@ import platform
 
 import torch
 import numpy as np
-from torch.cuda import nvtx
 
 from torchvision import transforms
 from torchvision.transforms import v2
 
 from app.processors.models_data import models_dir
+from app.processors.tensor_arena import get_tensor_arena
+from app.helpers.trace_recorder import tracer
 from app.processors.utils import faceutil
 if TYPE_CHECKING:
     from app.processors.models_processor import ModelsProcessor
@@ -48,7 +49,7 @@ class FaceEditors:
                 I_s = torch.clamp(I_s, 0, 1)  # clamp to 0~1
                 I_s = torch.unsqueeze(I_s, 0).contiguous()
 
-                nvtx.range_push("forward")
+                tracer.range_push("forward")
 
                 feed_dict = {}
                 feed_dict["img"] = I_s
@@ -67,7 +68,7 @@ class FaceEditors:
                     'kp': preds_dict["kp"]
                 }
 
-                nvtx.range_pop()
+                tracer.range_pop()
 
             else:
                 if face_editor_type == 'Human-Face':
@@ -142,7 +143,7 @@ class FaceEditors:
                 I_s = torch.clamp(I_s, 0, 1)  # clamp to 0~1
                 I_s = torch.unsqueeze(I_s, 0).contiguous()
 
-                nvtx.range_push("forward")
+                tracer.range_push("forward")
 
                 feed_dict = {}
                 feed_dict["img"] = I_s
@@ -151,7 +152,7 @@ class FaceEditors:
 
                 output = preds_dict["output"]
 
-                nvtx.range_pop()
+                tracer.range_pop()
 
             else:
                 if face_editor_type == 'Human-Face':
@@ -197,7 +198,7 @@ class FaceEditors:
 
                 feat_eye = faceutil.concat_feat(kp_source, eye_close_ratio).contiguous()
 
-                nvtx.range_push("forward")
+                tracer.range_push("forward")
 
                 feed_dict = {}
                 feed_dict["input"] = feat_eye
@@ -206,7 +207,7 @@ class FaceEditors:
 
                 delta = preds_dict["output"]
 
-                nvtx.range_pop()
+                tracer.range_pop()
 
             else:
                 if face_editor_type == 'Human-Face':
@@ -248,7 +249,7 @@ class FaceEditors:
 
                 feat_lip = faceutil.concat_feat(kp_source, lip_close_ratio).contiguous()
 
-                nvtx.range_push("forward")
+                tracer.range_push("forward")
 
                 feed_dict = {}
                 feed_dict["input"] = feat_lip
@@ -257,7 +258,7 @@ class FaceEditors:
 
                 delta = preds_dict["output"]
 
-                nvtx.range_pop()
+                tracer.range_pop()
 
             else:
                 if face_editor_type == 'Human-Face':
@@ -299,7 +300,7 @@ class FaceEditors:
 
                 feat_stiching = faceutil.concat_feat(kp_source, kp_driving).contiguous()
 
-                nvtx.range_push("forward")
+                tracer.range_push("forward")
 
                 feed_dict = {}
                 feed_dict["input"] = feat_stiching
@@ -308,7 +309,7 @@ class FaceEditors:
 
                 delta = preds_dict["output"]
 
-                nvtx.range_pop()
+                tracer.range_pop()
 
             else:
                 if face_editor_type == 'Human-Face':
@@ -405,7 +406,7 @@ class FaceEditors:
                 kp_source = kp_source.contiguous()
                 kp_driving = kp_driving.contiguous()
 
-                nvtx.range_push("forward")
+                tracer.range_push("forward")
 
                 feed_dict = {}
                 feed_dict["feature_3d"] = feature_3d
@@ -418,7 +419,7 @@ class FaceEditors:
 
                 out = preds_dict["out"]
 
-                nvtx.range_pop()
+                tracer.range_pop()
             else:
                 if face_editor_type == 'Human-Face':
                     if not self.models_processor.models['LivePortraitWarpingSpade']:
@@ -495,13 +496,15 @@ class FaceEditors:
         temp = torch.div(img, 255)
         temp = v2.functional.normalize(temp, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
         temp = torch.reshape(temp, (1, 3, 512, 512))
-        outpred = torch.empty((1, 19, 512, 512), dtype=torch.float32, device=self.models_processor.device).contiguous()
+        arena = get_tensor_arena()
+        outpred_buffer = arena.borrow((1, 19, 512, 512), device=self.models_processor.device)
 
-        self.models_processor.run_faceparser(temp, outpred)
+        self.models_processor.run_faceparser(temp, outpred_buffer)
 
         # Perform parsing prediction
-        outpred = torch.squeeze(outpred)
+        outpred = torch.squeeze(outpred_buffer)
         outpred = torch.argmax(outpred, 0)
+        arena.give_back(outpred_buffer)
 
         # Clone the image for modifications
         out = img.clone()
@@ -7,6 +7,7 @@ from torchvision.transforms import v2
 
 from app.processors.external.clipseg import CLIPDensePredT
 from app.processors.models_data import models_dir
+from app.processors.tensor_arena import get_tensor_arena
 if TYPE_CHECKING:
     from app.processors.models_processor import ModelsProcessor
 
@@ -124,12 +125,14 @@ class FaceMasks:
         img = torch.div(img, 255)
         img = v2.functional.normalize(img, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
         img = torch.reshape(img, (1, 3, 512, 512))
-        outpred = torch.empty((1,19,512,512), dtype=torch.float32, device=self.models_processor.device).contiguous()
+        arena = get_tensor_arena()
+        outpred_buffer = arena.borrow((1,19,512,512), device=self.models_processor.device)
 
-        self.run_faceparser(img, outpred)
+        self.run_faceparser(img, outpred_buffer)
 
-        outpred = torch.squeeze(outpred)
+        outpred = torch.squeeze(outpred_buffer)
         outpred = torch.argmax(outpred, 0)
+        arena.give_back(outpred_buffer)
 
         face_attributes = {
             1: parameters['FaceParserSlider'], #Face
@@ -147,7 +150,7 @@ class FaceMasks:
         }
         
         # Pre-calculated kernel for dilation (3x3 kernel to reduce iterations)
-        kernel = torch.ones((1, 1, 3, 3), dtype=torch.float32, device=self.models_processor.device)  # Kernel 3x3
+        kernel = arena.get_constant((1, 1, 3, 3), 1.0, device=self.models_processor.device)  # Kernel 3x3
 
         face_parses = []
         for attribute, attribute_value in face_attributes.items():
@@ -176,7 +179,7 @@ class FaceMasks:
                     gauss = transforms.GaussianBlur(blur_kernel_size, (parameters['FaceBlurParserSlider'] + 1) * 0.2)
                     attribute_parse = gauss(attribute_parse)
             else:
-                attribute_parse = torch.ones((1, 512, 512), dtype=torch.float32, device=self.models_processor.device)
+                attribute_parse = arena.get_constant((1, 512, 512), 1.0, device=self.models_processor.device)
             face_parses.append(attribute_parse)
 
         # BG Parse
@@ -213,7 +216,7 @@ class FaceMasks:
 
         else:
             # If FaceAmount is 0, use a fully white mask
-            bg_parse = torch.ones((1, 512, 512), dtype=torch.float32, device=self.models_processor.device)
+            bg_parse = arena.get_constant((1, 512, 512), 1.0, device=self.models_processor.device)
 
         out_parse = bg_parse.squeeze(0)
         for face_parse in face_parses:
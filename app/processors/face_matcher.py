@@ -0,0 +1,84 @@
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+def normalize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(NxD unit embeddings, N valid): the embeddings with a zero or non finite norm are left as zeros and not valid"""
+    norms = np.linalg.norm(embeddings, axis=1)
+    valid = np.isfinite(norms) & (norms > 0)
+    normalized = np.zeros_like(embeddings)
+    normalized[valid] = embeddings[valid] / norms[valid, None]
+    return normalized, valid
+
+class FaceMatcher:
+    """
+    Similarities of the detected faces with the target faces, on the scale of ModelsProcessor.findCosineDistance()
+    (100: same embedding). The normalized embeddings of the target faces are kept as one matrix per recognition model,
+    built again only when the target faces or their embeddings change, so that the similarities of all the faces of a
+    frame are one matrix product
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Per recognition model: ((face_id, embedding) of the target faces of the matrix, TxD normalized embeddings, T valid)
+        self.target_matrices: Dict[str, Tuple[List[Tuple[str, np.ndarray]], np.ndarray, np.ndarray]] = {}
+
+    def get_target_matrix(self, target_faces: dict, recognition_model: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """(face ids, TxD normalized embeddings, T valid) of the target faces, in the order of target_faces"""
+        target_embeddings = [(face_id, target_face.get_embedding(recognition_model)) for face_id, target_face in target_faces.items()]
+        face_ids = [face_id for face_id, _ in target_embeddings]
+        with self.lock:
+            cached = self.target_matrices.get(recognition_model)
+        # The embeddings of a target face are replaced, not modified, when it changes
+        if cached is not None and len(cached[0]) == len(target_embeddings) and all(
+                face_id == cached_face_id and embedding is cached_embedding
+                for (face_id, embedding), (cached_face_id, cached_embedding) in zip(target_embeddings, cached[0])):
+            return face_ids, cached[1], cached[2]
+
+        sizes = [np.size(embedding) for _, embedding in target_embeddings]
+        dim = max(sizes, default=0)
+        embeddings = np.zeros((len(target_embeddings), dim), dtype=np.float32)
+        for i, (_, embedding) in enumerate(target_embeddings):
+            # The target faces without an embedding of the model never match
+            if sizes[i] == dim:
+                embeddings[i] = np.ravel(embedding)
+        matrix, valid = normalize_embeddings(embeddings)
+        with self.lock:
+            self.target_matrices[recognition_model] = (target_embeddings, matrix, valid)
+        return face_ids, matrix, valid
+
+    def get_similarities(self, embeddings: List[np.ndarray], target_faces: dict, recognition_model: str) -> Tuple[List[str], np.ndarray]:
+        """(face ids of the target faces, NxT similarities of the N embeddings with the target faces, -inf when they can't be compared)"""
+        face_ids, matrix, valid = self.get_target_matrix(target_faces, recognition_model)
+        similarities = np.full((len(embeddings), len(face_ids)), -np.inf, dtype=np.float32)
+        if len(embeddings) == 0 or len(face_ids) == 0:
+            return face_ids, similarities
+        faces = np.stack([np.ravel(embedding) for embedding in embeddings]).astype(np.float32)
+        if faces.shape[1] != matrix.shape[1]:
+            return face_ids, similarities
+        faces, faces_valid = normalize_embeddings(faces)
+        cos_sims = faces @ matrix.T
+        similarities = np.where(faces_valid[:, None] & valid[None, :], 100 - (1 - cos_sims) * 50, similarities)
+        return face_ids, similarities
+
+    @staticmethod
+    def match_faces(similarities: np.ndarray, thresholds: np.ndarray, one_to_one=False) -> np.ndarray:
+        """
+        NxT matches of the faces with the target faces, the similarities at or above the T thresholds of the target faces.
+        With one_to_one, a face matches one target face at most and a target face one face at most: the pairs are
+        assigned by decreasing similarity
+        """
+        matches = similarities >= thresholds[None, :]
+        if not one_to_one or not matches.any():
+            return matches
+        face_indexes, target_indexes = np.nonzero(matches)
+        order = np.argsort(-similarities[face_indexes, target_indexes], kind='stable')
+        assigned = np.zeros_like(matches)
+        assigned_faces = set()
+        assigned_targets = set()
+        for face_index, target_index in zip(face_indexes[order], target_indexes[order]):
+            if face_index not in assigned_faces and target_index not in assigned_targets:
+                assigned[face_index, target_index] = True
+                assigned_faces.add(face_index)
+                assigned_targets.add(target_index)
+        return assigned
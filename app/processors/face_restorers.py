@@ -6,6 +6,8 @@ import numpy as np
 from torchvision.transforms import v2
 from skimage import transform as trans
 
+from app.processors.tensor_arena import get_tensor_arena
+
 if TYPE_CHECKING:
     from app.processors.models_processor import ModelsProcessor
 
@@ -55,8 +57,11 @@ class FaceRestorers:
 
         temp = torch.unsqueeze(temp, 0).contiguous()
 
-        # Bindings
-        outpred = torch.empty((1,3,512,512), dtype=torch.float32, device=self.models_processor.device).contiguous()
+        # Bindings. The output is borrowed from the arena of the worker
+        outpred_size = {'GPEN-256': 256, 'GPEN-1024': 1024, 'GPEN-2048': 2048}.get(restorer_type, 512)
+        arena = get_tensor_arena()
+        outpred_buffer = arena.borrow((1, 3, outpred_size, outpred_size), device=self.models_processor.device)
+        outpred = outpred_buffer
 
         if restorer_type == 'GFPGAN-v1.4':
             self.run_GFPGAN(temp, outpred)
@@ -65,7 +70,6 @@ class FaceRestorers:
             self.run_codeformer(temp, outpred, fidelity_weight)
 
         elif restorer_type == 'GPEN-256':
-            outpred = torch.empty((1,3,256,256), dtype=torch.float32, device=self.models_processor.device).contiguous()
             self.run_GPEN_256(temp, outpred)
 
         elif restorer_type == 'GPEN-512':
@@ -73,12 +77,10 @@ class FaceRestorers:
 
         elif restorer_type == 'GPEN-1024':
             temp = t1024(temp)
-            outpred = torch.empty((1, 3, 1024, 1024), dtype=torch.float32, device=self.models_processor.device).contiguous()
             self.run_GPEN_1024(temp, outpred)
 
         elif restorer_type == 'GPEN-2048':
             temp = t2048(temp)
-            outpred = torch.empty((1, 3, 2048, 2048), dtype=torch.float32, device=self.models_processor.device).contiguous()
             self.run_GPEN_2048(temp, outpred)
 
         elif restorer_type == 'RestoreFormer++':
@@ -90,6 +92,7 @@ class FaceRestorers:
         # Format back to cxHxW @ 255
         outpred = torch.squeeze(outpred)
         outpred = torch.clamp(outpred, -1, 1)
+        arena.give_back(outpred_buffer)
         outpred = torch.add(outpred, 1)
         outpred = torch.div(outpred, 2)
         outpred = torch.mul(outpred, 255)
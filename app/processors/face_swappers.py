@@ -5,7 +5,8 @@ from app.processors.utils import faceutil
 import numpy as np
 from numpy.linalg import norm as l2norm
 import onnx
-from typing import TYPE_CHECKING
+import onnxruntime
+from typing import TYPE_CHECKING, Dict
 if TYPE_CHECKING:
     from app.processors.models_processor import ModelsProcessor
 from app.helpers.downloader import download_file
@@ -13,6 +14,11 @@ from app.helpers.miscellaneous import is_file_exists
 class FaceSwappers:
     def __init__(self, models_processor: 'ModelsProcessor'):
         self.models_processor = models_processor
+        # Variants of the recognition models running a batch of faces, None for the models that can't (see get_batched_model())
+        self.batched_models: Dict[str, onnxruntime.InferenceSession|None] = {}
+
+    def delete_models(self):
+        self.batched_models.clear()
 
     def run_recognize_direct(self, img, kps, similarity_type='Opal', arcface_model='Inswapper128ArcFace'):
         if not self.models_processor.models[arcface_model]:
@@ -25,6 +31,103 @@ class FaceSwappers:
 
         return embedding, cropped_image
         
+    def run_recognize_batch(self, img, kpss, similarity_type='Opal', arcface_model='Inswapper128ArcFace') -> np.ndarray:
+        """
+        NxD embeddings of the faces of img with the Nx5x2 keypoints kpss, the embeddings of run_recognize_direct() for
+        each face: the crops of all the faces are warped at once and run through the model as one batch
+        """
+        if not self.models_processor.models[arcface_model]:
+            self.models_processor.models[arcface_model] = self.models_processor.load_model(arcface_model)
+
+        if len(kpss) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        if arcface_model == 'CSCSArcFace':
+            # The embedding adds the one of the ID adapter model, the faces are recognized one by one
+            return np.stack([self.recognize_cscs(img, kps)[0] for kps in kpss])
+
+        kpss = np.asarray(kpss, dtype=np.float32)
+        if similarity_type == 'Optimal':
+            Ms = np.stack([faceutil.estimate_norm(kps, 112, mode='arcfacemap')[0] for kps in kpss])
+            imgs = faceutil.warp_faces_by_transforms(img, Ms, 112, interpolation=v2.InterpolationMode.BILINEAR)
+        elif similarity_type == 'Pearl':
+            dst = self.models_processor.arcface_dst.copy()
+            dst[:, 0] += 8.0
+            Ms = faceutil.estimate_similarity_transforms(kpss, dst)
+            imgs = faceutil.warp_faces_by_transforms(img, Ms, 128)
+            imgs = v2.Resize((112, 112), interpolation=v2.InterpolationMode.BILINEAR, antialias=False)(imgs)
+        else:
+            Ms = faceutil.estimate_similarity_transforms(kpss, self.models_processor.arcface_dst)
+            imgs = faceutil.warp_faces_by_transforms(img, Ms, 112)
+
+        imgs = self.normalize_arcface_input(arcface_model, imgs).contiguous()
+        model = self.models_processor.models[arcface_model]
+        input_name = model.get_inputs()[0].name
+        output_names = [o.name for o in model.get_outputs()]
+
+        if len(imgs) > 1:
+            batched_model = self.get_batched_model(arcface_model, input_name, output_names, imgs)
+            if batched_model is not None:
+                return self.run_arcface_session(batched_model, input_name, output_names, imgs)
+        return np.concatenate([self.run_arcface_session(model, input_name, output_names, imgs[i:i+1]) for i in range(len(imgs))])
+
+    def run_arcface_session(self, model: onnxruntime.InferenceSession, input_name: str, output_names: list, imgs: torch.Tensor) -> np.ndarray:
+        """NxD embeddings of the NxCxHxW normalized crops"""
+        io_binding = model.io_binding()
+        io_binding.bind_input(name=input_name, device_type=self.models_processor.device, device_id=0, element_type=np.float32,  shape=imgs.size(), buffer_ptr=imgs.data_ptr())
+        for output_name in output_names:
+            io_binding.bind_output(output_name, self.models_processor.device)
+
+        # Sync and run model
+        if self.models_processor.device == "cuda":
+            torch.cuda.synchronize()
+        elif self.models_processor.device != "cpu":
+            self.models_processor.syncvec.cpu()
+        model.run_with_iobinding(io_binding)
+
+        return io_binding.copy_outputs_to_cpu()[0].reshape(len(imgs), -1).astype(np.float32, copy=False)
+
+    def get_batched_model(self, arcface_model: str, input_name: str, output_names: list, imgs: torch.Tensor) -> onnxruntime.InferenceSession|None:
+        """
+        Variant of the recognition model that runs a batch of faces, or None when the model can't, checked once against
+        the embeddings of the model for the first faces (see ModelsProcessor.create_batched_model())
+        """
+        if arcface_model in self.batched_models:
+            return self.batched_models[arcface_model]
+        with self.models_processor.model_lock:
+            if arcface_model in self.batched_models:
+                return self.batched_models[arcface_model]
+            try:
+                batched_model = self.models_processor.create_batched_model(arcface_model, input_name)
+                model = self.models_processor.models[arcface_model]
+                expected_embeddings = np.concatenate([self.run_arcface_session(model, input_name, output_names, imgs[i:i+1]) for i in range(2)])
+                embeddings = self.run_arcface_session(batched_model, input_name, output_names, imgs[:2])
+                if embeddings.shape != expected_embeddings.shape or not np.allclose(embeddings, expected_embeddings, rtol=1e-2, atol=1e-2):
+                    raise ValueError("the batch embeddings differ from the embeddings of single faces")
+            except Exception as e: # pylint: disable=broad-exception-caught
+                print(f"{arcface_model} can't run batches, the faces are recognized one by one: {e}")
+                batched_model = None
+            self.batched_models[arcface_model] = batched_model
+            return batched_model
+
+    def normalize_arcface_input(self, arcface_model, img):
+        """Input of the recognition model from the CxHxW or NxCxHxW crops"""
+        if arcface_model == 'Inswapper128ArcFace':
+            if img.dtype == torch.uint8:
+                img = img.to(torch.float32)  # Convert to float32 if uint8
+            img = torch.sub(img, 127.5)
+            img = torch.div(img, 127.5)
+        elif arcface_model == 'SimSwapArcFace':
+            if img.dtype == torch.uint8:
+                img = torch.div(img.to(torch.float32), 255.0)
+            img = v2.functional.normalize(img, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225), inplace=False)
+        else:
+            if img.dtype == torch.uint8:
+                img = img.to(torch.float32)  # Convert to float32 if uint8
+            # Normalize
+            img = torch.div(img, 127.5)
+            img = torch.sub(img, 1)
+        return img
+
     def run_recognize(self, img, kps, similarity_type='Opal', face_swapper_model='Inswapper128'):
         arcface_model = self.models_processor.get_arcface_model(face_swapper_model)
         return self.run_recognize_direct(img, kps, similarity_type, arcface_model)
@@ -54,24 +157,8 @@ class FaceSwappers:
             img = v2.functional.affine(img, tform.rotation*57.2958, (tform.translation[0], tform.translation[1]) , tform.scale, 0, center = (0,0) )
             img = v2.functional.crop(img, 0,0, 112, 112)
 
-        if arcface_model == 'Inswapper128ArcFace':
-            cropped_image = img.permute(1, 2, 0).clone()
-            if img.dtype == torch.uint8:
-                img = img.to(torch.float32)  # Convert to float32 if uint8
-            img = torch.sub(img, 127.5)
-            img = torch.div(img, 127.5)
-        elif arcface_model == 'SimSwapArcFace':
-            cropped_image = img.permute(1, 2, 0).clone()
-            if img.dtype == torch.uint8:
-                img = torch.div(img.to(torch.float32), 255.0)
-            img = v2.functional.normalize(img, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225), inplace=False)
-        else:
-            cropped_image = img.permute(1,2,0).clone() #112,112,3
-            if img.dtype == torch.uint8:
-                img = img.to(torch.float32)  # Convert to float32 if uint8
-            # Normalize
-            img = torch.div(img, 127.5)
-            img = torch.sub(img, 1)
+        cropped_image = img.permute(1,2,0).clone() #112,112,3
+        img = self.normalize_arcface_input(arcface_model, img)
 
         # Prepare data and find model parameters
         img = torch.unsqueeze(img, 0).contiguous()
@@ -0,0 +1,148 @@
+import threading
+from typing import TYPE_CHECKING, List
+
+import numpy as np
+import torch
+
+if TYPE_CHECKING:
+    from app.processors.models_processor import ModelsProcessor
+
+# Controls the detected faces depend on: the tracks are dropped when one of them changes
+TRACKING_CONTROLS = (
+    'DetectorModelSelection', 'DetectorScoreSlider', 'MaxFacesToDetectSlider', 'AutoRotationToggle',
+    'ManualRotationEnableToggle', 'ManualRotationAngleSlider', 'LandmarkDetectToggle', 'LandmarkDetectModelSelection',
+    'LandmarkDetectScoreSlider', 'DetectFromPointsToggle', 'SimilarityTypeSelection', 'RecognitionModelSelection',
+)
+
+def get_face_size(kps_5: np.ndarray) -> float:
+    return max(float(np.ptp(kps_5[:, 0])), float(np.ptp(kps_5[:, 1])), 1.0)
+
+def get_thumbnail(img: torch.Tensor) -> torch.Tensor:
+    """Small grayscale version of the CxHxW frame, compared between frames to find the scene cuts"""
+    thumbnail = torch.nn.functional.interpolate(img.unsqueeze(0).to(torch.float32), size=(36, 64), mode='area')
+    return thumbnail.mean(dim=1).squeeze(0)
+
+class FaceTrack:
+    """A face followed across frames: its last keypoints and box, and the embedding of the frame it was detected in"""
+    def __init__(self, bbox: np.ndarray, kps_5: np.ndarray, kps_all: np.ndarray, embedding: np.ndarray, frame_number: int, velocity: np.ndarray|None = None):
+        self.bbox = bbox
+        self.kps_5 = kps_5
+        self.kps_all = kps_all
+        self.embedding = embedding
+        self.frame_number = frame_number
+        # Motion of the keypoints per frame, to predict where the face is in the next frames
+        self.velocity = velocity if velocity is not None else np.zeros(2, dtype=np.float32)
+
+    def get_face_data(self) -> dict:
+        """Entry of the det_faces_data of FrameWorker. The keypoints are copies, since they are adjusted in place"""
+        return {'kps_5': self.kps_5.copy(), 'kps_all': self.kps_all.copy(), 'embedding': self.embedding, 'bbox': self.bbox.copy()}
+
+class FaceTracker:
+    """
+    Follows the detected faces across the frames of a video, so that most frames don't run the face detector and
+    the recognition model. The faces of a tracked frame are found by the landmark detector in the region predicted from
+    the previous frames, and keep the embedding of the frame they were detected in.
+    The full detection runs every detect_interval frames, on scene cuts, when a face was lost or moved/resized more than
+    the landmark detection can be trusted for, when the frames aren't consecutive (seeking) and when the detection
+    settings change. The tracker is shared by the FrameWorkers of one video, the frames can be processed out of order by
+    a few frames. The renderers that can run at the same time (VideoRenderer) have their own tracker
+    """
+    max_frame_gap = 4
+    def __init__(self, models_processor: 'ModelsProcessor'):
+        self.models_processor = models_processor
+        self.lock = threading.Lock()
+        self.tracks: List[FaceTrack] = []
+        self.tracking_key = None
+        self.frame_number: int|None = None # Frame of the tracks
+        self.detect_frame_number: int|None = None # Last frame processed with the full detection
+        self.thumbnail: torch.Tensor|None = None
+
+    def reset(self):
+        with self.lock:
+            self.tracks = []
+            self.tracking_key = None
+            self.frame_number = None
+            self.detect_frame_number = None
+            self.thumbnail = None
+
+    @staticmethod
+    def get_tracking_key(img: torch.Tensor, control: dict, is_edit_faces_enabled: bool, media_path: str) -> tuple:
+        return (media_path, tuple(img.shape), is_edit_faces_enabled) + tuple(control[name] for name in TRACKING_CONTROLS)
+
+    def track_faces(self, img: torch.Tensor, frame_number: int, control: dict, tracking_key: tuple, landmark_detect_mode: str, landmark_score: float, use_landmark_detection: bool) -> List[dict]|None:
+        """
+        det_faces_data of the frame from the tracks of the previous frames, or None when the frame must be processed
+        with the full detection (then call start_tracks() with its faces)
+        """
+        with self.lock:
+            if (tracking_key != self.tracking_key or not self.tracks or self.frame_number is None
+                    or not 0 < frame_number - self.frame_number <= self.max_frame_gap
+                    or frame_number - self.detect_frame_number >= control['FaceTrackingDetectIntervalSlider']):
+                return None
+            tracks = self.tracks
+            frame_gap = frame_number - self.frame_number
+            previous_thumbnail = self.thumbnail
+
+        thumbnail = get_thumbnail(img)
+        if torch.mean(torch.abs(thumbnail - previous_thumbnail)).item() > control['FaceTrackingSceneCutSlider']:
+            return None
+
+        min_confidence = control['FaceTrackingMinConfidenceSlider'] / 100.0
+        new_tracks = []
+        for track in tracks:
+            new_track = self.update_track(track, img, frame_number, frame_gap, landmark_detect_mode, landmark_score, use_landmark_detection, min_confidence)
+            if new_track is None:
+                return None
+            new_tracks.append(new_track)
+
+        with self.lock:
+            if tracking_key == self.tracking_key and self.frame_number is not None and frame_number > self.frame_number:
+                self.tracks = new_tracks
+                self.frame_number = frame_number
+                self.thumbnail = thumbnail
+        return [track.get_face_data() for track in new_tracks]
+
+    def update_track(self, track: FaceTrack, img: torch.Tensor, frame_number: int, frame_gap: int, landmark_detect_mode: str, landmark_score: float, use_landmark_detection: bool, min_confidence: float) -> FaceTrack|None:
+        """The track moved to the frame by the landmark detector, or None when the face was lost"""
+        offset = track.velocity * frame_gap
+        predicted_kps_5 = track.kps_5 + offset
+        predicted_bbox = track.bbox + np.tile(offset, 2)
+        kps_5, kps_all, _ = self.models_processor.run_detect_landmark(img, predicted_bbox, predicted_kps_5, landmark_detect_mode, landmark_score, from_points=True)
+        if len(kps_5) == 0:
+            return None
+        kps_5 = np.asarray(kps_5, dtype=np.float32)
+
+        # Confidence of the track: the landmarks of a lost face drift away from the prediction or collapse
+        face_size = get_face_size(track.kps_5)
+        size_ratio = get_face_size(kps_5) / face_size
+        shift = float(np.linalg.norm(kps_5.mean(axis=0) - predicted_kps_5.mean(axis=0))) / face_size
+        confidence = max(0.0, 1.0 - shift) * min(size_ratio, 1.0 / size_ratio)
+        if confidence < min_confidence:
+            return None
+
+        center = kps_5.mean(axis=0)
+        velocity = (center - track.kps_5.mean(axis=0)) / frame_gap
+        half_size = (track.bbox[2:] - track.bbox[:2]) / 2 * size_ratio
+        bbox_center = (track.bbox[:2] + track.bbox[2:]) / 2 + (center - track.kps_5.mean(axis=0))
+        bbox = np.concatenate((bbox_center - half_size, bbox_center + half_size)).astype(np.float32)
+        if use_landmark_detection and len(kps_all) > 0:
+            kps_all = np.asarray(kps_all)
+        else:
+            kps_all = kps_5.copy()
+        return FaceTrack(bbox, kps_5, kps_all, track.embedding, frame_number, velocity.astype(np.float32))
+
+    def start_tracks(self, img: torch.Tensor, frame_number: int, det_faces_data: List[dict], tracking_key: tuple):
+        """Start tracking the faces of a frame processed with the full detection"""
+        tracks = [FaceTrack(np.asarray(face['bbox'], dtype=np.float32).copy(), face['kps_5'].copy(), np.copy(face['kps_all']), face['embedding'], frame_number)
+                  for face in det_faces_data]
+        thumbnail = get_thumbnail(img)
+        with self.lock:
+            # A frame processed late by another worker doesn't replace the tracks of the frames after it
+            if (tracking_key == self.tracking_key and self.frame_number is not None
+                    and 0 < self.frame_number - frame_number <= self.max_frame_gap):
+                return
+            self.tracks = tracks
+            self.tracking_key = tracking_key
+            self.frame_number = frame_number
+            self.detect_frame_number = frame_number
+            self.thumbnail = thumbnail
@@ -0,0 +1,81 @@
+import math
+import time
+from typing import Dict
+
+class FramePacer:
+    """
+    Closed-loop pacing of the video playback.
+    The frames are displayed on a fixed schedule at target_fps. The number of frames allowed in flight (read but not
+    displayed yet) follows the measured worker latency (Little's law: latency * fps frames are needed to keep up),
+    capped by max_in_flight to bound the latency. Since a new frame is only read when a frame leaves the pipeline,
+    the read rate follows the display rate instead of a fixed timer interval.
+    """
+    # Weight of the newest measurement in the moving averages
+    smoothing = 0.1
+
+    def __init__(self, target_fps=30.0, max_in_flight=4):
+        self.target_fps = target_fps
+        self.max_in_flight = max_in_flight
+        self.frames_in_flight = 1
+        self.submit_times: Dict[int, float] = {}
+        self.next_display_time = 0.0
+        self.last_display_time = 0.0
+        # Measurements (in seconds), exposed for the UI and the logs
+        self.decode_latency = 0.0
+        self.worker_latency = 0.0
+        self.pipeline_latency = 0.0
+        self.display_interval = 0.0
+
+    @property
+    def frame_interval(self) -> float:
+        return 1.0 / self.target_fps if self.target_fps > 0 else 1.0 / 30
+
+    @property
+    def display_fps(self) -> float:
+        return 1.0 / self.display_interval if self.display_interval > 0 else 0.0
+
+    def reset(self, target_fps: float, max_in_flight: int):
+        self.target_fps = target_fps
+        self.max_in_flight = max(1, max_in_flight)
+        self.frames_in_flight = self.max_in_flight
+        self.submit_times.clear()
+        self.next_display_time = 0.0
+        self.last_display_time = 0.0
+        self.decode_latency = 0.0
+        self.worker_latency = 0.0
+        self.pipeline_latency = 0.0
+        self.display_interval = 0.0
+
+    def update_average(self, average: float, value: float) -> float:
+        return value if average == 0.0 else average + self.smoothing * (value - average)
+
+    def can_submit(self, in_flight: int) -> bool:
+        return in_flight < self.frames_in_flight
+
+    def on_submitted(self, frame_number: int, decode_time=0.0):
+        self.submit_times[frame_number] = time.perf_counter()
+        self.decode_latency = decode_time
+
+    def on_completed(self, frame_number: int):
+        submit_time = self.submit_times.get(frame_number)
+        if submit_time is None:
+            return
+        self.worker_latency = self.update_average(self.worker_latency, time.perf_counter() - submit_time)
+        frames_needed = math.ceil(self.worker_latency / self.frame_interval) + 1
+        self.frames_in_flight = max(1, min(frames_needed, self.max_in_flight))
+
+    def is_display_due(self) -> bool:
+        return time.perf_counter() >= self.next_display_time
+
+    def on_displayed(self, frame_number: int):
+        now = time.perf_counter()
+        submit_time = self.submit_times.pop(frame_number, None)
+        if submit_time is not None:
+            self.pipeline_latency = self.update_average(self.pipeline_latency, now - submit_time)
+        if self.last_display_time:
+            self.display_interval = self.update_average(self.display_interval, now - self.last_display_time)
+        self.last_display_time = now
+        self.next_display_time += self.frame_interval
+        if self.next_display_time <= now:
+            # The frame was late. Restart the schedule from now instead of showing the next frames in a burst
+            self.next_display_time = now + self.frame_interval
@@ -0,0 +1,108 @@
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+
+class FrameTransfer:
+    """
+    Host<->device transfers of HxWx3 uint8 frames. It is not thread safe, use the instance of the thread (get_frame_transfer()).
+    The copies go through pools of pinned host buffers and a device buffer per resolution, with non blocking copies.
+    The channel order swap (BGR<->RGB) is done on the device: an RGB view of a BGR frame (frame[..., ::-1]) is uploaded
+    in its memory order and flipped on the device, and downloads are flipped and made HxWxC contiguous before the copy.
+    Each frame crosses the bus once in each direction, with at most one host copy into or out of pinned memory
+    (none for uploads of frames decoded into allocate_host_frame() buffers).
+    """
+    # Pinned buffers kept per resolution and direction, enough for the uploads that are in flight at the same time
+    max_host_buffers = 2
+
+    def __init__(self, device):
+        self.device = torch.device(device)
+        self.use_cuda = self.device.type == 'cuda' and torch.cuda.is_available()
+        # Key: (direction, shape). Value: [pinned buffer, event recorded after its last copy]
+        self.host_buffers: Dict[Tuple[str, Tuple[int, ...]], List[list]] = {}
+        self.device_buffers: Dict[Tuple[int, ...], torch.Tensor] = {}
+
+    def get_host_buffer(self, direction: str, shape: Tuple[int, ...]) -> list:
+        buffers = self.host_buffers.setdefault((direction, shape), [])
+        for host_buffer in buffers:
+            if host_buffer[1].query():
+                return host_buffer
+        if len(buffers) < self.max_host_buffers:
+            host_buffer = [torch.empty(shape, dtype=torch.uint8, pin_memory=True), torch.cuda.Event()]
+            buffers.append(host_buffer)
+            return host_buffer
+        # All the buffers are in use, wait for the oldest copy
+        host_buffer = buffers.pop(0)
+        buffers.append(host_buffer)
+        host_buffer[1].synchronize()
+        return host_buffer
+
+    def get_device_buffer(self, shape: Tuple[int, ...]) -> torch.Tensor:
+        device_buffer = self.device_buffers.get(shape)
+        if device_buffer is None:
+            device_buffer = self.device_buffers[shape] = torch.empty(shape, dtype=torch.uint8, device=self.device)
+        return device_buffer
+
+    def upload(self, frame: np.ndarray, swap_channels=False) -> torch.Tensor:
+        """Copy the HxWx3 frame to the device and return it as a new uint8 CxHxW tensor, with the channels reversed if swap_channels"""
+        if frame.dtype != np.uint8:
+            frame = frame.astype(np.uint8)
+        if frame.strides[2] < 0:
+            # frame[..., ::-1] view: upload the frame in its memory order and swap the channels on the device instead
+            frame = frame[..., ::-1]
+            swap_channels = not swap_channels
+        frame = np.ascontiguousarray(frame)
+        if not self.use_cuda:
+            img = torch.from_numpy(frame).to(self.device).permute(2, 0, 1)
+            # The tensor can share the memory of the frame (eg a decode buffer), the flip or clone makes the copy
+            return img.flip(0) if swap_channels else img.clone()
+
+        host_frame = torch.from_numpy(frame)
+        event = None
+        if not host_frame.is_pinned():
+            host_buffer, event = self.get_host_buffer('upload', frame.shape)
+            np.copyto(host_buffer.numpy(), frame)
+            host_frame = host_buffer
+        device_buffer = self.get_device_buffer(frame.shape)
+        device_buffer.copy_(host_frame, non_blocking=True)
+        if event is not None:
+            event.record()
+        # The result is a new tensor, so the device buffer can be reused by the next upload (the copies are ordered on the stream)
+        img = device_buffer.permute(2, 0, 1)
+        return img.flip(0) if swap_channels else img.clone()
+
+    def download(self, img: torch.Tensor, swap_channels=False) -> np.ndarray:
+        """Copy the uint8 CxHxW tensor to the host and return it as a contiguous HxWx3 frame, with the channels reversed if swap_channels"""
+        if swap_channels:
+            img = img.flip(0)
+        img = img.permute(1, 2, 0).contiguous()
+        if not self.use_cuda or img.device.type != 'cuda':
+            return img.cpu().numpy()
+        host_buffer, event = self.get_host_buffer('download', tuple(img.shape))
+        host_buffer.copy_(img, non_blocking=True)
+        event.record()
+        event.synchronize()
+        # The pinned buffer is reused, so the frame is copied out of it. Handing out pinned memory instead would pin the
+        # frames held by the reorder buffer and the processed frame cache
+        frame = np.empty(tuple(img.shape), dtype=np.uint8)
+        np.copyto(frame, host_buffer.numpy())
+        return frame
+
+def allocate_host_frame(shape: Tuple[int, ...]) -> np.ndarray:
+    """Empty uint8 frame, in pinned memory when CUDA is available, so that FrameTransfer.upload() copies it to the device directly"""
+    if torch.cuda.is_available():
+        return torch.empty(shape, dtype=torch.uint8, pin_memory=True).numpy()
+    return np.empty(shape, dtype=np.uint8)
+
+_thread_local = threading.local()
+
+def get_frame_transfer(device) -> FrameTransfer:
+    """FrameTransfer of the calling thread for device"""
+    frame_transfers = getattr(_thread_local, 'frame_transfers', None)
+    if frame_transfers is None:
+        frame_transfers = _thread_local.frame_transfers = {}
+    frame_transfer = frame_transfers.get(str(device))
+    if frame_transfer is None:
+        frame_transfer = frame_transfers[str(device)] = FrameTransfer(device)
+    return frame_transfer
@@ -0,0 +1,111 @@
+import time
+import queue
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+
+import numpy
+
+from app.processors.workers.frame_worker import FrameWorker
+import app.helpers.miscellaneous as misc_helpers
+from app.helpers.stage_profiler import profiler, profile_stage
+
+if TYPE_CHECKING:
+    from app.processors.render_session import RenderSession
+
+class ImageBatchRenderer:
+    """
+    Processes a batch of still images through the ModelsProcessor of a RenderSession, without Qt.
+    The images are decoded by a pool of decode threads, at most lookahead images ahead of the frame workers
+    (num_workers threads, each with its own FrameWorker), and saved with get_output_file_path(..., media_type='image') naming.
+    """
+    def __init__(self, session: 'RenderSession', num_workers=2, num_decode_threads=4, lookahead: int|None = None):
+        self.session = session
+        self.num_workers = max(1, num_workers)
+        self.num_decode_threads = max(1, num_decode_threads)
+        self.lookahead = lookahead or 2 * (self.num_workers + self.num_decode_threads)
+        self.local = threading.local()
+        self.processing_time = 0.0
+
+    def get_frame_worker(self) -> FrameWorker:
+        # One FrameWorker per worker thread, since it holds the state of the frame being processed
+        if not hasattr(self.local, 'frame_worker'):
+            self.local.frame_worker = FrameWorker(self.session)
+        return self.local.frame_worker
+
+    def process_frame(self, frame: numpy.ndarray) -> numpy.ndarray:
+        """Process a single RGB image and return the BGR output image"""
+        frame_worker = self.get_frame_worker()
+        parameters, control = self.session.get_state_for_frame(0)
+        frame_worker.frame = frame
+        frame_worker.frame_number = 0
+        frame_worker.load_state(parameters, control, swap_faces=self.session.swap_faces, edit_faces=self.session.edit_faces)
+        return frame_worker.render_frame()
+
+    @staticmethod
+    @profile_stage('decode')
+    def decode_image(image_path: str) -> numpy.ndarray|None:
+        return misc_helpers.read_image_file(image_path)
+
+    def process_image(self, image_path: str, image: numpy.ndarray|None, output_folder: str) -> str|None:
+        """Process the decoded BGR image and save it. Return the output file path, or None on failure"""
+        if image is None:
+            return None
+        try:
+            frame = self.process_frame(image[..., ::-1])  # Convert BGR to RGB
+            output_file_path = misc_helpers.get_output_file_path(image_path, output_folder, media_type='image')
+            with profiler.stage('encode'):
+                written = misc_helpers.write_image_file(output_file_path, frame)
+            if not written:
+                print(f"Failed to write {output_file_path}")
+                return None
+            return output_file_path
+        except Exception as e: # pylint: disable=broad-exception-caught
+            print(f"Failed to process {image_path}: {e}")
+            traceback.print_exc()
+            return None
+
+    def render(self, image_paths: List[str], output_folder: str, skip_existing=True, progress_callback: Callable[[int, int], None]|None = None) -> Dict[str, int]:
+        """
+        Process the images and save the results in output_folder. With skip_existing, the images that already have an
+        output file in output_folder are not processed again. Return the number of processed, skipped and failed images
+        """
+        batch = []
+        stats = {'processed': 0, 'skipped': 0, 'failed': 0}
+        for image_path in image_paths:
+            if skip_existing and misc_helpers.find_existing_output_file(image_path, output_folder, media_type='image'):
+                stats['skipped'] += 1
+            else:
+                batch.append(image_path)
+        total_images = len(image_paths)
+        if progress_callback and stats['skipped']:
+            progress_callback(stats['skipped'], total_images)
+
+        # (image path, output file path or None), put by the worker threads when an image is finished
+        results: queue.Queue[Tuple[str, str|None]] = queue.Queue()
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.num_decode_threads) as decode_executor, ThreadPoolExecutor(max_workers=self.num_workers) as worker_executor:
+            def on_processed(image_path: str, process_future: Future):
+                results.put((image_path, process_future.result()))
+
+            def on_decoded(image_path: str, decode_future: Future):
+                process_future = worker_executor.submit(self.process_image, image_path, decode_future.result(), output_folder)
+                process_future.add_done_callback(lambda future: on_processed(image_path, future))
+
+            submitted = 0
+            finished = 0
+            while finished < len(batch):
+                # Only decode up to lookahead images ahead of the finished ones, to bound the memory used by the decoded images
+                while submitted < len(batch) and submitted - finished < self.lookahead:
+                    image_path = batch[submitted]
+                    decode_future = decode_executor.submit(self.decode_image, image_path)
+                    decode_future.add_done_callback(lambda future, image_path=image_path: on_decoded(image_path, future))
+                    submitted += 1
+                _, output_file_path = results.get()
+                finished += 1
+                stats['processed' if output_file_path else 'failed'] += 1
+                if progress_callback:
+                    progress_callback(stats['skipped'] + finished, total_images)
+        self.processing_time = time.perf_counter() - start_time
+        return stats
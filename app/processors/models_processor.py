@@ -22,9 +22,13 @@ from app.processors.face_restorers import FaceRestorers
 from app.processors.face_swappers import FaceSwappers
 from app.processors.frame_enhancers import FrameEnhancers
 from app.processors.face_editors import FaceEditors
+from app.processors.face_tracker import FaceTracker
+from app.processors.face_matcher import FaceMatcher
 from app.processors.utils.dfm_model import DFMModel
 from app.processors.models_data import models_list, arcface_mapping_model_dict, get_trt_models
 from app.helpers.miscellaneous import is_file_exists
+from app.helpers.stage_profiler import profile_stage
+from app.helpers.trace_recorder import trace_span, TracedLock
 from app.helpers.downloader import download_file
 
 if TYPE_CHECKING:
@@ -44,7 +48,7 @@ class ModelsProcessor(QtCore.QObject):
         self.provider_name = 'TensorRT'
         # Prefer CUDA when available; otherwise default to CPU for cross‑platform startup (e.g., macOS)
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model_lock = threading.RLock()  # Reentrant lock for model access
+        self.model_lock = TracedLock(threading.RLock(), 'model_lock')  # Reentrant lock for model access, its waits are traced
         self.trt_ep_options = {
             # 'trt_max_workspace_size': 3 << 30,  # Dimensione massima dello spazio di lavoro in bytes
             'trt_engine_cache_enable': True,
@@ -91,6 +95,8 @@ class ModelsProcessor(QtCore.QObject):
         self.face_swappers = FaceSwappers(self)
         self.frame_enhancers = FrameEnhancers(self)
         self.face_editors = FaceEditors(self)
+        self.face_tracker = FaceTracker(self)
+        self.face_matcher = FaceMatcher()
 
         self.clip_session = []
         self.arcface_dst = np.array( [[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]], dtype=np.float32)
@@ -137,6 +143,27 @@ class ModelsProcessor(QtCore.QObject):
 
             return model_instance
 
+    def create_batched_model(self, model_name: str, input_name: str) -> onnxruntime.InferenceSession:
+        """
+        Session of the model with a dynamic batch size on input_name, for the models exported with a batch size of 1 (the
+        model itself when its batch size is already dynamic). It has to be checked against the model by the caller
+        """
+        model = onnx.load(self.models_path[model_name])
+        model_input = next(graph_input for graph_input in model.graph.input if graph_input.name == input_name)
+        batch_dim = model_input.type.tensor_type.shape.dim[0]
+        if batch_dim.HasField('dim_param') or batch_dim.dim_value <= 0:
+            # The batch size is already dynamic
+            return self.models[model_name]
+        batch_dim.Clear()
+        batch_dim.dim_param = 'batch'
+        # The shapes are inferred again by onnxruntime
+        for graph_output in model.graph.output:
+            graph_output.type.tensor_type.ClearField('shape')
+        del model.graph.value_info[:]
+        # The TensorRT EP would build an engine for every batch size, the variant runs with the CUDA or CPU EP
+        providers = [provider for provider in self.providers if 'Tensorrt' not in str(provider)]
+        return onnxruntime.InferenceSession(model.SerializeToString(), providers=providers)
+
     def load_dfm_model(self, dfm_model):
         with self.model_lock:
             if not self.dfm_models.get(dfm_model):
@@ -204,6 +231,8 @@ class ModelsProcessor(QtCore.QObject):
         for model_name, model_instance in self.models.items():
             del model_instance
             self.models[model_name] = None
+        self.face_detectors.delete_models()
+        self.face_swappers.delete_models()
         self.clip_session = []
         gc.collect()
 
@@ -311,10 +340,14 @@ class ModelsProcessor(QtCore.QObject):
                 self.emap = onnx.numpy_helper.to_array(graph.initializer[-1])
                 self.main_window.model_loaded_signal.emit()
 
+    @profile_stage('detect', model_arg='detect_mode')
+    @trace_span()
     def run_detect(self, img, detect_mode='RetinaFace', max_num=1, score=0.5, input_size=(512, 512), use_landmark_detection=False, landmark_detect_mode='203', landmark_score=0.5, from_points=False, rotation_angles=None):
         rotation_angles = rotation_angles or [0]
         return self.face_detectors.run_detect(img, detect_mode, max_num, score, input_size, use_landmark_detection, landmark_detect_mode, landmark_score, from_points, rotation_angles)
     
+    @profile_stage('landmark', model_arg='detect_mode')
+    @trace_span()
     def run_detect_landmark(self, img, bbox, det_kpss, detect_mode='203', score=0.5, from_points=False):
         return self.face_landmark_detectors.run_detect_landmark(img, bbox, det_kpss, detect_mode, score, from_points)
 
@@ -324,87 +357,117 @@ class ModelsProcessor(QtCore.QObject):
         else:
             raise ValueError(f"Face swapper model {face_swapper_model} not found.")
 
+    @profile_stage('recognize', model_arg='arcface_model')
+    @trace_span()
     def run_recognize_direct(self, img, kps, similarity_type='Opal', arcface_model='Inswapper128ArcFace'):
         return self.face_swappers.run_recognize_direct(img, kps, similarity_type, arcface_model)
 
+    @profile_stage('recognize', model_arg='arcface_model')
+    @trace_span()
+    def run_recognize_batch(self, img, kpss, similarity_type='Opal', arcface_model='Inswapper128ArcFace'):
+        return self.face_swappers.run_recognize_batch(img, kpss, similarity_type, arcface_model)
+
     def calc_inswapper_latent(self, source_embedding):
         return self.face_swappers.calc_inswapper_latent(source_embedding)
 
+    @trace_span()
     def run_inswapper(self, image, embedding, output):
         self.face_swappers.run_inswapper(image, embedding, output)
 
     def calc_swapper_latent_iss(self, source_embedding, version="A"):
         return self.face_swappers.calc_swapper_latent_iss(source_embedding, version)
 
+    @trace_span()
     def run_iss_swapper(self, image, embedding, output, version="A"):
         self.face_swappers.run_iss_swapper(image, embedding, output, version)
 
     def calc_swapper_latent_simswap512(self, source_embedding):
         return self.face_swappers.calc_swapper_latent_simswap512(source_embedding)
 
+    @trace_span()
     def run_swapper_simswap512(self, image, embedding, output):
         self.face_swappers.run_swapper_simswap512(image, embedding, output)
 
     def calc_swapper_latent_ghost(self, source_embedding):
         return self.face_swappers.calc_swapper_latent_ghost(source_embedding)
 
+    @trace_span()
     def run_swapper_ghostface(self, image, embedding, output, swapper_model='GhostFace-v2'):
         self.face_swappers.run_swapper_ghostface(image, embedding, output, swapper_model)
 
     def calc_swapper_latent_cscs(self, source_embedding):
         return self.face_swappers.calc_swapper_latent_cscs(source_embedding)
 
+    @trace_span()
     def run_swapper_cscs(self, image, embedding, output):
         self.face_swappers.run_swapper_cscs(image, embedding, output)
 
+    @trace_span()
     def run_enhance_frame_tile_process(self, img, enhancer_type, tile_size=256, scale=1):
         return self.frame_enhancers.run_enhance_frame_tile_process(img, enhancer_type, tile_size, scale)
 
+    @trace_span()
     def run_deoldify_artistic(self, image, output):
         return self.frame_enhancers.run_deoldify_artistic(image, output)
 
+    @trace_span()
     def run_deoldify_stable(self, image, output):
         return self.frame_enhancers.run_deoldify_artistic(image, output)
     
+    @trace_span()
     def run_deoldify_video(self, image, output):
         return self.frame_enhancers.run_deoldify_video(image, output)
     
+    @trace_span()
     def run_ddcolor_artistic(self, image, output):
         return self.frame_enhancers.run_ddcolor_artistic(image, output)
 
+    @trace_span()
     def run_ddcolor(self, tensor_gray_rgb, output_ab):
         return self.frame_enhancers.run_ddcolor(tensor_gray_rgb, output_ab)
 
+    @trace_span()
     def run_occluder(self, image, output):
         self.face_masks.run_occluder(image, output)
 
+    @trace_span()
     def run_dfl_xseg(self, image, output):
         self.face_masks.run_dfl_xseg(image, output)
 
+    @trace_span()
     def run_faceparser(self, image, output):
         self.face_masks.run_faceparser(image, output)
 
+    @profile_stage('clip')
+    @trace_span()
     def run_CLIPs(self, img, CLIPText, CLIPAmount):
         return self.face_masks.run_CLIPs(img, CLIPText, CLIPAmount)
     
+    @trace_span()
     def lp_motion_extractor(self, img, face_editor_type='Human-Face', **kwargs) -> dict:
         return self.face_editors.lp_motion_extractor(img, face_editor_type, **kwargs)
 
+    @trace_span()
     def lp_appearance_feature_extractor(self, img, face_editor_type='Human-Face'):
         return self.face_editors.lp_appearance_feature_extractor(img, face_editor_type)
 
+    @trace_span()
     def lp_retarget_eye(self, kp_source: torch.Tensor, eye_close_ratio: torch.Tensor, face_editor_type='Human-Face') -> torch.Tensor:
         return self.face_editors.lp_retarget_eye(kp_source, eye_close_ratio, face_editor_type)
 
+    @trace_span()
     def lp_retarget_lip(self, kp_source: torch.Tensor, lip_close_ratio: torch.Tensor, face_editor_type='Human-Face') -> torch.Tensor:
         return self.face_editors.lp_retarget_lip(kp_source, lip_close_ratio, face_editor_type)
 
+    @trace_span()
     def lp_stitch(self, kp_source: torch.Tensor, kp_driving: torch.Tensor, face_editor_type='Human-Face') -> torch.Tensor:
         return self.face_editors.lp_stitch(kp_source, kp_driving, face_editor_type)
 
+    @trace_span()
     def lp_stitching(self, kp_source: torch.Tensor, kp_driving: torch.Tensor, face_editor_type='Human-Face') -> torch.Tensor:
         return self.face_editors.lp_stitching(kp_source, kp_driving, face_editor_type)
 
+    @trace_span()
     def lp_warp_decode(self, feature_3d: torch.Tensor, kp_source: torch.Tensor, kp_driving: torch.Tensor, face_editor_type='Human-Face') -> torch.Tensor:
         return self.face_editors.lp_warp_decode(feature_3d, kp_source, kp_driving, face_editor_type)
 
@@ -414,15 +477,19 @@ class ModelsProcessor(QtCore.QObject):
         cos_dist = 1 - np.dot(vector1, vector2)/(np.linalg.norm(vector1)*np.linalg.norm(vector2)) # 2..0
         return 100-cos_dist*50
 
+    @profile_stage('restore', model_arg='restorer_type')
     def apply_facerestorer(self, swapped_face_upscaled, restorer_det_type, restorer_type, restorer_blend, fidelity_weight, detect_score):
         return self.face_restorers.apply_facerestorer(swapped_face_upscaled, restorer_det_type, restorer_type, restorer_blend, fidelity_weight, detect_score)
 
+    @profile_stage('occluder')
     def apply_occlusion(self, img, amount):
         return self.face_masks.apply_occlusion(img, amount)
     
+    @profile_stage('xseg')
     def apply_dfl_xseg(self, img, amount):
         return self.face_masks.apply_dfl_xseg(img, amount)
     
+    @profile_stage('parser')
     def apply_face_parser(self, img, parameters):
         return self.face_masks.apply_face_parser(img, parameters)
     
@@ -0,0 +1,353 @@
+import os
+import sys
+import time
+import platform
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+import torch
+import onnxruntime
+
+from app.processors.render_session import RenderSession, RenderTargetFace, get_default_parameters_and_control
+from app.processors.video_renderer import VideoRenderer, create_models_processor
+from app.processors.standin_models import create_standin_models
+from app.processors.models_data import models_list
+from app.helpers.stage_profiler import profiler, get_percentile
+import app.helpers.miscellaneous as misc_helpers
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Version of the layout of the results file
+RESULTS_VERSION = 1
+
+# Control values of every preset: the stand-in models only exist for RetinaFace and Inswapper128ArcFace, and the
+# optional frame steps that are not part of a preset are disabled, whatever the defaults of the layouts are
+BASE_CONTROL = {
+    'DetectorModelSelection': 'RetinaFace',
+    'LandmarkDetectToggle': False,
+    'AutoRotationToggle': False,
+    'ManualRotationEnableToggle': False,
+    'RecognitionModelSelection': 'Inswapper128ArcFace',
+    'SimilarityTypeSelection': 'Opal',
+    'ShowAllDetectedFacesBBoxToggle': False,
+    'ShowLandmarksEnableToggle': False,
+    'FrameEnhancerEnableToggle': False,
+    'BeautyEnableToggle': False,
+}
+BASE_PARAMETERS = {
+    'SwapModelSelection': 'Inswapper128',
+}
+
+# Parameters/control of the presets, and the models they run (ModelsProcessor.models_path keys)
+PRESETS = {
+    'swap': {
+        'parameters': {},
+        'control': {},
+        'swap_faces': True,
+        'edit_faces': False,
+        'models': ['RetinaFace', 'Inswapper128ArcFace', 'Inswapper128'],
+    },
+    'swap_tracking': {
+        'parameters': {},
+        'control': {'FaceTrackingEnableToggle': True},
+        'swap_faces': True,
+        'edit_faces': False,
+        'models': ['RetinaFace', 'Inswapper128ArcFace', 'Inswapper128', 'FaceLandmark203'],
+    },
+    'swap_restorer': {
+        'parameters': {'FaceRestorerEnableToggle': True, 'FaceRestorerTypeSelection': 'GFPGAN-v1.4', 'FaceRestorerDetTypeSelection': 'Blend'},
+        'control': {},
+        'swap_faces': True,
+        'edit_faces': False,
+        'models': ['RetinaFace', 'Inswapper128ArcFace', 'Inswapper128', 'GFPGANv1.4'],
+    },
+    'swap_masks': {
+        'parameters': {'OccluderEnableToggle': True, 'DFLXSegEnableToggle': True, 'FaceParserEnableToggle': True},
+        'control': {},
+        'swap_faces': True,
+        'edit_faces': False,
+        'models': ['RetinaFace', 'Inswapper128ArcFace', 'Inswapper128', 'Occluder', 'XSeg', 'FaceParser'],
+    },
+    'enhancer': {
+        'parameters': {},
+        'control': {'FrameEnhancerEnableToggle': True, 'FrameEnhancerTypeSelection': 'RealEsrgan-x2-Plus'},
+        'swap_faces': True,
+        'edit_faces': False,
+        'models': ['RetinaFace', 'Inswapper128ArcFace', 'Inswapper128', 'RealEsrganx2Plus'],
+    },
+    # The face editor (LivePortrait) has no stand-in models, the makeup runs the rest of the edit path
+    'edit_faces': {
+        'parameters': {'FaceMakeupEnableToggle': True},
+        'control': {},
+        'swap_faces': False,
+        'edit_faces': True,
+        'models': ['RetinaFace', 'Inswapper128ArcFace', 'FaceLandmark203', 'FaceParser'],
+    },
+}
+
+# 5 keypoints of a face in its 112x112 box (ArcFace template), used to place the synthetic faces
+FACE_TEMPLATE = np.array([[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]], dtype=np.float32) / 112.0
+
+def get_synthetic_faces(width: int, height: int, num_faces: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """(bbox, 5 keypoints) of the faces of the synthetic video, in frame coordinates: side by side, 30% of the frame height"""
+    face_size = min(0.3 * height, 0.8 * width / num_faces)
+    faces = []
+    for index in range(num_faces):
+        center_x = width * (index + 1) / (num_faces + 1)
+        center_y = height * 0.45
+        bbox = np.array([center_x - face_size / 2, center_y - face_size / 2, center_x + face_size / 2, center_y + face_size / 2], dtype=np.float32)
+        faces.append((bbox, bbox[:2] + FACE_TEMPLATE * face_size))
+    return faces
+
+def get_detector_faces(faces: List[Tuple[np.ndarray, np.ndarray]], width: int, height: int, input_size=512) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """The faces in the coordinates of the detector input, with the same scaling as FaceDetectors.detect_retinaface()"""
+    if height / width > 1.0:
+        det_scale = input_size / height
+    else:
+        det_scale = int(input_size * height / width) / height
+    return [(bbox * det_scale, kps * det_scale) for bbox, kps in faces]
+
+def generate_synthetic_video(video_path: str, width: int, height: int, num_frames: int, num_faces=1, fps=30.0):
+    """
+    Write a video of simple drawn faces (skin ellipse, eyes, nose, a mouth that opens and closes) over a moving noise
+    background, so that every frame is different. The faces are at get_synthetic_faces()
+    """
+    rng = np.random.default_rng(0)
+    texture = cv2.resize(rng.integers(0, 255, (height // 8 + 8, width // 8 + 8, 3), dtype=np.uint8), (width + 64, height + 64), interpolation=cv2.INTER_LINEAR)
+    faces = get_synthetic_faces(width, height, num_faces)
+    video_writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not video_writer.isOpened():
+        raise RuntimeError(f"Unable to write the synthetic video: {video_path}")
+    try:
+        for frame_number in range(num_frames):
+            offset = frame_number % 64
+            frame = texture[offset:offset + height, offset:offset + width].copy()
+            mouth_opening = 0.5 + 0.5 * np.sin(frame_number / 5.0)
+            for bbox, kps in faces:
+                face_size = bbox[2] - bbox[0]
+                center = (int((bbox[0] + bbox[2]) / 2), int((bbox[1] + bbox[3]) / 2 + face_size * 0.08))
+                cv2.ellipse(frame, center, (int(face_size * 0.42), int(face_size * 0.55)), 0, 0, 360, (140, 170, 220), -1, cv2.LINE_AA)
+                eye_radius = max(2, int(face_size * 0.06))
+                for eye in kps[:2]:
+                    cv2.circle(frame, (int(eye[0]), int(eye[1])), eye_radius, (255, 255, 255), -1, cv2.LINE_AA)
+                    cv2.circle(frame, (int(eye[0]), int(eye[1])), eye_radius // 2, (60, 40, 30), -1, cv2.LINE_AA)
+                cv2.circle(frame, (int(kps[2][0]), int(kps[2][1])), max(1, eye_radius // 2), (110, 130, 190), -1, cv2.LINE_AA)
+                mouth_center = (int((kps[3][0] + kps[4][0]) / 2), int((kps[3][1] + kps[4][1]) / 2))
+                mouth_axes = (int((kps[4][0] - kps[3][0]) / 2), max(1, int(face_size * 0.06 * mouth_opening)))
+                cv2.ellipse(frame, mouth_center, mouth_axes, 0, 0, 360, (60, 50, 150), -1, cv2.LINE_AA)
+            video_writer.write(frame)
+    finally:
+        video_writer.release()
+
+def get_peak_rss_mb() -> float|None:
+    """Peak resident memory of the process in MB, None when it can't be measured"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB on Linux
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+def get_machine_info() -> dict:
+    machine_info = {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'onnxruntime': onnxruntime.__version__,
+        'gpu': torch.cuda.get_device_name() if torch.cuda.is_available() else '',
+    }
+    return machine_info
+
+def get_commit() -> str:
+    """Git commit of the code that is benchmarked, empty outside of a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def get_missing_models(preset_names: List[str]) -> List[str]:
+    """Models of the presets that are not downloaded, for the benchmark with the installed models"""
+    model_paths = {model_data['model_name']: model_data['local_path'] for model_data in models_list}
+    model_names = sorted({model_name for preset_name in preset_names for model_name in PRESETS[preset_name]['models']})
+    return [model_name for model_name in model_names if not misc_helpers.is_file_exists(model_paths[model_name])]
+
+class PipelineBenchmark:
+    """
+    Runs the frames of a video through the whole frame pipeline (FrameWorker.process_frame, like VideoRenderer) for
+    every preset, and measures the FPS, the time of every frame and of every stage (see StageProfiler) and the peak memory.
+    By default every preset runs in its own process, so that the peak memory is the one of the preset alone.
+    model_paths replaces the paths of the models (eg by the stand-in models), the other models are loaded from model_assets.
+    """
+    def __init__(self, video_path: str, provider='CPU', threads=2, num_frames=60, warmup_frames=5, model_paths: Dict[str, str]|None = None,
+                 synchronize=False, separate_processes=True):
+        self.video_path = video_path
+        self.provider = provider
+        self.threads = threads
+        self.num_frames = num_frames
+        self.warmup_frames = warmup_frames
+        self.model_paths = model_paths or {}
+        self.synchronize = synchronize
+        self.separate_processes = separate_processes
+
+    def get_settings(self) -> dict:
+        return {
+            'video': self.video_path,
+            'provider': self.provider,
+            'threads': self.threads,
+            'frames': self.num_frames,
+            'warmup_frames': self.warmup_frames,
+            'standin_models': sorted(self.model_paths),
+            'synchronize': self.synchronize,
+        }
+
+    def run(self, preset_names: List[str], progress_callback: Callable[[str, dict], None]|None = None) -> dict:
+        """Run the presets and return the results (see run_preset()), with the machine info and the settings"""
+        results = {'version': RESULTS_VERSION, 'commit': get_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'machine': get_machine_info(), 'settings': self.get_settings(), 'presets': {}}
+        for preset_name in preset_names:
+            if self.separate_processes:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    preset_results = executor.submit(run_preset, self, preset_name).result()
+            else:
+                preset_results = run_preset(self, preset_name)
+            results['presets'][preset_name] = preset_results
+            if progress_callback:
+                progress_callback(preset_name, preset_results)
+        return results
+
+def create_session(preset: dict) -> RenderSession:
+    default_parameters, control = get_default_parameters_and_control()
+    control.update(BASE_CONTROL)
+    control.update(preset['control'])
+    session = RenderSession(default_parameters, control)
+    session.swap_faces = preset['swap_faces']
+    session.edit_faces = preset['edit_faces']
+    return session
+
+def add_target_faces(session: RenderSession, renderer: VideoRenderer, frame: np.ndarray, parameters: dict):
+    """Use the faces found in the frame as the target faces, each swapped with itself, like 'Find Faces' in the GUI"""
+    frame_worker = renderer.frame_worker
+    frame_worker.frame = frame
+    frame_worker.load_state(session.parameters, session.control, swap_faces=False, edit_faces=False)
+    _, det_faces_data = frame_worker.detect_faces_in_frame()
+    recognition_model = session.control['RecognitionModelSelection']
+    for index, face_data in enumerate(det_faces_data):
+        face_id = str(index)
+        embedding_store = {recognition_model: face_data['embedding']}
+        session.target_faces[face_id] = RenderTargetFace(face_id, embedding_store, dict(embedding_store))
+        session.parameters[face_id] = misc_helpers.ParametersDict(dict(parameters), session.default_parameters)
+
+def run_preset(benchmark: PipelineBenchmark, preset_name: str) -> dict:
+    """Process the frames of the video with the preset and return its results"""
+    preset = PRESETS[preset_name]
+    session = create_session(preset)
+    models_processor = create_models_processor(session, benchmark.provider, benchmark.threads)
+    models_processor.models_path.update(benchmark.model_paths)
+    renderer = VideoRenderer(session)
+
+    media_capture = misc_helpers.open_video_capture(benchmark.video_path)
+    if not media_capture.isOpened():
+        raise RuntimeError(f"Unable to open the video: {benchmark.video_path}")
+    total_frames = int(media_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    profiler.window = benchmark.num_frames + benchmark.warmup_frames
+    profiler.synchronize = benchmark.synchronize
+    frame_times = []
+    start_time = 0.0
+    try:
+        ret, frame = misc_helpers.read_frame(media_capture)
+        if not ret:
+            raise RuntimeError(f"Cannot read the first frame of {benchmark.video_path}")
+        add_target_faces(session, renderer, frame[..., ::-1], {**session.default_parameters, **BASE_PARAMETERS, **preset['parameters']})
+        if not session.target_faces:
+            raise RuntimeError(f"No face detected in the first frame of {benchmark.video_path}")
+        for frame_number in range(benchmark.warmup_frames + benchmark.num_frames):
+            if frame_number == benchmark.warmup_frames:
+                # Only the frames after the warm-up (models loading, allocations) are measured
+                profiler.reset()
+                profiler.enabled = True
+                frame_times = []
+                start_time = time.perf_counter()
+            if frame_number == 0 or (total_frames and frame_number % total_frames == 0):
+                # Loop the video when it is shorter than the benchmark
+                media_capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            with profiler.stage('decode'):
+                ret, frame = misc_helpers.read_frame(media_capture)
+            if not ret:
+                raise RuntimeError(f"Cannot read frame {frame_number} of {benchmark.video_path}")
+            frame = frame[..., ::-1]  # Convert BGR to RGB
+            frame_start_time = time.perf_counter()
+            renderer.process_frame(frame_number, frame)
+            frame_times.append(time.perf_counter() - frame_start_time)
+        total_time = time.perf_counter() - start_time
+    finally:
+        profiler.enabled = False
+        media_capture.release()
+
+    frame_times.sort()
+    results = {
+        'fps': len(frame_times) / total_time if total_time > 0 else 0.0,
+        'frames': len(frame_times),
+        'faces': len(session.target_faces),
+        'frame_ms': {
+            'p50': get_percentile(frame_times, 50) * 1000,
+            'p95': get_percentile(frame_times, 95) * 1000,
+            'max': frame_times[-1] * 1000,
+            'mean': sum(frame_times) / len(frame_times) * 1000,
+        },
+        'stages': profiler.get_stats(),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'peak_gpu_memory_mb': torch.cuda.max_memory_allocated() / (1024 * 1024) if torch.cuda.is_available() else None,
+    }
+    models_processor.clear_gpu_memory()
+    return results
+
+def compare_results(baseline: dict, current: dict, max_regression=0.1) -> Tuple[List[str], List[str]]:
+    """
+    Compare the presets of two results files. Return the report lines and the presets whose FPS dropped by more than
+    max_regression (a fraction) from the baseline
+    """
+    lines = []
+    regressions = []
+    for preset_name, current_results in current['presets'].items():
+        baseline_results = baseline['presets'].get(preset_name)
+        if baseline_results is None:
+            lines.append(f"{preset_name}: not in the baseline")
+            continue
+        fps_change = current_results['fps'] / baseline_results['fps'] - 1 if baseline_results['fps'] else 0.0
+        lines.append(f"{preset_name}: {baseline_results['fps']:.2f} -> {current_results['fps']:.2f} fps ({fps_change * 100:+.1f}%), "
+                     f"p95 frame {baseline_results['frame_ms']['p95']:.1f} -> {current_results['frame_ms']['p95']:.1f} ms")
+        if fps_change < -max_regression:
+            regressions.append(preset_name)
+        baseline_stages = {(stage['stage'], stage['model']): stage for stage in baseline_results['stages']}
+        for stage in current_results['stages']:
+            baseline_stage = baseline_stages.get((stage['stage'], stage['model']))
+            if baseline_stage is None or baseline_stage['p50_ms'] <= 0:
+                continue
+            stage_change = stage['p50_ms'] / baseline_stage['p50_ms'] - 1
+            if abs(stage_change) > max_regression:
+                stage_name = f"{stage['stage']} ({stage['model']})" if stage['model'] else stage['stage']
+                lines.append(f"    {stage_name}: p50 {baseline_stage['p50_ms']:.2f} -> {stage['p50_ms']:.2f} ms ({stage_change * 100:+.1f}%)")
+    return lines, regressions
+
+def prepare_standin_benchmark(work_dir: str, width: int, height: int, num_frames: int, num_faces: int, video_path: str|None = None) -> Tuple[str, Dict[str, str]]:
+    """Generate the synthetic video (unless video_path is given) and the stand-in models detecting its faces, in work_dir. Return the video path and the model paths"""
+    os.makedirs(work_dir, exist_ok=True)
+    if not video_path:
+        video_path = os.path.join(work_dir, f'synthetic_{width}x{height}_{num_faces}faces_{num_frames}.mp4')
+        if not misc_helpers.is_file_exists(video_path):
+            generate_synthetic_video(video_path, width, height, num_frames, num_faces)
+    else:
+        media_capture = cv2.VideoCapture(video_path)
+        width, height = int(media_capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(media_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        media_capture.release()
+    faces = get_detector_faces(get_synthetic_faces(width, height, num_faces), width, height)
+    model_paths = create_standin_models(os.path.join(work_dir, 'standin_models'), faces)
+    return video_path, model_paths
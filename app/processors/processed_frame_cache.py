@@ -0,0 +1,86 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Hashable, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from app.processors.workers.frame_worker import FrameWorker
+
+def get_frame_state_hash(frame_worker: 'FrameWorker') -> str:
+    """
+    Hash of everything that the output of frame_worker depends on, besides the input frame: the effective parameters
+    (after the marker of the frame was applied), the control, the toggles and the input faces assigned to the target faces
+    """
+    default_parameters = frame_worker.main_window.default_parameters
+    state = [
+        sorted(frame_worker.control.items()),
+        frame_worker.is_swap_faces_enabled, frame_worker.is_edit_faces_enabled,
+        frame_worker.is_view_face_compare, frame_worker.is_view_face_mask,
+    ]
+    for face_id in sorted(frame_worker.parameters.keys()):
+        # Missing values are filled from the defaults when accessed, so hash the values with the defaults applied
+        parameters = frame_worker.parameters[face_id]
+        state.append((face_id, sorted({**default_parameters, **dict(parameters)}.items())))
+    state_hash = hashlib.md5(repr(state).encode('utf-8'))
+    for face_id in sorted(frame_worker.target_faces.keys()):
+        state_hash.update(str(face_id).encode('utf-8'))
+        for embedding_model, embedding in sorted(frame_worker.target_faces[face_id].assigned_input_embedding.items()):
+            state_hash.update(embedding_model.encode('utf-8'))
+            state_hash.update(np.ascontiguousarray(embedding).tobytes())
+    return state_hash.hexdigest()
+
+class ProcessedFrameCache:
+    """
+    LRU cache of processed frames, keyed by (media path, frame number, input frame shape, state hash), see get_frame_state_hash().
+    Changing the parameters changes the state hash, so the frames processed with old parameters are never returned
+    and are evicted when the cache is over its byte budget. max_bytes = 0 disables the cache.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.frames: OrderedDict[Hashable, np.ndarray] = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, int, Tuple[int, ...], str]) -> np.ndarray|None:
+        """Return a copy of the cached frame, or None"""
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return frame.copy()
+
+    def put(self, key: Tuple[str, int, Tuple[int, ...], str], frame: np.ndarray):
+        if frame.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.frames:
+                self.nbytes -= self.frames.pop(key).nbytes
+            self.frames[key] = frame
+            self.nbytes += frame.nbytes
+            self.evict()
+
+    def evict(self):
+        while self.nbytes > self.max_bytes and self.frames:
+            _, frame = self.frames.popitem(last=False)
+            self.nbytes -= frame.nbytes
+
+    def set_max_bytes(self, max_bytes: int):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'frames': len(self.frames), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
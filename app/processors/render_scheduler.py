@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+import traceback
+from typing import TYPE_CHECKING, Callable, Dict, List
+
+import torch
+
+from app.processors.render_session import load_render_session
+from app.processors.video_renderer import VideoRenderer, create_models_processor
+from app.processors.image_batch_renderer import ImageBatchRenderer
+import app.helpers.miscellaneous as misc_helpers
+
+if TYPE_CHECKING:
+    from app.processors.models_processor import ModelsProcessor
+    from app.processors.render_session import RenderSession
+
+DEFAULT_RENDER_QUEUE_DIR = './render_queue'
+
+class RenderJob:
+    """A target media file to render with a snapshot of the workspace (faces, embeddings, parameters, markers) taken when it was queued"""
+    def __init__(self, job_id: str, media_path: str, workspace_file: str, output_folder: str = '', swap_faces=True, edit_faces=False,
+                 status='queued', output_file_path: str = '', error: str = '', queued_time=0.0, finished_time=0.0):
+        self.job_id = job_id
+        self.media_path = media_path
+        self.workspace_file = workspace_file
+        self.output_folder = output_folder
+        self.swap_faces = swap_faces
+        self.edit_faces = edit_faces
+        self.status = status # 'queued', 'running', 'done' or 'failed'
+        self.output_file_path = output_file_path
+        self.error = error
+        self.queued_time = queued_time
+        self.finished_time = finished_time
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RenderJob':
+        return cls(**data)
+
+class RenderQueue:
+    """
+    Render jobs persisted in queue_dir: queue.json holds the jobs in order, and the workspace snapshot of every job is
+    copied into queue_dir, so the queue survives restarts and later changes of the original workspace file.
+    Jobs that were running when the process stopped are queued again on load.
+    """
+    queue_filename = 'queue.json'
+    def __init__(self, queue_dir: str = DEFAULT_RENDER_QUEUE_DIR):
+        self.queue_dir = queue_dir
+        self.jobs: List[RenderJob] = []
+        self.lock = threading.RLock()
+        os.makedirs(queue_dir, exist_ok=True)
+        self.load()
+
+    @property
+    def queue_path(self) -> str:
+        return os.path.join(self.queue_dir, self.queue_filename)
+
+    def load(self):
+        with self.lock:
+            self.jobs = []
+            if not misc_helpers.is_file_exists(self.queue_path):
+                return
+            with open(self.queue_path, 'r', encoding='utf-8') as queue_file:
+                self.jobs = [RenderJob.from_dict(job_data) for job_data in json.load(queue_file)['jobs']]
+            for job in self.jobs:
+                if job.status == 'running':
+                    job.status = 'queued'
+
+    def save(self):
+        with self.lock:
+            # Write to a temporary file first, so that an interrupted write never leaves a broken queue
+            with open(f'{self.queue_path}.tmp', 'w', encoding='utf-8') as queue_file:
+                json.dump({'jobs': [job.to_dict() for job in self.jobs]}, queue_file, indent=4)
+            os.replace(f'{self.queue_path}.tmp', self.queue_path)
+
+    def add_job(self, workspace_file: str, media_path: str, output_folder: str = '', swap_faces=True, edit_faces=False) -> RenderJob:
+        job_id = uuid.uuid4().hex[:8]
+        snapshot_file = os.path.join(self.queue_dir, f'{job_id}.workspace.json')
+        shutil.copyfile(workspace_file, snapshot_file)
+        job = RenderJob(job_id, os.path.abspath(media_path), snapshot_file, output_folder, swap_faces, edit_faces, queued_time=time.time())
+        with self.lock:
+            self.jobs.append(job)
+            self.save()
+        return job
+
+    def get_job(self, job_id: str) -> RenderJob|None:
+        with self.lock:
+            return next((job for job in self.jobs if job.job_id == job_id), None)
+
+    def remove_job(self, job_id: str) -> bool:
+        with self.lock:
+            job = self.get_job(job_id)
+            if job is None or job.status == 'running':
+                return False
+            self.jobs.remove(job)
+            self.save()
+        if misc_helpers.is_file_exists(job.workspace_file):
+            os.remove(job.workspace_file)
+        return True
+
+    def requeue_failed_jobs(self) -> int:
+        with self.lock:
+            failed_jobs = [job for job in self.jobs if job.status == 'failed']
+            for job in failed_jobs:
+                job.status = 'queued'
+                job.error = ''
+            self.save()
+        return len(failed_jobs)
+
+    def take_next_job(self) -> RenderJob|None:
+        """Mark the first queued job as running and return it"""
+        with self.lock:
+            for job in self.jobs:
+                if job.status == 'queued':
+                    job.status = 'running'
+                    self.save()
+                    return job
+            return None
+
+    def finish_job(self, job: RenderJob, output_file_path='', error=''):
+        with self.lock:
+            job.status = 'failed' if error else 'done'
+            job.output_file_path = output_file_path
+            job.error = error
+            job.finished_time = time.time()
+            self.save()
+
+def get_models_processor_settings(session: 'RenderSession') -> dict:
+    """The settings the ModelsProcessor reads from the session it is bound to (its main_window)"""
+    return {'MaxDFMModelsSlider': session.control['MaxDFMModelsSlider']}
+
+class RenderScheduler:
+    """
+    Runs the jobs of a RenderQueue back to back, or up to max_concurrent_jobs at a time when the free GPU memory is above
+    min_free_memory_mb. All the jobs share one ModelsProcessor, so the models loaded by a job are reused by the next ones
+    instead of being unloaded and loaded again for every job.
+    Another job is only started once the last one has rendered its first frame, so that the free memory is checked with
+    its models loaded. The ModelsProcessor is bound to the session of the job that starts when no other job is running;
+    a job whose ModelsProcessor settings differ from the ones of the running jobs waits for them to finish.
+    """
+    def __init__(self, render_queue: RenderQueue, provider: str, threads: int, max_concurrent_jobs=1, min_free_memory_mb=4096):
+        self.render_queue = render_queue
+        self.provider = provider
+        self.threads = threads
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        self.min_free_memory_mb = min_free_memory_mb
+        self.models_processor: 'ModelsProcessor|None' = None
+        # Jobs using the ModelsProcessor, and the settings of the session it is bound to
+        self.models_processor_condition = threading.Condition()
+        self.models_processor_users = 0
+        self.models_processor_settings: dict|None = None
+
+    def acquire_models_processor(self, session: 'RenderSession') -> 'ModelsProcessor':
+        """The shared ModelsProcessor for the session of a job, released with release_models_processor() when the job ends"""
+        settings = get_models_processor_settings(session)
+        with self.models_processor_condition:
+            self.models_processor_condition.wait_for(lambda: self.models_processor_users == 0 or settings == self.models_processor_settings)
+            if self.models_processor is None:
+                self.models_processor = create_models_processor(session, self.provider, self.threads)
+            else:
+                session.models_processor = self.models_processor
+                if self.models_processor_users == 0:
+                    # The ModelsProcessor uses the session for the model loading signals and the DFM settings
+                    self.models_processor.main_window = session
+            if self.models_processor_users == 0:
+                self.models_processor_settings = settings
+            self.models_processor_users += 1
+            return self.models_processor
+
+    def release_models_processor(self):
+        with self.models_processor_condition:
+            self.models_processor_users -= 1
+            self.models_processor_condition.notify_all()
+
+    def has_free_memory(self) -> bool:
+        if not torch.cuda.is_available():
+            return True
+        free_memory, _ = torch.cuda.mem_get_info()
+        return free_memory / (1024 * 1024) >= self.min_free_memory_mb
+
+    def run_job(self, job: RenderJob, progress_callback: Callable[[RenderJob, int, int], None]|None = None) -> str:
+        """Render the job and return the output file path"""
+        session = load_render_session(job.workspace_file)
+        session.swap_faces = job.swap_faces
+        session.edit_faces = job.edit_faces
+        self.acquire_models_processor(session)
+        try:
+            return self.render_job(job, session, progress_callback)
+        finally:
+            self.release_models_processor()
+
+    def render_job(self, job: RenderJob, session: 'RenderSession', progress_callback: Callable[[RenderJob, int, int], None]|None = None) -> str:
+        output_folder = job.output_folder or session.control['OutputMediaFolder'] or misc_helpers.get_dir_of_file(job.media_path)
+        os.makedirs(output_folder, exist_ok=True)
+        job_progress_callback = (lambda done, total: progress_callback(job, done, total)) if progress_callback else None
+        file_type = misc_helpers.get_file_type(job.media_path)
+        if file_type == 'image':
+            output_file_path = ImageBatchRenderer(session).process_image(job.media_path, misc_helpers.read_image_file(job.media_path), output_folder)
+            if not output_file_path:
+                raise RuntimeError(f"Failed to process {job.media_path}")
+            if job_progress_callback:
+                job_progress_callback(1, 1)
+            return output_file_path
+        if file_type != 'video':
+            raise RuntimeError(f"Unsupported media: {job.media_path}")
+        output_file_path = misc_helpers.get_output_file_path(job.media_path, output_folder)
+        VideoRenderer(session).render(job.media_path, output_file_path, progress_callback=job_progress_callback)
+        return output_file_path
+
+    def run_job_and_record(self, job: RenderJob, progress_callback, started_event: threading.Event):
+        """Run the job and record its result in the queue. started_event is set once the job rendered its first frame, or ended"""
+        def job_progress_callback(job: RenderJob, done: int, total: int):
+            started_event.set()
+            if progress_callback:
+                progress_callback(job, done, total)
+        try:
+            output_file_path = self.run_job(job, job_progress_callback)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            print(f"\nRender job {job.job_id} ({job.media_path}) failed: {e}")
+            traceback.print_exc()
+            self.render_queue.finish_job(job, error=str(e) or type(e).__name__)
+            return
+        finally:
+            started_event.set()
+        self.render_queue.finish_job(job, output_file_path=output_file_path)
+
+    def run(self, progress_callback: Callable[[RenderJob, int, int], None]|None = None) -> Dict[str, int]:
+        """Run the queued jobs until none is left. Return the number of done and failed jobs"""
+        running: List[threading.Thread] = []
+        finished_jobs: List[RenderJob] = []
+        while True:
+            running = [thread for thread in running if thread.is_alive()]
+            # The first job always starts, more run at the same time only while there is enough free memory for them
+            can_start = not running or (len(running) < self.max_concurrent_jobs and self.has_free_memory())
+            job = self.render_queue.take_next_job() if can_start else None
+            if job is not None:
+                print(f"Starting render job {job.job_id}: {job.media_path}")
+                finished_jobs.append(job)
+                started_event = threading.Event()
+                thread = threading.Thread(target=self.run_job_and_record, args=(job, progress_callback, started_event), daemon=True)
+                thread.start()
+                running.append(thread)
+                if self.max_concurrent_jobs > 1:
+                    # The free memory is only meaningful once the job has loaded its models
+                    started_event.wait()
+                continue
+            if not running:
+                break
+            running[0].join(timeout=1.0)
+        if self.models_processor is not None:
+            self.models_processor.clear_gpu_memory()
+        return {'done': sum(job.status == 'done' for job in finished_jobs), 'failed': sum(job.status == 'failed' for job in finished_jobs)}
@@ -0,0 +1,119 @@
+import json
+import copy
+from typing import Dict, Tuple
+
+import numpy as np
+
+from app.helpers.miscellaneous import ParametersDict, DFM_MODELS_DATA
+from app.helpers.typing_helper import LayoutDictTypes, ParametersTypes, FacesParametersTypes, ControlTypes, MarkerTypes
+
+class NullSignal:
+    """Stand-in for the Qt signals that ModelsProcessor emits on the MainWindow (model loading dialogs etc.)"""
+    def emit(self, *args):
+        pass
+
+    def connect(self, *args):
+        pass
+
+class RenderTargetFace:
+    """Qt-free counterpart of TargetFaceCardButton, holding only the data needed by the frame pipeline"""
+    def __init__(self, face_id: str, embedding_store: Dict[str, np.ndarray], assigned_input_embedding: Dict[str, np.ndarray], cropped_face: np.ndarray|None = None):
+        self.face_id = face_id
+        self.embedding_store = embedding_store
+        self.assigned_input_embedding = assigned_input_embedding
+        self.cropped_face = cropped_face
+
+    def get_embedding(self, embedding_swap_model: str) -> np.ndarray:
+        return self.embedding_store.get(embedding_swap_model, np.array([]))
+
+def get_default_values_from_layout(LAYOUT_DATA: LayoutDictTypes) -> dict:
+    # Same value conversions used by layout_actions.add_widgets_to_tab_layout() when the widgets are created
+    values = {}
+    for _, widgets in LAYOUT_DATA.items():
+        for widget_name, widget_data in widgets.items():
+            default = widget_data['default']
+            if callable(default):
+                default = default()
+            if 'Toggle' in widget_name or 'Selection' in widget_name:
+                values[widget_name] = default
+            elif 'DecimalSlider' in widget_name:
+                values[widget_name] = float(default)
+            elif 'Slider' in widget_name:
+                values[widget_name] = int(default)
+            elif 'Text' in widget_name:
+                values[widget_name] = default
+    return values
+
+def get_default_parameters_and_control() -> Tuple[dict, dict]:
+    # Imported here because the layout data modules pull in the Qt widget actions
+    from app.ui.widgets.common_layout_data import COMMON_LAYOUT_DATA
+    from app.ui.widgets.swapper_layout_data import SWAPPER_LAYOUT_DATA
+    from app.ui.widgets.face_editor_layout_data import FACE_EDITOR_LAYOUT_DATA
+    from app.ui.widgets.settings_layout_data import SETTINGS_LAYOUT_DATA
+
+    default_parameters = {}
+    for layout_data in (COMMON_LAYOUT_DATA, SWAPPER_LAYOUT_DATA, FACE_EDITOR_LAYOUT_DATA):
+        default_parameters.update(get_default_values_from_layout(layout_data))
+    default_control = get_default_values_from_layout(SETTINGS_LAYOUT_DATA)
+    default_control['OutputMediaFolder'] = ''
+    return default_parameters, default_control
+
+class RenderSession:
+    """
+    Snapshot of a workspace (target faces, embeddings, parameters, control and markers) that can drive
+    the frame pipeline without a MainWindow. It exposes the same attribute names that ModelsProcessor
+    and FrameWorker read from the MainWindow, so it can be passed in its place.
+    """
+    def __init__(self, default_parameters: dict, control: dict):
+        self.default_parameters: ParametersTypes = default_parameters
+        self.control: ControlTypes = control
+        self.parameters: FacesParametersTypes = {}
+        self.target_faces: Dict[str, RenderTargetFace] = {}
+        self.markers: MarkerTypes = {}
+        self.target_media_paths: list[str] = []
+        self.selected_media_path: str = ''
+        self.dfm_models_data = DFM_MODELS_DATA
+        self.pixel_free_worker = None
+        self.models_processor = None
+        self.video_processor = None
+        self.swap_faces = True
+        self.edit_faces = False
+
+        self.model_loading_signal = NullSignal()
+        self.model_loaded_signal = NullSignal()
+
+    def get_state_for_frame(self, frame_number: int) -> Tuple[FacesParametersTypes, ControlTypes]:
+        """Return the (parameters, control) in effect at frame_number, i.e. from the last marker at or before it"""
+        parameters, control = self.parameters, self.control
+        marker_positions = [position for position in self.markers if position <= frame_number]
+        if marker_positions:
+            marker_data = self.markers[max(marker_positions)]
+            parameters = marker_data['parameters']
+            control = {**self.control, **marker_data['control']}
+        return copy.copy(parameters), dict(control)
+
+def load_render_session(workspace_filename: str) -> RenderSession:
+    """Build a RenderSession from a workspace file written by save_load_actions.save_current_workspace()"""
+    with open(workspace_filename, 'r') as data_file: #pylint: disable=unspecified-encoding
+        data = json.load(data_file)
+
+    default_parameters, control = get_default_parameters_and_control()
+    control.update(data['control'])
+    session = RenderSession(default_parameters, control)
+
+    for media_data in data['target_medias_data']:
+        session.target_media_paths.append(media_data['media_path'])
+        if media_data['media_id'] == data['selected_media_id']:
+            session.selected_media_path = media_data['media_path']
+
+    for face_id, target_face_data in data['target_faces_data'].items():
+        embedding_store = {embed_model: np.array(embedding) for embed_model, embedding in target_face_data['embedding_store'].items()}
+        assigned_input_embedding = {embed_model: np.array(embedding) for embed_model, embedding in target_face_data['assigned_input_embedding'].items()}
+        session.target_faces[face_id] = RenderTargetFace(face_id, embedding_store, assigned_input_embedding)
+        session.parameters[face_id] = ParametersDict(target_face_data['parameters'], default_parameters)
+
+    for marker_position, marker_data in data['markers'].items():
+        marker_parameters = {face_id: ParametersDict(parameters, default_parameters) for face_id, parameters in marker_data['parameters'].items()}
+        session.markers[int(marker_position)] = {'parameters': marker_parameters, 'control': marker_data['control']}
+
+    return session
@@ -0,0 +1,60 @@
+import threading
+from typing import Dict
+
+import numpy as np
+
+class ReorderBuffer:
+    """
+    Holds the processed frames that finished out of order until they can be displayed/recorded in order.
+    Only the BGR frame array is kept for each frame (the pixmap is created when the frame is shown), and the
+    total size of the held frames is tracked against max_bytes, so that the reader can stop submitting new frames
+    with is_full() (or wait_until_not_full()) instead of letting the buffer grow without limit.
+    A frame stored as None is a frame whose processing failed.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.frames: Dict[int, np.ndarray|None] = {}
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        # Notified when frames are taken out of the buffer
+        self.not_full = threading.Condition(self.lock)
+
+    def __contains__(self, frame_number: int) -> bool:
+        with self.lock:
+            return frame_number in self.frames
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.frames)
+
+    def put(self, frame_number: int, frame: np.ndarray|None):
+        with self.lock:
+            previous_frame = self.frames.get(frame_number)
+            if previous_frame is not None:
+                self.nbytes -= previous_frame.nbytes
+            self.frames[frame_number] = frame
+            if frame is not None:
+                self.nbytes += frame.nbytes
+
+    def pop(self, frame_number: int) -> np.ndarray|None:
+        with self.lock:
+            frame = self.frames.pop(frame_number)
+            if frame is not None:
+                self.nbytes -= frame.nbytes
+            self.not_full.notify_all()
+            return frame
+
+    def is_full(self) -> bool:
+        with self.lock:
+            return self.nbytes >= self.max_bytes
+
+    def wait_until_not_full(self, timeout=None) -> bool:
+        """Block until the buffer is not full or the timeout expires. Returns True if the buffer is not full"""
+        with self.not_full:
+            return self.not_full.wait_for(lambda: self.nbytes < self.max_bytes, timeout)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+            self.not_full.notify_all()
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Callable, List, Tuple
+
+import cv2
+
+import app.helpers.miscellaneous as misc_helpers
+
+if TYPE_CHECKING:
+    from app.processors.render_session import RenderSession
+
+# VideoRenderer of the current segment worker process, created by init_segment_worker()
+_segment_renderer = None
+
+def get_keyframe_numbers(media_path: str, fps: float) -> List[int]:
+    """Frame numbers of the keyframes of the first video stream, read from the packet flags with ffprobe (empty if ffprobe is not available)"""
+    if not misc_helpers.cmd_exist('ffprobe'):
+        return []
+    args = ["ffprobe",
+            "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags",
+            "-of", "csv=print_section=0",
+            media_path]
+    result = subprocess.run(args, capture_output=True, text=True, check=False)
+    keyframe_numbers = set()
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframe_numbers.add(round(float(pts_time) * fps))
+    return sorted(keyframe_numbers)
+
+def split_into_segments(start_frame: int, end_frame: int, keyframe_numbers: List[int], num_segments: int) -> List[Tuple[int, int]]:
+    """
+    Split [start_frame, end_frame] into at most num_segments (start, end) ranges of similar length.
+    Every segment after the first starts at the keyframe closest to its ideal start, so each worker can seek to its segment without decoding a previous GOP
+    """
+    total_frames = end_frame - start_frame + 1
+    num_segments = max(1, min(num_segments, total_frames))
+    keyframe_numbers = [frame_number for frame_number in keyframe_numbers if start_frame < frame_number <= end_frame]
+    segment_starts = [start_frame]
+    for i in range(1, num_segments):
+        ideal_start = start_frame + round(i * total_frames / num_segments)
+        if keyframe_numbers:
+            ideal_start = min(keyframe_numbers, key=lambda frame_number, ideal_start=ideal_start: abs(frame_number - ideal_start))
+        if ideal_start > segment_starts[-1]:
+            segment_starts.append(ideal_start)
+    segment_ends = [segment_start - 1 for segment_start in segment_starts[1:]] + [end_frame]
+    return list(zip(segment_starts, segment_ends))
+
+def get_workspace_hash(workspace_file: str) -> str:
+    with open(workspace_file, 'rb') as data_file:
+        return hashlib.sha256(data_file.read()).hexdigest()
+
+def get_model_selections(session: 'RenderSession') -> dict:
+    """The models selected in the control and in the parameters of each target face (including the markers)"""
+    def get_selections(values) -> dict:
+        return {key: values[key] for key in sorted(values.keys()) if key.endswith(('ModelSelection', 'TypeSelection'))}
+    model_selections = {
+        'control': get_selections(session.control),
+        'faces': {face_id: get_selections(parameters) for face_id, parameters in session.parameters.items()},
+        'markers': {str(position): {face_id: get_selections(parameters) for face_id, parameters in marker_data['parameters'].items()}
+                    for position, marker_data in sorted(session.markers.items())},
+    }
+    return model_selections
+
+class RenderCheckpoint:
+    """
+    Manifest of a checkpointed segmented render. It is stored with the finished segment files in checkpoint_dir and
+    records the segments, which of them are done, and the render_info (media, frame range, workspace hash, model selections)
+    that a resumed render must match.
+    """
+    manifest_filename = 'manifest.json'
+    def __init__(self, checkpoint_dir: str, render_info: dict, segments: List[Tuple[int, int]], done_segments: List[Tuple[int, int]]|None = None):
+        self.checkpoint_dir = checkpoint_dir
+        self.render_info = render_info
+        self.segments = segments
+        self.done_segments = set(done_segments or [])
+
+    @classmethod
+    def load(cls, checkpoint_dir: str) -> 'RenderCheckpoint|None':
+        manifest_path = os.path.join(checkpoint_dir, cls.manifest_filename)
+        if not misc_helpers.is_file_exists(manifest_path):
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+        return cls(checkpoint_dir, manifest['render_info'],
+                   [tuple(segment) for segment in manifest['segments']],
+                   [tuple(segment) for segment in manifest['done_segments']])
+
+    def save(self):
+        manifest = {
+            'render_info': self.render_info,
+            'segments': self.segments,
+            'done_segments': sorted(self.done_segments),
+        }
+        manifest_path = os.path.join(self.checkpoint_dir, self.manifest_filename)
+        # Write to a temporary file first, so that an interrupted write never leaves a broken manifest
+        with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+
+    def get_changed_keys(self, render_info: dict) -> List[str]:
+        return [key for key in sorted(set(self.render_info) | set(render_info)) if self.render_info.get(key) != render_info.get(key)]
+
+    def get_segment_file_path(self, segment: Tuple[int, int]) -> str:
+        start, end = segment
+        return os.path.join(self.checkpoint_dir, f'segment_{start:08d}_{end:08d}.mp4')
+
+    def is_done(self, segment: Tuple[int, int]) -> bool:
+        return segment in self.done_segments and misc_helpers.is_file_exists(self.get_segment_file_path(segment))
+
+    def mark_done(self, segment: Tuple[int, int]):
+        self.done_segments.add(segment)
+        self.save()
+
+def init_segment_worker(workspace_file: str, provider: str, threads: int, swap_faces: bool, edit_faces: bool):
+    """Load the workspace and create the ModelsProcessor of a segment worker process, once for all the segments it renders"""
+    global _segment_renderer # pylint: disable=global-statement
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    # Imported here so that the parent process doesn't need to load the models
+    from app.processors.render_session import load_render_session
+    from app.processors.video_renderer import VideoRenderer, create_models_processor
+
+    session = load_render_session(workspace_file)
+    session.swap_faces = swap_faces
+    session.edit_faces = edit_faces
+    create_models_processor(session, provider, threads)
+    _segment_renderer = VideoRenderer(session)
+
+def render_segment(media_path: str, segment_file_path: str, start_frame: int, end_frame: int) -> Tuple[int, float]:
+    """Render one segment (without audio) in a worker process. Returns (frames rendered, processing time)"""
+    _segment_renderer.render(media_path, segment_file_path, start_frame=start_frame, end_frame=end_frame, include_audio=False)
+    return _segment_renderer.frames_rendered, _segment_renderer.processing_time
+
+class SegmentedRenderer:
+    """
+    Renders a video in GOP aligned segments, each one in a worker process with its own ModelsProcessor, and joins the
+    segments with the ffmpeg concat demuxer while muxing the audio of the source.
+    The parameters of each frame are resolved from the markers of the workspace (see RenderSession.get_state_for_frame),
+    so every segment starts with the state in effect at its first frame.
+    """
+    def __init__(self, workspace_file: str, provider: str, threads: int, swap_faces=True, edit_faces=False, num_processes=2, num_segments: int|None = None):
+        self.workspace_file = workspace_file
+        self.provider = provider
+        self.threads = threads
+        self.swap_faces = swap_faces
+        self.edit_faces = edit_faces
+        self.num_processes = num_processes
+        # More segments than processes, so that a process finishing early can pick up another segment
+        self.num_segments = num_segments or num_processes * 4
+        self.frames_rendered = 0
+        self.processing_time = 0.0
+
+    def get_segments(self, media_path: str, fps: float, start_frame: int, end_frame: int) -> List[Tuple[int, int]]:
+        keyframe_numbers = get_keyframe_numbers(media_path, fps)
+        return split_into_segments(start_frame, end_frame, keyframe_numbers, self.num_segments)
+
+    def render_segments(self, media_path: str, segments: List[Tuple[int, int]], segment_file_paths: List[str], progress_callback: Callable[[int, int], None]|None = None, on_segment_done: Callable[[Tuple[int, int]], None]|None = None):
+        """
+        Render the segments in the worker processes. on_segment_done is only called for the segments rendered completely,
+        the other segments are rendered until the end and then a RuntimeError lists the segments that failed
+        """
+        total_frames = sum(end - start + 1 for start, end in segments)
+        # CUDA can't be used in forked processes
+        mp_context = multiprocessing.get_context('spawn')
+        initargs = (self.workspace_file, self.provider, self.threads, self.swap_faces, self.edit_faces)
+        with ProcessPoolExecutor(max_workers=self.num_processes, mp_context=mp_context, initializer=init_segment_worker, initargs=initargs) as executor:
+            futures = {executor.submit(render_segment, media_path, segment_file_path, start, end): (start, end)
+                       for (start, end), segment_file_path in zip(segments, segment_file_paths)}
+            failed_segments = []
+            for future in as_completed(futures):
+                start, end = futures[future]
+                try:
+                    frames_rendered, _ = future.result()
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    print(f"\nSegment {start}-{end} failed: {e}")
+                    failed_segments.append((start, end))
+                    continue
+                self.frames_rendered += frames_rendered
+                if frames_rendered != end - start + 1:
+                    # Not marked as done, so that a resumed render renders it again
+                    print(f"\nSegment {start}-{end} rendered only {frames_rendered} frames")
+                    failed_segments.append((start, end))
+                elif on_segment_done:
+                    on_segment_done((start, end))
+                if progress_callback:
+                    progress_callback(self.frames_rendered, total_frames)
+        if failed_segments:
+            raise RuntimeError(f"{len(failed_segments)} segments were not rendered completely: {', '.join(f'{start}-{end}' for start, end in sorted(failed_segments))}")
+
+    def concat_segments(self, media_path: str, segment_file_paths: List[str], start_time: float, output_file_path: str, work_dir: str):
+        list_file_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_file_path, 'w', encoding='utf-8') as list_file:
+            for segment_file_path in segment_file_paths:
+                escaped_path = os.path.abspath(segment_file_path).replace("'", "'\\''")
+                list_file.write(f"file '{escaped_path}'\n")
+        if misc_helpers.is_file_exists(output_file_path):
+            os.remove(output_file_path)
+        args = misc_helpers.get_ffmpeg_concat_args(list_file_path, output_file_path, audio_media_path=media_path, audio_start_time=start_time)
+        subprocess.run(args, check=True)
+
+    def render(self, media_path: str, output_file_path: str, start_frame=0, end_frame: int|None = None, progress_callback: Callable[[int, int], None]|None = None,
+               checkpoint_dir: str|None = None, render_info: dict|None = None, resume=False) -> float:
+        """
+        Render frames [start_frame, end_frame] of media_path to output_file_path and return the average FPS.
+        With checkpoint_dir, the finished segments and their manifest are kept there until the output is written, and
+        with resume the segments already done by a previous render are reused. The resume is refused (RuntimeError) if
+        the render_info (see RenderCheckpoint) differs from the one of the checkpoint.
+        """
+        media_capture = cv2.VideoCapture(media_path)
+        if not media_capture.isOpened():
+            raise RuntimeError(f"Unable to open the video: {media_path}")
+        fps = media_capture.get(cv2.CAP_PROP_FPS)
+        max_frame_number = int(media_capture.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+        media_capture.release()
+        if end_frame is None or end_frame > max_frame_number:
+            end_frame = max_frame_number
+
+        if checkpoint_dir:
+            render_info = {**(render_info or {}), 'media_path': os.path.abspath(media_path), 'start_frame': start_frame, 'end_frame': end_frame}
+            work_dir = checkpoint_dir
+            os.makedirs(work_dir, exist_ok=True)
+            checkpoint = RenderCheckpoint.load(work_dir) if resume else None
+            if checkpoint is not None:
+                changed_keys = checkpoint.get_changed_keys(render_info)
+                if changed_keys:
+                    raise RuntimeError(f"Cannot resume the render, the checkpoint in {work_dir} was written with a different {', '.join(changed_keys)}")
+                print(f"Resuming the render, {len(checkpoint.done_segments)} of {len(checkpoint.segments)} segments are already done")
+            else:
+                if resume:
+                    print(f"No checkpoint found in {work_dir}, starting the render from the beginning")
+                checkpoint = RenderCheckpoint(work_dir, render_info, self.get_segments(media_path, fps, start_frame, end_frame))
+                checkpoint.save()
+        else:
+            work_dir = tempfile.mkdtemp(prefix='.render_segments_', dir=os.path.dirname(os.path.abspath(output_file_path)))
+            checkpoint = RenderCheckpoint(work_dir, {}, self.get_segments(media_path, fps, start_frame, end_frame))
+
+        segments = checkpoint.segments
+        pending_segments = [segment for segment in segments if not checkpoint.is_done(segment)]
+        print(f"Rendering {len(pending_segments)} segments with {self.num_processes} processes")
+
+        self.frames_rendered = 0
+        start_time = time.perf_counter()
+        try:
+            self.render_segments(media_path, pending_segments, [checkpoint.get_segment_file_path(segment) for segment in pending_segments], progress_callback,
+                                 on_segment_done=checkpoint.mark_done if checkpoint_dir else None)
+            self.concat_segments(media_path, [checkpoint.get_segment_file_path(segment) for segment in segments], start_frame / float(fps), output_file_path, work_dir)
+        finally:
+            # The checkpoint is only kept when the render didn't finish
+            if not checkpoint_dir or misc_helpers.is_file_exists(output_file_path):
+                shutil.rmtree(work_dir, ignore_errors=True)
+        self.processing_time = time.perf_counter() - start_time
+
+        return self.frames_rendered / self.processing_time if self.processing_time > 0 else 0.0
@@ -0,0 +1,232 @@
+import os
+import json
+import hashlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+# Stand-ins for the models used by the benchmark presets, see create_standin_models()
+STANDIN_MODEL_NAMES = ('RetinaFace', 'Inswapper128ArcFace', 'Inswapper128', 'GFPGANv1.4', 'Occluder', 'XSeg', 'FaceParser', 'RealEsrganx2Plus', 'FaceLandmark203')
+
+# Output names of the RetinaFace model, in the order used by FaceDetectors.detect_retinaface(): scores, bboxes and keypoints of the strides 8, 16 and 32
+RETINAFACE_OUTPUTS = {'scores': ('448', '471', '494'), 'bboxes': ('451', '474', '497'), 'kpss': ('454', '477', '500')}
+RETINAFACE_STRIDES = (8, 16, 32)
+
+# Weight of the (input dependent) computed part of the outputs of the stand-ins, small enough to keep their outputs stable
+NOISE_SCALE = 1e-3
+
+class StandinModelBuilder:
+    """
+    Builds a tiny ONNX graph with the input/output names and shapes of a real model. The outputs are mostly constant
+    (fixed detections, embedding, landmarks or masks) plus a small term computed from the inputs with a few cheap
+    layers, so that they cost a bit of real inference time and can't be folded away by onnxruntime.
+    """
+    def __init__(self, seed=0):
+        self.nodes = []
+        self.initializers = []
+        self.inputs = []
+        self.outputs = []
+        self.rng = np.random.default_rng(seed)
+        self.counter = 0
+
+    def get_name(self, prefix: str) -> str:
+        self.counter += 1
+        return f'{prefix}_{self.counter}'
+
+    def add_input(self, name: str, shape: list):
+        self.inputs.append(helper.make_tensor_value_info(name, TensorProto.FLOAT, shape))
+
+    def add_output(self, name: str, shape: list):
+        self.outputs.append(helper.make_tensor_value_info(name, TensorProto.FLOAT, shape))
+
+    def add_constant(self, array: np.ndarray, prefix='const', dtype=np.float32) -> str:
+        name = self.get_name(prefix)
+        self.initializers.append(numpy_helper.from_array(np.asarray(array, dtype=dtype), name))
+        return name
+
+    def add_node(self, op_type: str, inputs: List[str], output: str|None = None, **attributes) -> str:
+        output = output or self.get_name(op_type.lower())
+        self.nodes.append(helper.make_node(op_type, inputs, [output], **attributes))
+        return output
+
+    def add_noise(self, features: str, num_features: int, shape: Tuple[int, ...]) -> str:
+        """Small term of the given shape computed from (1, num_features) features"""
+        weights = self.add_constant(self.rng.standard_normal((num_features, int(np.prod(shape)))) * NOISE_SCALE)
+        noise = self.add_node('MatMul', [features, weights])
+        return self.add_node('Reshape', [noise, self.add_constant(shape, dtype=np.int64)])
+
+    def add_pooled_features(self, input_name: str) -> str:
+        """(1, C) mean of the NCHW input"""
+        pooled = self.add_node('GlobalAveragePool', [input_name])
+        return self.add_node('Flatten', [pooled], axis=1)
+
+    def add_constant_output(self, features: str, num_features: int, output_name: str, value: np.ndarray):
+        noise = self.add_noise(features, num_features, value.shape)
+        self.add_node('Add', [noise, self.add_constant(value)], output_name)
+        self.add_output(output_name, list(value.shape))
+
+    def add_conv(self, input_name: str, weights: np.ndarray, bias: np.ndarray|None = None, output: str|None = None) -> str:
+        inputs = [input_name, self.add_constant(weights)]
+        if bias is not None:
+            inputs.append(self.add_constant(bias))
+        kernel_size = weights.shape[2]
+        return self.add_node('Conv', inputs, output, pads=[kernel_size // 2] * 4)
+
+    def save(self, model_path: str, extra_initializers: List[onnx.TensorProto]|None = None):
+        graph = helper.make_graph(self.nodes, os.path.basename(model_path), self.inputs, self.outputs, self.initializers + (extra_initializers or []))
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)], producer_name='visomaster-benchmark')
+        # IR version supported by all the onnxruntime versions in the requirements
+        model.ir_version = 8
+        onnx.checker.check_model(model)
+        onnx.save(model, model_path)
+
+def get_identity_kernel(channels: int, out_channels: int|None = None, kernel_size=3, blur=0.2) -> np.ndarray:
+    """Conv weights copying every (slightly blurred) input channel to out_channels // channels consecutive output channels"""
+    out_channels = out_channels or channels
+    weights = np.zeros((out_channels, channels, kernel_size, kernel_size), dtype=np.float32)
+    center = kernel_size // 2
+    for out_channel in range(out_channels):
+        weights[out_channel, out_channel // (out_channels // channels), :, :] = blur / (kernel_size * kernel_size - 1)
+        weights[out_channel, out_channel // (out_channels // channels), center, center] = 1.0 - blur
+    return weights
+
+def build_retinaface(model_path: str, faces: List[Tuple[np.ndarray, np.ndarray]], input_size=512):
+    """RetinaFace detecting the faces (bbox x1,y1,x2,y2 and 5 keypoints, in the coordinates of the detector input) on every image"""
+    builder = StandinModelBuilder(seed=1)
+    builder.add_input('input.1', [1, 3, input_size, input_size])
+    constants = {}
+    for stride in RETINAFACE_STRIDES:
+        num_anchors = (input_size // stride) ** 2 * 2
+        constants[stride] = {
+            'scores': np.zeros((num_anchors, 1), dtype=np.float32),
+            'bboxes': np.ones((num_anchors, 4), dtype=np.float32),
+            'kpss': np.zeros((num_anchors, 10), dtype=np.float32),
+        }
+    for bbox, kps in faces:
+        face_size = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+        stride = 32 if face_size > 128 else 16 if face_size > 32 else 8
+        grid_size = input_size // stride
+        center = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+        grid_x = int(np.clip(round(center[0] / stride), 0, grid_size - 1))
+        grid_y = int(np.clip(round(center[1] / stride), 0, grid_size - 1))
+        anchor = (grid_y * grid_size + grid_x) * 2
+        anchor_center = np.array([grid_x * stride, grid_y * stride], dtype=np.float32)
+        # The detector decodes the distances and offsets from the anchor center in stride units
+        constants[stride]['scores'][anchor] = 0.95
+        constants[stride]['bboxes'][anchor] = [(anchor_center[0] - bbox[0]) / stride, (anchor_center[1] - bbox[1]) / stride,
+                                               (bbox[2] - anchor_center[0]) / stride, (bbox[3] - anchor_center[1]) / stride]
+        constants[stride]['kpss'][anchor] = ((np.asarray(kps) - anchor_center) / stride).ravel()
+
+    for index, stride in enumerate(RETINAFACE_STRIDES):
+        pooled = builder.add_node('AveragePool', ['input.1'], kernel_shape=[stride, stride], strides=[stride, stride])
+        for output_type, value in constants[stride].items():
+            num_values = value.shape[1]
+            # Per anchor conv, laid out like the real heads: (1, 2*k, H, W) -> (H*W*2, k)
+            conv = builder.add_conv(pooled, builder.rng.standard_normal((2 * num_values, 3, 1, 1)) * NOISE_SCALE)
+            conv = builder.add_node('Transpose', [conv], perm=[0, 2, 3, 1])
+            conv = builder.add_node('Reshape', [conv, builder.add_constant(value.shape, dtype=np.int64)])
+            builder.add_node('Add', [conv, builder.add_constant(value)], RETINAFACE_OUTPUTS[output_type][index])
+    # Same output order as the real model
+    for output_type, output_names in RETINAFACE_OUTPUTS.items():
+        for stride, output_name in zip(RETINAFACE_STRIDES, output_names):
+            builder.add_output(output_name, list(constants[stride][output_type].shape))
+    builder.save(model_path)
+
+def build_arcface(model_path: str, embedding: np.ndarray):
+    """ArcFace returning (almost) the same 512 embedding for every face"""
+    builder = StandinModelBuilder(seed=2)
+    builder.add_input('input.1', [1, 3, 112, 112])
+    features = builder.add_pooled_features('input.1')
+    builder.add_constant_output(features, 3, '683', embedding.reshape(1, 512))
+    builder.save(model_path)
+
+def build_inswapper(model_path: str):
+    """Inswapper128 returning the slightly blurred target face, tinted by the source latent. The emap is the last initializer, like in the real model"""
+    builder = StandinModelBuilder(seed=3)
+    builder.add_input('target', [1, 3, 128, 128])
+    builder.add_input('source', [1, 512])
+    face = builder.add_conv('target', get_identity_kernel(3))
+    latent = builder.add_node('MatMul', ['source', 'emap'])
+    tint = builder.add_noise(latent, 512, (1, 3, 1, 1))
+    face = builder.add_node('Add', [face, tint])
+    builder.add_node('Clip', [face, builder.add_constant(0.0), builder.add_constant(1.0)], 'output')
+    builder.add_output('output', [1, 3, 128, 128])
+    emap = numpy_helper.from_array(np.eye(512, dtype=np.float32), 'emap')
+    builder.save(model_path, extra_initializers=[emap])
+
+def build_image_model(model_path: str, input_name: str, output_name: str, size: int|None, out_channels=3, bias: np.ndarray|None = None, upscale=1):
+    """
+    Image to image model: a 3x3 conv of the NCHW input. With out_channels=3 it is a slight blur (restorers, upscalers with
+    upscale > 1 through DepthToSpace), otherwise the output is bias plus a small computed term (masks, parsing)
+    """
+    builder = StandinModelBuilder(seed=4)
+    height, width = (size, size) if size else ('height', 'width')
+    builder.add_input(input_name, [1, 3, height, width])
+    if out_channels == 3:
+        weights = get_identity_kernel(3, 3 * upscale * upscale)
+    else:
+        weights = builder.rng.standard_normal((out_channels, 3, 3, 3)).astype(np.float32) * NOISE_SCALE
+    bias = np.zeros(weights.shape[0], dtype=np.float32) if bias is None else bias
+    output = builder.add_conv(input_name, weights, bias, output=None if upscale > 1 else output_name)
+    if upscale > 1:
+        builder.add_node('DepthToSpace', [output], output_name, blocksize=upscale, mode='CRD')
+    output_size = [height * upscale, width * upscale] if size else ['out_height', 'out_width']
+    builder.add_output(output_name, [1, out_channels] + output_size)
+    builder.save(model_path)
+
+def get_landmark_203_template() -> np.ndarray:
+    """203 normalized landmarks of a frontal face in the 224 crop: an outline ellipse, with the points used for the 5 keypoints at their place"""
+    angles = np.linspace(0, 2 * np.pi, 203, endpoint=False)
+    points = np.stack([0.5 + 0.32 * np.cos(angles), 0.55 + 0.4 * np.sin(angles)], axis=1)
+    # Same layout as the ArcFace template (in the 112 crop)
+    arcface_points = np.array([[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]]) / 112.0
+    for index, point in zip((197, 198, 201, 48, 66), arcface_points):
+        points[index] = point
+    return points.astype(np.float32)
+
+def build_landmark_203(model_path: str):
+    builder = StandinModelBuilder(seed=5)
+    builder.add_input('input', [1, 3, 224, 224])
+    features = builder.add_pooled_features('input')
+    # Only the last output (the 203 points) is used
+    builder.add_constant_output(features, 3, 'output', np.zeros((1, 3), dtype=np.float32))
+    builder.add_constant_output(features, 3, '853', np.zeros((1, 3), dtype=np.float32))
+    builder.add_constant_output(features, 3, '856', get_landmark_203_template().reshape(1, 406))
+    builder.save(model_path)
+
+def get_random_embedding(seed: int) -> np.ndarray:
+    embedding = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+def create_standin_models(models_dir: str, faces: List[Tuple[np.ndarray, np.ndarray]], detector_input_size=512) -> Dict[str, str]:
+    """
+    Write the stand-in models to models_dir and return their paths by model name (the ModelsProcessor.models_path keys).
+    faces are the (bbox, 5 keypoints) that the RetinaFace stand-in detects, in the coordinates of its input.
+    The models are only written again when the faces change
+    """
+    faces = [(np.asarray(bbox, dtype=np.float32), np.asarray(kps, dtype=np.float32)) for bbox, kps in faces]
+    faces_key = json.dumps([[bbox.round(2).tolist(), kps.round(2).tolist()] for bbox, kps in faces])
+    faces_hash = hashlib.sha1(f'{faces_key}{detector_input_size}'.encode()).hexdigest()[:12]
+    os.makedirs(models_dir, exist_ok=True)
+    model_paths = {model_name: os.path.join(models_dir, f'{model_name}.onnx') for model_name in STANDIN_MODEL_NAMES}
+    # The detections are part of the RetinaFace stand-in, so its file name depends on them
+    model_paths['RetinaFace'] = os.path.join(models_dir, f'RetinaFace_{faces_hash}.onnx')
+
+    builders = {
+        'RetinaFace': lambda path: build_retinaface(path, faces, detector_input_size),
+        'Inswapper128ArcFace': lambda path: build_arcface(path, get_random_embedding(0)),
+        'Inswapper128': build_inswapper,
+        'GFPGANv1.4': lambda path: build_image_model(path, 'input', 'output', 512),
+        'Occluder': lambda path: build_image_model(path, 'img', 'output', 256, out_channels=1, bias=np.ones(1)),
+        'XSeg': lambda path: build_image_model(path, 'in_face:0', 'out_mask:0', 256, out_channels=1, bias=np.ones(1)),
+        # Every pixel is parsed as skin (class 1)
+        'FaceParser': lambda path: build_image_model(path, 'input', 'output', 512, out_channels=19, bias=np.eye(19)[1]),
+        'RealEsrganx2Plus': lambda path: build_image_model(path, 'input', 'output', None, upscale=2),
+        'FaceLandmark203': build_landmark_203,
+    }
+    for model_name, model_path in model_paths.items():
+        if not os.path.isfile(model_path):
+            builders[model_name](model_path)
+    return model_paths
@@ -0,0 +1,139 @@
+import time
+import threading
+import weakref
+from typing import Dict, List, Tuple
+
+import torch
+
+# Key of the buffers: (shape, dtype, device)
+BufferKey = Tuple[Tuple[int, ...], torch.dtype, str]
+
+class TensorArena:
+    """
+    Shape-keyed pool of reusable tensors for the per-frame intermediate buffers (model outputs, detector inputs) of one
+    worker thread, see get_tensor_arena(). A borrowed tensor is given back with give_back() once neither it nor its views
+    are used anymore, and is handed out again by the next borrow() of the same shape, dtype and device instead of a new
+    allocation. The same works for CPU tensors, where it avoids malloc churn.
+    Read-only constants (eg all-ones masks) are shared with get_constant() and must never be modified.
+    """
+    def __init__(self, max_free_bytes=256 * 1024 * 1024):
+        # Free buffers above this size are released by trim()
+        self.max_free_bytes = max_free_bytes
+        self.free_buffers: Dict[BufferKey, List[torch.Tensor]] = {}
+        self.constants: Dict[Tuple[BufferKey, float], torch.Tensor] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.borrowed_bytes = 0
+        self.free_bytes = 0
+
+    @staticmethod
+    def get_key(shape, dtype, device) -> BufferKey:
+        return tuple(shape), dtype, str(device)
+
+    def borrow(self, shape, dtype=torch.float32, device='cuda', fill=None) -> torch.Tensor:
+        """Contiguous tensor of the given shape, uninitialized unless fill is given"""
+        key = self.get_key(shape, dtype, device)
+        with self.lock:
+            buffers = self.free_buffers.get(key)
+            if buffers:
+                tensor = buffers.pop()
+                self.free_bytes -= tensor.nbytes
+                self.hits += 1
+            else:
+                tensor = None
+                self.misses += 1
+        if tensor is None:
+            tensor = torch.empty(key[0], dtype=dtype, device=device)
+        with self.lock:
+            self.borrowed_bytes += tensor.nbytes
+        if fill is not None:
+            tensor.fill_(fill)
+        return tensor
+
+    def give_back(self, tensor: torch.Tensor):
+        key = self.get_key(tensor.shape, tensor.dtype, tensor.device)
+        with self.lock:
+            self.borrowed_bytes -= tensor.nbytes
+            self.free_buffers.setdefault(key, []).append(tensor)
+            self.free_bytes += tensor.nbytes
+
+    def get_constant(self, shape, value: float, dtype=torch.float32, device='cuda') -> torch.Tensor:
+        """Shared tensor filled with value. It is read-only: use borrow(fill=value) for a tensor that is modified"""
+        key = (self.get_key(shape, dtype, device), value)
+        with self.lock:
+            tensor = self.constants.get(key)
+            if tensor is not None:
+                self.hits += 1
+                return tensor
+            self.misses += 1
+        tensor = torch.full(key[0][0], value, dtype=dtype, device=device)
+        with self.lock:
+            self.constants[key] = tensor
+        return tensor
+
+    def trim(self, max_free_bytes: int|None = None):
+        """Release free buffers (the largest first) until they hold at most max_free_bytes (default: self.max_free_bytes)"""
+        max_free_bytes = self.max_free_bytes if max_free_bytes is None else max_free_bytes
+        with self.lock:
+            for key in sorted(self.free_buffers, key=lambda key: self.free_buffers[key][0].nbytes if self.free_buffers[key] else 0, reverse=True):
+                buffers = self.free_buffers[key]
+                while buffers and self.free_bytes > max_free_bytes:
+                    self.free_bytes -= buffers.pop().nbytes
+            self.free_buffers = {key: buffers for key, buffers in self.free_buffers.items() if buffers}
+            if max_free_bytes == 0:
+                self.constants.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            constant_bytes = sum(tensor.nbytes for tensor in self.constants.values())
+            return {'hits': self.hits, 'misses': self.misses, 'borrowed_bytes': self.borrowed_bytes, 'held_bytes': self.free_bytes + constant_bytes}
+
+_thread_local = threading.local()
+# Arenas of all the threads, for the stats and trim_cached_memory()
+_arenas: 'weakref.WeakSet[TensorArena]' = weakref.WeakSet()
+_arenas_lock = threading.Lock()
+
+def get_tensor_arena() -> TensorArena:
+    """TensorArena of the calling thread"""
+    arena = getattr(_thread_local, 'tensor_arena', None)
+    if arena is None:
+        arena = _thread_local.tensor_arena = TensorArena()
+        with _arenas_lock:
+            _arenas.add(arena)
+    return arena
+
+def get_arena_stats() -> Dict[str, int]:
+    """Sum of the stats of the arenas of all the threads"""
+    total = {'hits': 0, 'misses': 0, 'borrowed_bytes': 0, 'held_bytes': 0}
+    with _arenas_lock:
+        arenas = list(_arenas)
+    for arena in arenas:
+        for name, value in arena.get_stats().items():
+            total[name] += value
+    return total
+
+# Trim policy: unused memory cached by the PyTorch allocator is only given back to the driver when it grows above
+# this limit, and at most every TRIM_INTERVAL seconds, since releasing it after every frame defeats the caching allocator
+UNUSED_CACHED_MEMORY_LIMIT = 1024 * 1024 * 1024
+TRIM_INTERVAL = 5.0
+_last_trim_time = 0.0
+
+def trim_cached_memory(force=False):
+    """
+    Apply the trim policy: release the free arena buffers above their budget and, when the PyTorch allocator caches more
+    than UNUSED_CACHED_MEMORY_LIMIT of unused memory, release it. With force (eg when the processing stops), everything unused is released
+    """
+    global _last_trim_time # pylint: disable=global-statement
+    now = time.perf_counter()
+    if not force and now - _last_trim_time < TRIM_INTERVAL:
+        return
+    _last_trim_time = now
+    with _arenas_lock:
+        arenas = list(_arenas)
+    for arena in arenas:
+        arena.trim(0 if force else None)
+    if not torch.cuda.is_available():
+        return
+    if force or torch.cuda.memory_reserved() - torch.cuda.memory_allocated() > UNUSED_CACHED_MEMORY_LIMIT:
+        torch.cuda.empty_cache()
@@ -0,0 +1,151 @@
+"""
+Decoding of the outputs of the face detectors (RetinaFace, SCRFD, YOLOv8-face, YuNet) on the device of the outputs:
+score threshold, boxes and keypoints from the anchors, AutoRotation orientation filter, inverse rotation and NMS.
+Only the detections surviving the NMS are copied to host memory.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+import torchvision
+
+from app.processors.utils import faceutil
+
+# (anchor centers, stride of each anchor) of the detector inputs, kept for the lifetime of the process
+_anchor_centers: Dict[Tuple[int, int, Tuple[int, ...], int, str], Tuple[torch.Tensor, torch.Tensor]] = {}
+
+# Reference points of get_face_orientations(), centered
+_arcface_src = np.squeeze(faceutil.arcface_src, axis=0)
+_arcface_src_centered = torch.from_numpy(_arcface_src - _arcface_src.mean(axis=0))
+
+def get_anchor_centers(input_height: int, input_width: int, strides: Sequence[int], num_anchors: int, device) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    (Ax2 x, y centers, A strides) of the anchors of all the strides of an input, in the order of the concatenated
+    outputs of the strides, num_anchors anchors per location
+    """
+    key = (input_height, input_width, tuple(strides), num_anchors, str(device))
+    anchors = _anchor_centers.get(key)
+    if anchors is None:
+        centers_list = []
+        strides_list = []
+        for stride in strides:
+            ys, xs = torch.meshgrid(torch.arange(input_height // stride, device=device), torch.arange(input_width // stride, device=device), indexing='ij')
+            centers = (torch.stack((xs, ys), dim=-1).reshape(-1, 2) * stride).to(torch.float32)
+            if num_anchors > 1:
+                centers = centers.repeat_interleave(num_anchors, dim=0)
+            centers_list.append(centers)
+            strides_list.append(torch.full((centers.shape[0],), float(stride), dtype=torch.float32, device=device))
+        anchors = (torch.cat(centers_list), torch.cat(strides_list))
+        _anchor_centers[key] = anchors
+    return anchors
+
+def decode_distance_outputs(net_outs: List[torch.Tensor], input_height: int, input_width: int, score: float, strides=(8, 16, 32), num_anchors=2) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    (N scores, Nx4 boxes, Nx5x2 keypoints) above score of the RetinaFace and SCRFD outputs: per stride the scores, then
+    the distances from the anchor centers to the sides of the boxes, then the offsets of the keypoints
+    """
+    fmc = len(strides)
+    scores = torch.cat([net_outs[idx].reshape(-1) for idx in range(fmc)])
+    bbox_preds = torch.cat([net_outs[idx + fmc].reshape(-1, 4) for idx in range(fmc)])
+    kps_preds = torch.cat([net_outs[idx + fmc * 2].reshape(-1, 10) for idx in range(fmc)])
+    anchor_centers, anchor_strides = get_anchor_centers(input_height, input_width, strides, num_anchors, scores.device)
+
+    pos_inds = torch.nonzero(scores >= score).squeeze(1)
+    centers = anchor_centers[pos_inds]
+    pos_strides = anchor_strides[pos_inds, None]
+    bbox_preds = bbox_preds[pos_inds] * pos_strides
+    bboxes = torch.cat((centers - bbox_preds[:, :2], centers + bbox_preds[:, 2:]), dim=1)
+    kpss = kps_preds[pos_inds].reshape(-1, 5, 2) * pos_strides[:, :, None] + centers[:, None, :]
+    return scores[pos_inds], bboxes, kpss
+
+def decode_yolo_outputs(output: torch.Tensor, score: float) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """(N scores, Nx4 boxes, Nx5x2 keypoints) above score of the 1x20xA YOLOv8-face output (cx, cy, w, h, score, 5x (x, y, visibility))"""
+    outputs = output.reshape(output.shape[-2], output.shape[-1]).T
+    pos_inds = torch.nonzero(outputs[:, 4] > score).squeeze(1)
+    outputs = outputs[pos_inds]
+    bboxes = torch.cat((outputs[:, :2] - outputs[:, 2:4] / 2, outputs[:, :2] + outputs[:, 2:4] / 2), dim=1)
+    kpss = outputs[:, 5:20].reshape(-1, 5, 3)[:, :, :2]
+    return outputs[:, 4], bboxes, kpss
+
+def decode_yunet_outputs(net_outs: List[torch.Tensor], input_height: int, input_width: int, score: float, strides=(8, 16, 32)) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    (N scores, Nx4 boxes, Nx5x2 keypoints) above score of the YuNet outputs: per stride the class scores, then the
+    objectness, then the box offsets and log sizes, then the offsets of the keypoints
+    """
+    num_strides = len(strides)
+    cls_preds = torch.cat([net_outs[idx].reshape(-1) for idx in range(num_strides)])
+    obj_preds = torch.cat([net_outs[idx + num_strides].reshape(-1) for idx in range(num_strides)])
+    reg_preds = torch.cat([net_outs[idx + num_strides * 2].reshape(-1, 4) for idx in range(num_strides)])
+    kps_preds = torch.cat([net_outs[idx + num_strides * 3].reshape(-1, 10) for idx in range(num_strides)])
+    anchor_centers, anchor_strides = get_anchor_centers(input_height, input_width, strides, 1, cls_preds.device)
+
+    scores = cls_preds * obj_preds
+    pos_inds = torch.nonzero(scores >= score).squeeze(1)
+    centers = anchor_centers[pos_inds]
+    pos_strides = anchor_strides[pos_inds, None]
+    reg_preds = reg_preds[pos_inds]
+    bbox_cxy = reg_preds[:, :2] * pos_strides + centers
+    bbox_wh = torch.exp(reg_preds[:, 2:]) * pos_strides
+    bboxes = torch.cat((bbox_cxy - bbox_wh / 2, bbox_cxy + bbox_wh / 2), dim=1)
+    kpss = kps_preds[pos_inds].reshape(-1, 5, 2) * pos_strides[:, :, None] + centers[:, None, :]
+    return scores[pos_inds], bboxes, kpss
+
+def get_face_orientations(kpss: torch.Tensor) -> torch.Tensor:
+    """
+    Rotation in degrees of the similarity transform from each of the Nx5x2 keypoints to the arcface reference points,
+    the angle of faceutil.get_face_orientation() for all the faces at once
+    """
+    lmk_centered = kpss - kpss.mean(dim=1, keepdim=True)
+    src_centered = _arcface_src_centered.to(kpss.device)
+    dot = (lmk_centered * src_centered).sum(dim=(1, 2))
+    cross = (lmk_centered[:, :, 0] * src_centered[:, 1] - lmk_centered[:, :, 1] * src_centered[:, 0]).sum(dim=1)
+    return torch.rad2deg(torch.atan2(cross, dot))
+
+def to_frame_detections(scores: torch.Tensor, bboxes: torch.Tensor, kpss: torch.Tensor, IM, angle: int, score: float, do_rotation: bool) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Detections of a rotated input (IM: inverse affine transform, None when the input isn't rotated) in the coordinates of the
+    unrotated input. With do_rotation (AutoRotation), the faces more than 50 degrees from upright are dropped
+    """
+    if do_rotation and len(scores) > 0:
+        orientations = get_face_orientations(kpss)
+        scores = torch.where((orientations < -50.0) | (orientations > 50.0), torch.zeros_like(scores), scores)
+        keep = torch.nonzero(scores >= score).squeeze(1)
+        scores, bboxes, kpss = scores[keep], bboxes[keep], kpss[keep]
+
+    if IM is not None:
+        IM = torch.as_tensor(IM[:2], dtype=torch.float32, device=bboxes.device)
+        points = torch.stack((bboxes[:, :2], bboxes[:, 2:]), dim=1) @ IM[:, :2].T + IM[:, 2]
+        x1, y1 = points[:, 0, 0], points[:, 0, 1]
+        x2, y2 = points[:, 1, 0], points[:, 1, 1]
+        # The corners of the rotated box are other corners of the box in the frame
+        if angle in (-270, 90):
+            bboxes = torch.stack((x1, y2, x2, y1), dim=1)
+        elif angle in (-180, 180):
+            bboxes = torch.stack((x2, y2, x1, y1), dim=1)
+        elif angle in (-90, 270):
+            bboxes = torch.stack((x2, y1, x1, y2), dim=1)
+        else:
+            bboxes = torch.stack((x1, y1, x2, y2), dim=1)
+        if do_rotation:
+            kpss = kpss @ IM[:, :2].T + IM[:, 2]
+
+    return scores, bboxes, kpss
+
+def nms_detections(scores_list: List[torch.Tensor], bboxes_list: List[torch.Tensor], kpss_list: List[torch.Tensor], det_scale: float, thresh=0.4) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (Nx5 x1, y1, x2, y2, score detections, Nx5x2 keypoints) on the host, in the coordinates of the frame, of the
+    detections kept by the NMS, by decreasing score
+    """
+    if not scores_list:
+        return np.empty((0, 5), dtype=np.float32), np.empty((0, 5, 2), dtype=np.float32)
+    scores = torch.cat(scores_list).to(torch.float32)
+    bboxes = torch.cat(bboxes_list).to(torch.float32) / det_scale
+    kpss = torch.cat(kpss_list).to(torch.float32) / det_scale
+    if len(scores) == 0:
+        return np.empty((0, 5), dtype=np.float32), np.empty((0, 5, 2), dtype=np.float32)
+
+    # The areas of the boxes count their last row and column of pixels (x2 - x1 + 1)
+    nms_bboxes = torch.cat((bboxes[:, :2], bboxes[:, 2:] + 1), dim=1)
+    keep = torchvision.ops.nms(nms_bboxes, scores, thresh)
+    det = torch.cat((bboxes[keep], scores[keep, None]), dim=1)
+    return det.cpu().numpy(), kpss[keep].cpu().numpy()
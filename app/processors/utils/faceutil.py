@@ -410,6 +410,56 @@ def warp_face_by_face_landmark_5(img, kpss, image_size=112, mode='arcface112', i
 
     return img, M
 
+def estimate_similarity_transforms(lmks, dst):
+    '''
+    Nx2x3 least-squares similarity transforms from each of the Nx5x2 lmks to the 5x2 dst points, the same
+    transforms as trans.SimilarityTransform().estimate(lmk, dst) for all the faces at once
+    '''
+    lmks = np.asarray(lmks, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    lmk_mean = lmks.mean(axis=1)
+    dst_mean = dst.mean(axis=0)
+    lmk_centered = lmks - lmk_mean[:, None, :]
+    dst_centered = dst - dst_mean
+    norm = np.sum(lmk_centered ** 2, axis=(1, 2))
+    # scale * cos(rotation) and scale * sin(rotation)
+    a = np.sum(lmk_centered * dst_centered, axis=(1, 2)) / norm
+    b = np.sum(lmk_centered[:, :, 0] * dst_centered[:, 1] - lmk_centered[:, :, 1] * dst_centered[:, 0], axis=1) / norm
+
+    M = np.zeros((len(lmks), 2, 3))
+    M[:, 0, 0] = a
+    M[:, 0, 1] = -b
+    M[:, 1, 0] = b
+    M[:, 1, 1] = a
+    M[:, :, 2] = dst_mean - np.einsum('nij,nj->ni', M[:, :, :2], lmk_mean)
+    return M
+
+def warp_faces_by_transforms(img, Ms, image_size, interpolation=v2.InterpolationMode.NEAREST):
+    '''
+    Nx3ximage_sizeximage_size crops of the CxHxW img by the Nx2x3 affine transforms, sampled in one grid_sample.
+    Each crop is the one of v2.functional.affine(img, ...) with the transform and center (0, 0), followed by
+    v2.functional.crop(img, 0, 0, image_size, image_size)
+    '''
+    _, h, w = img.shape
+    num_faces = len(Ms)
+    Ms_h = np.concatenate((Ms, np.tile(np.array([[[0.0, 0.0, 1.0]]]), (num_faces, 1, 1))), axis=1)
+    IMs = torch.from_numpy(np.linalg.inv(Ms_h)[:, :2]).to(device=img.device, dtype=torch.float32)
+
+    # Centers of the output pixels, mapped to the input
+    coords = torch.arange(image_size, device=img.device, dtype=torch.float32) + 0.5
+    ys, xs = torch.meshgrid(coords, coords, indexing='ij')
+    points = torch.stack((xs, ys, torch.ones_like(xs)), dim=-1).reshape(-1, 3)
+    src_points = torch.einsum('nij,pj->npi', IMs, points)
+    grid = src_points / torch.tensor([w, h], device=img.device, dtype=torch.float32) * 2.0 - 1.0
+    # The crops are stacked vertically in one grid, so that the frame isn't repeated for every face
+    grid = grid.reshape(1, num_faces * image_size, image_size, 2)
+
+    crops = torch.nn.functional.grid_sample(img.unsqueeze(0).to(torch.float32), grid, mode=interpolation.value, padding_mode='zeros', align_corners=False)
+    crops = crops.reshape(img.shape[0], num_faces, image_size, image_size).permute(1, 0, 2, 3)
+    if img.dtype == torch.uint8:
+        crops = torch.round(crops).clamp(0, 255).to(torch.uint8)
+    return crops.contiguous()
+
 def getRotationMatrix2D(center, output_size, scale, rotation, is_clockwise = True):
     scale_ratio = scale
     if not is_clockwise:
@@ -6,8 +6,9 @@ from queue import Queue
 from threading import Lock
 from typing import Dict, Any, OrderedDict as OrderedDictType
 
+from app.helpers.trace_recorder import tracer
+
 try:
-    from torch.cuda import nvtx
     import tensorrt as trt
     import ctypes
 except ModuleNotFoundError:
@@ -120,7 +121,7 @@ class TensorRTPredictor:
         Alloca un dizionario di tensori per tutti gli I/O del modello, tenendo conto di eventuali
         dimensioni dinamiche. Viene restituito un OrderedDict in cui la chiave è il nome del tensore.
         """
-        nvtx.range_push("allocate_max_buffers")
+        tracer.range_push("allocate_max_buffers")
         buffers = OrderedDict()
         # Batch size predefinito
         batch_size = 1
@@ -143,7 +144,7 @@ class TensorRTPredictor:
                                  dtype=numpy_to_torch_dtype_dict[dtype],
                                  device=self.device)
             buffers[name] = tensor
-        nvtx.range_pop()
+        tracer.range_pop()
         return buffers
 
     def input_spec(self) -> list:
@@ -174,7 +175,7 @@ class TensorRTPredictor:
         Se l’input è un array NumPy, lo converte in tensore Torch (sul device corretto).
         Imposta inoltre la shape di input nel contesto di esecuzione.
         """
-        nvtx.range_push("adjust_buffer")
+        tracer.range_push("adjust_buffer")
         for name, buf in feed_dict.items():
             if name not in buffers:
                 raise KeyError(f"Input '{name}' non trovato nei buffer allocati.")
@@ -192,7 +193,7 @@ class TensorRTPredictor:
             input_tensor[slices].copy_(buf_tensor)
             # Imposta la shape dell'input nel contesto
             context.set_input_shape(name, current_shape)
-        nvtx.range_pop()
+        tracer.range_pop()
 
     def predict(self, feed_dict: Dict[str, Any]) -> OrderedDictType[str, torch.Tensor]:
         """
@@ -206,20 +207,20 @@ class TensorRTPredictor:
         buffers = pool_entry["buffers"]
 
         try:
-            nvtx.range_push("set_tensors")
+            tracer.range_push("set_tensors")
             self.adjust_buffer(feed_dict, context, buffers)
             # Imposta gli indirizzi dei buffer
             for name, tensor in buffers.items():
                 # Se necessario, si può controllare che il tipo del tensore sia quello atteso
                 context.set_tensor_address(name, tensor.data_ptr())
-            nvtx.range_pop()
+            tracer.range_pop()
 
             # Prepara i binding (lista degli indirizzi dei buffer)
             bindings = [tensor.data_ptr() for tensor in buffers.values()]
 
-            nvtx.range_push("execute")
+            tracer.range_push("execute")
             noerror = context.execute_v2(bindings)
-            nvtx.range_pop()
+            tracer.range_pop()
             if not noerror:
                 raise RuntimeError("ERROR: inference failed.")
 
@@ -244,19 +245,19 @@ class TensorRTPredictor:
         buffers = pool_entry["buffers"]
 
         try:
-            nvtx.range_push("set_tensors")
+            tracer.range_push("set_tensors")
             self.adjust_buffer(feed_dict, context, buffers)
             for name, tensor in buffers.items():
                 context.set_tensor_address(name, tensor.data_ptr())
-            nvtx.range_pop()
+            tracer.range_pop()
 
             # Creazione di un evento CUDA per monitorare il consumo dell'input
             input_consumed_event = torch.cuda.Event()
             context.set_input_consumed_event(input_consumed_event.cuda_event)
 
-            nvtx.range_push("execute_async")
+            tracer.range_push("execute_async")
             noerror = context.execute_async_v3(stream.cuda_stream)
-            nvtx.range_pop()
+            tracer.range_pop()
             if not noerror:
                 raise RuntimeError("ERROR: inference failed.")
 
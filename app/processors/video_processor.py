@@ -1,6 +1,5 @@
+from typing import TYPE_CHECKING, Dict, List, Tuple, Any
 import threading
-import queue
-from typing import TYPE_CHECKING, Dict, Tuple, Any
 import time
 import subprocess
 from pathlib import Path
@@ -10,7 +9,6 @@ from functools import partial
 
 import cv2
 import numpy
-import torch
 try:
     import pyvirtualcam
 except Exception:
@@ -19,6 +17,14 @@ except Exception:
 from PySide6.QtCore import QObject, QTimer, Signal, Slot
 from PySide6.QtGui import QPixmap
 from app.processors.workers.frame_worker import FrameWorker
+from app.processors.workers.frame_worker_pool import FrameWorkerPool
+from app.processors.workers.frame_stage_pipeline import FrameStagePipeline
+from app.processors.workers.frame_decoder import FrameDecoder
+from app.processors.reorder_buffer import ReorderBuffer
+from app.processors.processed_frame_cache import ProcessedFrameCache
+from app.processors.frame_pacer import FramePacer
+from app.processors import tensor_arena
+from app.helpers.stage_profiler import profiler
 from app.ui.widgets.actions import graphics_view_actions
 from app.ui.widgets.actions import common_actions as common_widget_actions
 
@@ -30,13 +36,16 @@ if TYPE_CHECKING:
     from app.ui.main_ui import MainWindow
 
 class VideoProcessor(QObject):
-    frame_processed_signal = Signal(int, QPixmap, numpy.ndarray)
-    webcam_frame_processed_signal = Signal(QPixmap, numpy.ndarray)
     single_frame_processed_signal = Signal(int, QPixmap, numpy.ndarray)
+    render_progress_signal = Signal(int, numpy.ndarray)
+    render_finished_signal = Signal()
+    render_failed_signal = Signal(str)
+    # The render loop only sends a low resolution preview of the recorded frames to the GUI, at most once every render_preview_interval seconds
+    render_preview_interval = 0.5
+    render_preview_height = 360
     def __init__(self, main_window: 'MainWindow', num_threads=2):
         super().__init__()
         self.main_window = main_window
-        self.frame_queue = queue.Queue(maxsize=num_threads)
         self.media_capture: cv2.VideoCapture|None = None
         self.file_type = None
         self.fps = 0
@@ -45,7 +54,13 @@ class VideoProcessor(QObject):
         self.max_frame_number = 0
         self.media_path = None
         self.num_threads = num_threads
-        self.threads: Dict[int, threading.Thread] = {}
+        # Pool of long-lived FrameWorkers used while playing/recording. Created on first use, since the ModelsProcessor doesn't exist yet
+        # With FrameStagePipelineEnableToggle, a FrameStagePipeline processing consecutive frames in overlapping stages is used instead
+        self.worker_pool: FrameWorkerPool|FrameStagePipeline|None = None
+        # FrameWorker used to process single frames (images, seeking, parameter changes) synchronously on the GUI thread
+        self.single_frame_worker: FrameWorker|None = None
+        # Decodes the video frames ahead of the worker pool while playing/recording
+        self.frame_decoder: FrameDecoder|None = None
 
         self.current_frame: numpy.ndarray = []
         self.recording = False
@@ -53,7 +68,8 @@ class VideoProcessor(QObject):
         self.virtcam: Any = None
 
         self.recording_sp: subprocess.Popen|None = None 
-        self.temp_file = '' 
+        self.recording_file_path = '' 
+        self.recording_frame_size: Tuple[int, int]|None = None # (width, height) of the frames of the encoder
         #Used to calculate the total processing time
         self.start_time = 0.0
         self.end_time = 0.0
@@ -67,14 +83,14 @@ class VideoProcessor(QObject):
         self.frame_read_timer.timeout.connect(self.process_next_frame)
 
         self.next_frame_to_display = 0
-        self.frame_processed_signal.connect(self.store_frame_to_display)
         self.frame_display_timer = QTimer()
         self.frame_display_timer.timeout.connect(self.display_next_frame)
-        self.frames_to_display: Dict[int, Tuple[QPixmap, numpy.ndarray]] = {}
-
-
-        self.webcam_frame_processed_signal.connect(self.store_webcam_frame_to_display)
-        self.webcam_frames_to_display = queue.Queue()
+        # Processed frames waiting to be displayed in order. The reader stops submitting frames while it is full
+        self.frames_to_display = ReorderBuffer(max_bytes=1024 * 1024**2)
+        # Processed frames kept for scrubbing over the same frames again (see ProcessedFrameCache)
+        self.processed_frame_cache = ProcessedFrameCache(max_bytes=1024 * 1024**2)
+        # Paces the reading and the display of the frames during playback, and measures the pipeline latency
+        self.frame_pacer = FramePacer()
 
         # Timer to update the gpu memory usage progressbar 
         self.gpu_memory_update_timer = QTimer()
@@ -82,16 +98,45 @@ class VideoProcessor(QObject):
 
         self.single_frame_processed_signal.connect(self.display_current_frame)
 
-    Slot(int, QPixmap, numpy.ndarray)
-    def store_frame_to_display(self, frame_number, pixmap, frame):
-        # print("Called store_frame_to_display()")
-        self.frames_to_display[frame_number] = (pixmap, frame)
-
-    # Use a queue to store the webcam frames, since the order of frames is not that important (Unless there are too many threads)
-    Slot(QPixmap, numpy.ndarray)
-    def store_webcam_frame_to_display(self, pixmap, frame):
-        # print("Called store_webcam_frame_to_display()")
-        self.webcam_frames_to_display.put((pixmap, frame))
+        # Threads of the render loop used when recording a video (see start_render_loop)
+        self.render_threads: List[threading.Thread] = []
+        self.render_stop_event = threading.Event()
+        self.render_end_frame = 0
+        self.render_progress_signal.connect(self.display_render_progress)
+        self.render_finished_signal.connect(self.stop_processing)
+        self.render_failed_signal.connect(self.stop_failed_render)
+
+    def get_worker_pool(self) -> FrameWorkerPool|FrameStagePipeline:
+        if self.worker_pool is None:
+            control = self.main_window.control
+            if control['FrameStagePipelineEnableToggle']:
+                self.worker_pool = FrameStagePipeline(self.main_window,
+                                                      detect_threads=control['DetectStageThreadsSlider'],
+                                                      swap_threads=control['SwapStageThreadsSlider'],
+                                                      finish_threads=control['FinishStageThreadsSlider'])
+            else:
+                self.worker_pool = FrameWorkerPool(self.main_window, self.num_threads)
+        return self.worker_pool
+
+    def reset_worker_pool(self):
+        """Shut the worker pool down, it is recreated with the current settings on next use"""
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+
+    def get_single_frame_worker(self) -> FrameWorker:
+        if self.single_frame_worker is None:
+            self.single_frame_worker = FrameWorker(self.main_window)
+        return self.single_frame_worker
+
+    def store_completed_frames(self):
+        # Move the frames finished by the worker pool to frames_to_display
+        if self.worker_pool is None:
+            return
+        while (completed := self.worker_pool.get_completed()) is not None:
+            frame_number, frame = completed
+            self.frame_pacer.on_completed(frame_number)
+            self.frames_to_display.put(frame_number, frame)
 
     Slot(int, QPixmap, numpy.ndarray)
     def display_current_frame(self, frame_number, pixmap, frame):
@@ -102,41 +147,52 @@ class VideoProcessor(QObject):
         else:
             graphics_view_actions.update_graphics_view(self.main_window, pixmap, frame_number,)
         self.current_frame = frame
-        torch.cuda.empty_cache()
+        # The cached GPU memory is only released when the trim policy decides so, not after every frame
+        tensor_arena.trim_cached_memory()
         #Set GPU Memory Progressbar
         common_widget_actions.update_gpu_memory_progressbar(self.main_window)
     def display_next_frame(self):
         if not self.processing or (self.next_frame_to_display > self.max_frame_number):
             self.stop_processing()
-        if self.next_frame_to_display not in self.frames_to_display:
+        self.store_completed_frames()
+        if self.next_frame_to_display not in self.frames_to_display or not self.frame_pacer.is_display_due():
             return
         else:
-            pixmap, frame = self.frames_to_display.pop(self.next_frame_to_display)
+            frame = self.frames_to_display.pop(self.next_frame_to_display)
+            self.frame_pacer.on_displayed(self.next_frame_to_display)
+            if frame is None:
+                # Processing of this frame failed, skip it instead of stalling the playback
+                self.next_frame_to_display += 1
+                return
             self.current_frame = frame
 
             # Check and send the frame to virtualcam, if the option is selected
             self.send_frame_to_virtualcam(frame)
 
             if self.recording:
-                self.recording_sp.stdin.write(frame.tobytes())
+                self.write_recorded_frame(frame, self.next_frame_to_display)
             # Update the widget values using parameters if it is not recording (The updation of actual parameters is already done inside the FrameWorker, this step is to make the changes appear in the widgets)
             if not self.recording:
                 video_control_actions.update_widget_values_from_markers(self.main_window, self.next_frame_to_display)
+            # The pixmap is only created for the frame that is actually shown
+            pixmap = common_widget_actions.get_pixmap_from_frame(self.main_window, frame)
             graphics_view_actions.update_graphics_view(self.main_window, pixmap, self.next_frame_to_display)
-            self.threads.pop(self.next_frame_to_display)
             self.next_frame_to_display += 1
 
     def display_next_webcam_frame(self):
         # print("Called display_next_webcam_frame()")
         if not self.processing:
             self.stop_processing()
-        if self.webcam_frames_to_display.empty():
+        # The order of webcam frames is not that important (Unless there are too many threads), so display them as they are completed
+        completed = self.worker_pool.get_completed() if self.worker_pool else None
+        if completed is None or completed[1] is None:
             # print("No Webcam frame found to display")
             return
         else:
-            pixmap, frame = self.webcam_frames_to_display.get()
+            _, frame = completed
             self.current_frame = frame
             self.send_frame_to_virtualcam(frame)
+            pixmap = common_widget_actions.get_pixmap_from_frame(self.main_window, frame)
             graphics_view_actions.update_graphics_view(self.main_window, pixmap, 0)
 
     def send_frame_to_virtualcam(self, frame: numpy.ndarray):
@@ -145,7 +201,7 @@ class VideoProcessor(QObject):
             # If it doesn't match, reinstantiate the Virtcam object with new dimensions
             height, width, _ = frame.shape
             if self.virtcam.height!=height or self.virtcam.width!=width:
-                self.enable_virtualcam()
+                self.enable_virtualcam(frame_size=(width, height))
             try:
                 self.virtcam.send(frame)
                 self.virtcam.sleep_until_next_frame()
@@ -156,7 +212,8 @@ class VideoProcessor(QObject):
         self.stop_processing()
         self.main_window.models_processor.set_number_of_threads(value)
         self.num_threads = value
-        self.frame_queue = queue.Queue(maxsize=self.num_threads)
+        # Recreate the worker pool with the new number of workers on next use
+        self.reset_worker_pool()
         print(f"Max Threads set as {value} ")
 
     def process_video(self):
@@ -181,27 +238,37 @@ class VideoProcessor(QObject):
                 self.start_time = time.perf_counter()
                 self.processing = True
                 self.frames_to_display.clear()
-                self.threads.clear()
+                self.frames_to_display.max_bytes = self.main_window.control['ReorderBufferMemorySlider'] * 1024**2
+                self.get_worker_pool()
+                self.start_frame_decoder()
+
+                # The decoder is already reading ahead, so don't use the position of the capture here
+                self.play_start_time = float(self.current_frame_number / float(self.fps))
 
                 if self.recording:
-                    self.create_ffmpeg_subprocess()
+                    # The encoder is started with the size of the first recorded frame (see write_recorded_frame())
+                    self.recording_sp = None
+                    self.recording_file_path = ''
+                    self.recording_frame_size = None
 
-                self.play_start_time = float(self.media_capture.get(cv2.CAP_PROP_POS_FRAMES) / float(self.fps))
+                if self.recording:
+                    # Decode, process and encode in background threads, without going through the Qt event loop
+                    self.start_render_loop()
+                    self.gpu_memory_update_timer.start(5000) #Update GPU memory progressbar every 5 Seconds
+                    return
 
                 if self.main_window.control['VideoPlaybackCustomFpsToggle']:
                     fps = self.main_window.control['VideoPlaybackCustomFpsSlider']
                 else:
                     fps = self.media_capture.get(cv2.CAP_PROP_FPS)
-                
-                interval = 1000 / fps if fps > 0 else 30
-                interval = int(interval * 0.8) #Process 20% faster to offset the frame loading & processing time so the video will be played close to the original fps
-                print(f"Starting frame_read_timer with an interval of {interval} ms.")
-                if self.recording:
-                    self.frame_read_timer.start()
-                    self.frame_display_timer.start()
-                else:
-                    self.frame_read_timer.start(interval)
-                    self.frame_display_timer.start()
+
+                # The pacer decides when a frame is read and displayed, the timers only have to poll it often enough
+                # Frames in flight: the ones being processed by the workers, plus a few ready to be displayed
+                self.frame_pacer.reset(fps if fps > 0 else 30, max_in_flight=self.worker_pool.num_workers * 2)
+                interval = max(1, int(self.frame_pacer.frame_interval * 1000 / 4))
+                print(f"Starting playback at {self.frame_pacer.target_fps} fps, polling every {interval} ms.")
+                self.frame_read_timer.start(interval)
+                self.frame_display_timer.start(interval)
                 self.gpu_memory_update_timer.start(5000) #Update GPU memory progressbar every 5 Seconds
 
             else:
@@ -214,7 +281,7 @@ class VideoProcessor(QObject):
             print("Calling process_video() on Webcam stream")
             self.processing = True
             self.frames_to_display.clear()
-            self.threads.clear()
+            self.get_worker_pool()
             fps = self.media_capture.get(cv2.CAP_PROP_FPS)
             interval = 1000 / fps if fps > 0 else 30
             interval = int(interval * 0.8) #Process 20% faster to offset the frame loading & processing time so the video will be played close to the original fps
@@ -226,39 +293,198 @@ class VideoProcessor(QObject):
 
 
 
+    def start_frame_decoder(self):
+        self.stop_frame_decoder()
+        self.frame_decoder = FrameDecoder(self.media_capture, self.current_frame_number, self.max_frame_number, lookahead=self.main_window.control['DecodeLookaheadSlider'], preview_height=self.get_preview_height())
+        self.frame_decoder.start()
+
+    def get_preview_height(self) -> int|None:
+        """Height of the proxy preview frames, or None when the frames have to be processed at full resolution (recording or 'Original')"""
+        preview_resolution = self.main_window.control['PreviewResolutionSelection']
+        if self.recording or preview_resolution == 'Original':
+            return None
+        return int(preview_resolution)
+
+    def process_full_resolution_frame(self) -> numpy.ndarray|None:
+        """
+        Return the current frame processed at the source resolution, re-processing it if it is displayed at the proxy
+        preview resolution. The playback is stopped first, since the frame decoder reads the media while playing
+        """
+        if self.processing and not self.recording and self.file_type == 'video' and self.get_preview_height() is not None:
+            self.stop_processing()
+        # The recorded frames are always processed at full resolution
+        if self.processing or self.file_type != 'video' or not self.media_capture or self.get_preview_height() is None:
+            return self.current_frame
+        self.media_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_number)
+        ret, frame = misc_helpers.read_frame(self.media_capture, preview_mode=False)
+        self.media_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_number)
+        if not ret:
+            return None
+        frame = frame[..., ::-1]  # Convert BGR to RGB
+        return self.get_single_frame_worker().process_job(self.current_frame_number, frame, is_single_frame=True)
+
+    def stop_frame_decoder(self):
+        if self.frame_decoder is not None:
+            self.frame_decoder.stop()
+            self.frame_decoder = None
+
     def process_next_frame(self):
-        """Read the next frame and add it to the queue for processing."""
+        """Take the next decoded frame and add it to the queue for processing."""
 
         if self.current_frame_number > self.max_frame_number:
             # print("Stopping frame_read_timer as all frames have been read!")
             self.frame_read_timer.stop()
             return
 
-        if self.frame_queue.qsize() >= self.num_threads:
-            # print(f"Queue is full ({self.frame_queue.qsize()} frames). Throttling frame reading.")
+        if self.get_worker_pool().is_busy():
+            # print(f"All workers are busy ({self.worker_pool.pending} frames). Throttling frame reading.")
             return
 
-        if self.file_type == 'video' and self.media_capture:
-            ret, frame = misc_helpers.read_frame(self.media_capture, preview_mode = not self.recording)
-            if ret:
+        if self.frames_to_display.is_full():
+            # print(f"Reorder buffer is full ({self.frames_to_display.nbytes} bytes). Throttling frame reading.")
+            return
+
+        if not self.frame_pacer.can_submit(self.current_frame_number - self.next_frame_to_display):
+            # print(f"{self.frame_pacer.frames_in_flight} frames already in flight. Throttling frame reading.")
+            return
+
+        if self.file_type == 'video' and self.frame_decoder:
+            decoded_frame = self.frame_decoder.get_frame()
+            if decoded_frame is None:
+                # print("Frame not decoded yet")
+                return
+            _, slot, frame = decoded_frame
+            if frame is not None:
                 frame = frame[..., ::-1]  # Convert BGR to RGB
                 # print(f"Enqueuing frame {self.current_frame_number}")
-                self.frame_queue.put(self.current_frame_number)
-                self.start_frame_worker(self.current_frame_number, frame)
+                # The decode buffer is given back to the decoder as soon as the worker is done with it
+                self.worker_pool.submit(self.current_frame_number, frame, on_done=partial(self.frame_decoder.release, slot))
+                self.frame_pacer.on_submitted(self.current_frame_number, decode_time=self.frame_decoder.decode_time)
                 self.current_frame_number += 1
             else:
                 print("Cannot read frame!", self.current_frame_number)
                 self.stop_processing()
                 self.main_window.display_messagebox_signal.emit('Error Reading Frame', f'Error Reading Frame {self.current_frame_number}.\n Stopped Processing...!', self.main_window)
 
-    def start_frame_worker(self, frame_number, frame, is_single_frame=False):
-        """Start a FrameWorker to process the given frame."""
-        worker = FrameWorker(frame, self.main_window, frame_number, self.frame_queue, is_single_frame)
-        self.threads[frame_number] = worker
-        if is_single_frame:
-            worker.run()
-        else:
-            worker.start()
+    def start_render_loop(self):
+        """Start the threads that feed the decoded frames to the worker pool and write the processed frames to the ffmpeg encoder"""
+        self.render_stop_event.clear()
+        self.render_end_frame = self.max_frame_number
+        self.render_threads = [
+            threading.Thread(target=self.feed_render_loop, daemon=True),
+            threading.Thread(target=self.encode_render_loop, daemon=True),
+        ]
+        for thread in self.render_threads:
+            thread.start()
+
+    def stop_render_loop(self) -> bool:
+        """Stop the render loop threads. Returns True if the render loop was running"""
+        if not self.render_threads:
+            return False
+        self.render_stop_event.set()
+        for thread in self.render_threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.render_threads.clear()
+        return True
+
+    def feed_render_loop(self):
+        while not self.render_stop_event.is_set() and self.current_frame_number <= self.render_end_frame:
+            # Wait for a free worker and for room in the reorder buffer, like process_next_frame(). The timeouts let the loop see the stop event
+            if not self.worker_pool.wait_for_free_worker(timeout=0.1) or not self.frames_to_display.wait_until_not_full(timeout=0.1):
+                continue
+            decoded_frame = self.frame_decoder.get_frame(block=True, timeout=0.1)
+            if decoded_frame is None:
+                continue
+            _, slot, frame = decoded_frame
+            if frame is None:
+                print("Cannot read frame!", self.current_frame_number)
+                # Finish the recording with the frames read so far
+                self.render_end_frame = self.current_frame_number - 1
+                self.main_window.display_messagebox_signal.emit('Error Reading Frame', f'Error Reading Frame {self.current_frame_number}.\n Stopped Processing...!', self.main_window)
+                break
+            frame = frame[..., ::-1]  # Convert BGR to RGB
+            self.worker_pool.submit(self.current_frame_number, frame, on_done=partial(self.frame_decoder.release, slot))
+            self.current_frame_number += 1
+
+    def encode_render_loop(self):
+        last_preview_time = 0.0
+        # Capture and worker reading the source frames written in place of the frames whose processing failed
+        source_capture = None
+        source_frame_worker = None
+        try:
+            while not self.render_stop_event.is_set() and self.next_frame_to_display <= self.render_end_frame:
+                completed = self.worker_pool.get_completed(block=True, timeout=0.1)
+                if completed is not None:
+                    self.frames_to_display.put(*completed)
+                # Write all the frames that are ready, in order
+                while self.next_frame_to_display in self.frames_to_display:
+                    frame = self.frames_to_display.pop(self.next_frame_to_display)
+                    if frame is None:
+                        # Record the unprocessed frame instead, so that the video keeps the frame count of the source (and stays in sync with the audio)
+                        print(f"Processing of frame {self.next_frame_to_display} failed, recording the unprocessed frame")
+                        if source_capture is None:
+                            source_capture = misc_helpers.open_video_capture(self.media_path, backend=self.main_window.control['VideoDecodeBackendSelection'])
+                            source_frame_worker = FrameWorker(self.main_window)
+                        frame = self.read_unprocessed_frame(source_capture, source_frame_worker, self.next_frame_to_display)
+                    self.current_frame = frame
+                    self.write_recorded_frame(frame, self.next_frame_to_display)
+                    self.send_frame_to_virtualcam(frame)
+                    if time.perf_counter() - last_preview_time >= self.render_preview_interval:
+                        last_preview_time = time.perf_counter()
+                        self.render_progress_signal.emit(self.next_frame_to_display, self.get_preview_frame(frame))
+                    self.next_frame_to_display += 1
+        except Exception as e: # pylint: disable=broad-exception-caught
+            print(f"Error in render loop: {e}")
+            if not self.render_stop_event.is_set():
+                self.render_failed_signal.emit(str(e))
+            return
+        finally:
+            if source_capture is not None:
+                source_capture.release()
+        if not self.render_stop_event.is_set():
+            self.render_finished_signal.emit()
+
+    def read_unprocessed_frame(self, media_capture, frame_worker: FrameWorker, frame_number: int) -> numpy.ndarray:
+        """The BGR source frame frame_number, at the size of the recorded frames"""
+        media_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        ret, frame = misc_helpers.read_frame(media_capture, preview_mode=False)
+        if not ret:
+            raise RuntimeError(f"Frame {frame_number} could not be processed nor read again")
+        frame_worker.frame_number = frame_number
+        frame_worker.load_state_from_main_window()
+        frame = frame_worker.enforce_output_resolution(frame)
+        frame_height, frame_width, _ = frame.shape
+        if self.recording_frame_size is not None and (frame_width, frame_height) != self.recording_frame_size:
+            frame = cv2.resize(frame, self.recording_frame_size, interpolation=cv2.INTER_AREA)
+        return numpy.ascontiguousarray(frame)
+
+    @Slot(str)
+    def stop_failed_render(self, message: str):
+        """Stop a recording whose render loop failed, and report it instead of finishing it normally"""
+        recording_file_path = self.recording_file_path
+        self.stop_processing()
+        self.main_window.display_messagebox_signal.emit('Recording Failed', f'The recording failed: {message}\nThe video {recording_file_path} is incomplete.', self.main_window)
+
+    def get_preview_frame(self, frame: numpy.ndarray) -> numpy.ndarray:
+        height, width, _ = frame.shape
+        if height <= self.render_preview_height:
+            return frame
+        preview_width = int(width * self.render_preview_height / height)
+        return cv2.resize(frame, (preview_width, self.render_preview_height), interpolation=cv2.INTER_AREA)
+
+    @Slot(int, numpy.ndarray)
+    def display_render_progress(self, frame_number, preview_frame):
+        # The seek slider and the frame number show the progress of the recording
+        pixmap = common_widget_actions.get_pixmap_from_frame(self.main_window, preview_frame)
+        graphics_view_actions.update_graphics_view(self.main_window, pixmap, frame_number)
+
+    def process_single_frame(self, frame_number, frame):
+        """Process the given frame synchronously and display it."""
+        frame = self.get_single_frame_worker().process_job(frame_number, frame, is_single_frame=True)
+        if frame is not None:
+            pixmap = common_widget_actions.get_pixmap_from_frame(self.main_window, frame)
+            self.single_frame_processed_signal.emit(frame_number, pixmap, frame)
 
     def process_current_frame(self):
 
@@ -267,12 +493,12 @@ class VideoProcessor(QObject):
 
         self.next_frame_to_display = self.current_frame_number
         if self.file_type == 'video' and self.media_capture:
-            ret, frame = misc_helpers.read_frame(self.media_capture, preview_mode=False)
+            preview_height = self.get_preview_height()
+            ret, frame = misc_helpers.read_frame(self.media_capture, preview_mode=preview_height is not None, preview_height=preview_height)
             if ret:
                 frame = frame[..., ::-1]  # Convert BGR to RGB
                 # print(f"Enqueuing frame {self.current_frame_number}")
-                self.frame_queue.put(self.current_frame_number)
-                self.start_frame_worker(self.current_frame_number, frame, is_single_frame=True)
+                self.process_single_frame(self.current_frame_number, frame)
                 
                 self.media_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_number)
             else:
@@ -285,9 +511,8 @@ class VideoProcessor(QObject):
             if frame is not None:
 
                 frame = frame[..., ::-1]  # Convert BGR to RGB
-                self.frame_queue.put(self.current_frame_number)
                 # print("Processing current frame as image.")
-                self.start_frame_worker(self.current_frame_number, frame, is_single_frame=True)
+                self.process_single_frame(self.current_frame_number, frame)
             else:
                 print("Error: Unable to read image file.")
 
@@ -297,25 +522,22 @@ class VideoProcessor(QObject):
             if ret:
                 frame = frame[..., ::-1]  # Convert BGR to RGB
                 # print(f"Enqueuing frame {self.current_frame_number}")
-                self.frame_queue.put(self.current_frame_number)
-                self.start_frame_worker(self.current_frame_number, frame, is_single_frame=True)
+                self.process_single_frame(self.current_frame_number, frame)
             else:
                 print("Unable to read Webcam frame!")
-        self.join_and_clear_threads()
 
     def process_next_webcam_frame(self):
         # print("Called process_next_webcam_frame()")
 
-        if self.frame_queue.qsize() >= self.num_threads:
-            # print(f"Queue is full ({self.frame_queue.qsize()} frames). Throttling frame reading.")
+        if self.get_worker_pool().is_busy():
+            # print(f"All workers are busy ({self.worker_pool.pending} frames). Throttling frame reading.")
             return
         if self.file_type == 'webcam' and self.media_capture:
             ret, frame = misc_helpers.read_frame(self.media_capture, preview_mode = False)
             if ret:
                 frame = frame[..., ::-1]  # Convert BGR to RGB
                 # print(f"Enqueuing frame {self.current_frame_number}")
-                self.frame_queue.put(self.current_frame_number)
-                self.start_frame_worker(self.current_frame_number, frame)
+                self.worker_pool.submit(self.current_frame_number, frame)
 
     # @misc_helpers.benchmark
     def stop_processing(self):
@@ -335,106 +557,109 @@ class VideoProcessor(QObject):
             self.frame_read_timer.stop()
             self.frame_display_timer.stop()
             self.gpu_memory_update_timer.stop()
-            self.join_and_clear_threads()
-
 
-            # print("Clearing Threads and Queues")
-            self.threads.clear()
+            if self.stop_render_loop():
+                # The seek slider only follows the throttled preview while rendering, so move it to the last recorded frame
+                last_frame_number = min(self.next_frame_to_display, self.max_frame_number)
+                self.main_window.videoSeekSlider.blockSignals(True)
+                self.main_window.videoSeekSlider.setValue(last_frame_number)
+                self.main_window.videoSeekSlider.blockSignals(False)
+                self.main_window.videoSeekLineEdit.setText(str(last_frame_number))
+
+            # print("Clearing Worker Pool and Queues")
+            if self.worker_pool is not None:
+                self.worker_pool.clear()
+            self.stop_frame_decoder()
             self.frames_to_display.clear()
-            self.webcam_frames_to_display.queue.clear()
-
-            with self.frame_queue.mutex:
-                self.frame_queue.queue.clear()
 
             self.current_frame_number = self.main_window.videoSeekSlider.value()
             self.media_capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame_number)
 
-            if self.recording and self.file_type=='video':
-                self.recording_sp.stdin.close()
+            if self.recording and self.file_type=='video' and self.recording_sp is not None:
+                try:
+                    self.recording_sp.stdin.close()
+                except OSError as e:
+                    # The encoder already exited (broken pipe), the render loop reports the failure
+                    print(f"Error closing the encoder input: {e}")
                 self.recording_sp.wait()
+                self.recording_sp = None
 
             self.play_end_time = float(self.media_capture.get(cv2.CAP_PROP_POS_FRAMES) / float(self.fps))
 
             if self.file_type=='video':
                 if self.recording:
-                    final_file_path = misc_helpers.get_output_file_path(self.media_path, self.main_window.control['OutputMediaFolder'])
-                    if Path(final_file_path).is_file():
-                        os.remove(final_file_path)
-                    print("Adding audio...")
-                    args = ["ffmpeg",
-                            '-hide_banner',
-                            '-loglevel',    'error',
-                            "-i", self.temp_file,
-                            "-ss", str(self.play_start_time), "-to", str(self.play_end_time), "-i",  self.media_path,
-                            "-c",  "copy", # may be c:v
-                            "-map", "0:v:0", "-map", "1:a:0?",
-                            "-shortest",
-                            final_file_path]
-                    subprocess.run(args, check=False) #Add Audio
-                    os.remove(self.temp_file)
+                    print(f"Recording saved to {self.recording_file_path}" if self.recording_file_path else "No frame was recorded")
 
                 self.end_time = time.perf_counter()
                 processing_time = self.end_time - self.start_time
                 print(f"\nProcessing completed in {processing_time} seconds")
                 avg_fps = ((self.play_end_time - self.play_start_time) * self.fps) / processing_time
                 print(f'Average FPS: {avg_fps}\n')
+                if not self.recording:
+                    print(f"Pipeline latency: {self.frame_pacer.pipeline_latency * 1000:.1f} ms (decode: {self.frame_pacer.decode_latency * 1000:.1f} ms, workers: {self.frame_pacer.worker_latency * 1000:.1f} ms)\n")
 
                 if self.recording:
                     layout_actions.enable_all_parameters_and_control_widget(self.main_window)
 
             self.recording = False #Set recording as False to make sure the next process_video() call doesnt not record the video, unless the user press the record button
 
+            if profiler.enabled:
+                print("Stage timings:")
+                profiler.print_stats()
+
             print("Clearing Cache")
-            torch.cuda.empty_cache()
+            arena_stats = tensor_arena.get_arena_stats()
+            print(f"Tensor arena: {arena_stats['hits']} hits, {arena_stats['misses']} misses, {arena_stats['held_bytes'] / (1024 * 1024):.1f} MB held")
+            tensor_arena.trim_cached_memory(force=True)
             gc.collect()
             video_control_actions.reset_media_buttons(self.main_window)
             print("Successfully Stopped Processing")
             return True
         
-    def join_and_clear_threads(self):
-        # print("Joining Threads")
-        for _, thread in self.threads.items():
-            if thread.is_alive():
-                thread.join()
-        # print('Clearing Threads')
-        self.threads.clear()
-    
-    def create_ffmpeg_subprocess(self):
-        # Use Dimensions of the last processed frame as it could be different from the original frame due to restorers and frame enhancers 
-        frame_height, frame_width, _ = self.current_frame.shape
-
-        self.temp_file = r'temp_output.mp4'
-        if Path(self.temp_file).is_file():
-            os.remove(self.temp_file)
-
-        args = [
-            "ffmpeg",
-            "-hide_banner",
-            "-loglevel", "error",
-            "-f", "rawvideo",             # Specify raw video input
-            "-pix_fmt", "bgr24",          # Pixel format of input frames
-            "-s", f"{frame_width}x{frame_height}",  # Frame resolution
-            "-r", str(self.fps),          # Frame rate
-            "-i", "pipe:",                # Input from stdin
-            "-vf", f"pad=ceil(iw/2)*2:ceil(ih/2)*2,format=yuvj420p",  # Padding and format conversion            
-            "-c:v", "libx264",            # H.264 codec
-            "-crf", "18",                 # Quality setting
-            self.temp_file                # Output file
-        ]
+    def write_recorded_frame(self, frame: numpy.ndarray, frame_number: int):
+        if self.recording_sp is None:
+            # The recorded frames are processed at full resolution, the size of the displayed frame can be the one of the proxy preview
+            frame_height, frame_width, _ = frame.shape
+            self.create_ffmpeg_subprocess(frame_width, frame_height)
+        with profiler.stage('encode', frame_number=frame_number):
+            self.recording_sp.stdin.write(frame.tobytes())
+
+    def create_ffmpeg_subprocess(self, frame_width: int, frame_height: int):
+        """Start the encoder of the recording, for frames of the size of the first processed frame (restorers and frame enhancers can change it)"""
+        # Encode straight into the output file, muxing the audio of the source (from the first recorded frame) in the same pass
+        self.recording_file_path = misc_helpers.get_output_file_path(self.media_path, self.main_window.control['OutputMediaFolder'])
+        if Path(self.recording_file_path).is_file():
+            os.remove(self.recording_file_path)
+
+        args = misc_helpers.get_ffmpeg_video_writer_args(frame_width, frame_height, self.fps, self.recording_file_path, audio_media_path=self.media_path, audio_start_time=self.play_start_time)
 
         self.recording_sp = subprocess.Popen(args, stdin=subprocess.PIPE)
-
-    def enable_virtualcam(self, backend=False):
+        self.recording_frame_size = (frame_width, frame_height)
+
+    def get_output_frame_size(self) -> Tuple[int, int]:
+        """(width, height) of the frames processed at full resolution: the resolution enforced by FrameWorker.enforce_output_resolution(), else the source resolution"""
+        res_text = str(self.main_window.control.get('WebcamMaxResSelection', '1280x720'))
+        try:
+            frame_width, frame_height = (int(value) for value in res_text.split('x'))
+            if frame_width > 0 and frame_height > 0:
+                return frame_width, frame_height
+        except ValueError:
+            pass
+        return self.get_source_frame_size()
+
+    def get_source_frame_size(self) -> Tuple[int, int]:
+        """(width, height) of the frames of the media, before any proxy preview downscale"""
+        return int(self.media_capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.media_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def enable_virtualcam(self, backend=False, frame_size: Tuple[int, int]|None = None):
+        """Create the virtual camera for frames of frame_size (width, height), by default the size of the frames processed at full resolution"""
         #Check if capture contains any cv2 stream or is it an empty list
         if pyvirtualcam is None:
             print("pyvirtualcam not installed; virtual camera disabled.")
             return
         if self.media_capture:
-            if isinstance(self.current_frame, numpy.ndarray):
-                frame_height, frame_width, _ = self.current_frame.shape
-            else:
-                frame_height = int(self.media_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                frame_width = int(self.media_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            # Never the size of the displayed frame, which can be a proxy preview frame
+            frame_width, frame_height = frame_size or self.get_output_frame_size()
             self.disable_virtualcam()
             try:
                 backend = backend or self.main_window.control['VirtCamBackendSelection']
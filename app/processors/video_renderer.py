@@ -0,0 +1,108 @@
+import os
+import time
+import subprocess
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+import cv2
+import numpy
+
+from app.processors.workers.frame_worker import FrameWorker
+from app.processors.models_processor import ModelsProcessor
+from app.processors.face_tracker import FaceTracker
+import app.helpers.miscellaneous as misc_helpers
+from app.helpers.stage_profiler import profiler
+from app.helpers.trace_recorder import tracer
+
+if TYPE_CHECKING:
+    from app.processors.render_session import RenderSession
+
+def create_models_processor(session: 'RenderSession', provider: str, threads: int) -> ModelsProcessor:
+    """Create the ModelsProcessor of a RenderSession, for rendering without the GUI"""
+    models_processor = ModelsProcessor(session)
+    session.models_processor = models_processor
+    models_processor.switch_providers_priority(provider)
+    models_processor.set_number_of_threads(threads)
+    return models_processor
+
+class VideoRenderer:
+    """
+    Renders a target video straight to a file through the ModelsProcessor, without Qt timers, signals or pixmaps.
+    The frame parameters/control are resolved from the RenderSession (including its markers) for every frame.
+    """
+    def __init__(self, session: 'RenderSession'):
+        self.session = session
+        self.frame_worker = FrameWorker(session)
+        # Renderers sharing a ModelsProcessor (RenderScheduler) render different videos at the same time
+        self.frame_worker.face_tracker = FaceTracker(session.models_processor)
+        self.recording_sp: subprocess.Popen|None = None
+        self.frames_rendered = 0
+        self.processing_time = 0.0
+
+    def process_frame(self, frame_number: int, frame: numpy.ndarray) -> numpy.ndarray:
+        """Process a single RGB frame and return the BGR output frame"""
+        parameters, control = self.session.get_state_for_frame(frame_number)
+        tracer.set_frame(frame_number)
+        self.frame_worker.frame = frame
+        self.frame_worker.frame_number = frame_number
+        self.frame_worker.load_state(parameters, control, swap_faces=self.session.swap_faces, edit_faces=self.session.edit_faces)
+        return self.frame_worker.render_frame()
+
+    def render(self, media_path: str, output_file_path: str, start_frame=0, end_frame: int|None = None, progress_callback: Callable[[int, int], None]|None = None, include_audio=True) -> float:
+        """
+        Render frames [start_frame, end_frame] of media_path to output_file_path and return the average FPS.
+        Raises a RuntimeError when a frame can't be read or ffmpeg fails, since the output is then incomplete
+        """
+        media_capture = misc_helpers.open_video_capture(media_path, backend=self.session.control['VideoDecodeBackendSelection'])
+        if not media_capture.isOpened():
+            raise RuntimeError(f"Unable to open the video: {media_path}")
+        fps = media_capture.get(cv2.CAP_PROP_FPS)
+        max_frame_number = int(media_capture.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+        if end_frame is None or end_frame > max_frame_number:
+            end_frame = max_frame_number
+        media_capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        self.frame_worker.face_tracker.reset()
+        if Path(output_file_path).is_file():
+            os.remove(output_file_path)
+
+        total_frames = end_frame - start_frame + 1
+        self.frames_rendered = 0
+        returncode = 0
+        start_time = time.perf_counter()
+        try:
+            for frame_number in range(start_frame, end_frame + 1):
+                with profiler.stage('decode', frame_number=frame_number):
+                    ret, frame = misc_helpers.read_frame(media_capture)
+                if not ret:
+                    print(f"Cannot read frame! {frame_number}")
+                    break
+                frame = frame[..., ::-1]  # Convert BGR to RGB
+                frame = self.process_frame(frame_number, frame)
+                if self.recording_sp is None:
+                    # Use Dimensions of the first processed frame as it could be different from the original frame due to restorers and frame enhancers
+                    frame_height, frame_width, _ = frame.shape
+                    # The audio of the source is muxed in the same pass
+                    args = misc_helpers.get_ffmpeg_video_writer_args(frame_width, frame_height, fps, output_file_path, audio_media_path=media_path if include_audio else None, audio_start_time=start_frame / float(fps))
+                    self.recording_sp = subprocess.Popen(args, stdin=subprocess.PIPE)
+                with profiler.stage('encode', frame_number=frame_number):
+                    self.recording_sp.stdin.write(frame.tobytes())
+                self.frames_rendered += 1
+                if progress_callback:
+                    progress_callback(self.frames_rendered, total_frames)
+        finally:
+            media_capture.release()
+            if self.recording_sp:
+                try:
+                    self.recording_sp.stdin.close()
+                except OSError as e:
+                    # The encoder already exited (broken pipe), its exit code reports the failure
+                    print(f"Error closing the encoder input: {e}")
+                returncode = self.recording_sp.wait()
+                self.recording_sp = None
+        self.processing_time = time.perf_counter() - start_time
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with exit code {returncode}, {output_file_path} is incomplete")
+        if self.frames_rendered < total_frames:
+            raise RuntimeError(f"Only {self.frames_rendered} of {total_frames} frames were rendered, {output_file_path} is incomplete")
+
+        return self.frames_rendered / self.processing_time if self.processing_time > 0 else 0.0
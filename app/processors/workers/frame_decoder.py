@@ -0,0 +1,102 @@
+import queue
+import time
+import threading
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+import app.helpers.miscellaneous as misc_helpers
+from app.processors.frame_transfer import allocate_host_frame
+from app.helpers.stage_profiler import profiler
+from app.helpers.trace_recorder import tracer
+
+class FrameDecoder(threading.Thread):
+    """
+    Decodes the frames of a video capture in its own thread, ahead of the FrameWorkers.
+    The frames are decoded into a fixed ring of preallocated buffers (lookahead slots). A slot is handed out with
+    get_frame() and is only reused for decoding once it is given back with release(), so the decoder
+    never runs more than lookahead frames ahead of the consumer.
+    With preview_height, the frames are downscaled to the proxy preview resolution (see misc_helpers.get_preview_resolution) into the slots.
+    """
+    def __init__(self, media_capture: cv2.VideoCapture, start_frame: int, end_frame: int, lookahead=8, preview_height: int|None = None):
+        super().__init__(daemon=True)
+        self.media_capture = media_capture
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.lookahead = max(1, lookahead)
+
+        width = int(media_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(media_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.preview_resolution = misc_helpers.get_preview_resolution(width, height, preview_height)
+        # Full resolution frame that is downscaled into the slots in preview mode
+        self.decode_buffer: np.ndarray|None = None
+        if self.preview_resolution:
+            self.decode_buffer = np.empty((height, width, 3), dtype=np.uint8)
+            width, height = self.preview_resolution
+        # Pinned when CUDA is available, so that the FrameWorkers upload the frames straight from the slots
+        self.buffers: List[np.ndarray] = [allocate_host_frame((height, width, 3)) for _ in range(self.lookahead)]
+        self.free_slots: queue.Queue[int] = queue.Queue()
+        for slot in range(self.lookahead):
+            self.free_slots.put(slot)
+        # (frame_number, slot) of the decoded frames, in decoding order. slot is None when the frame could not be read
+        self.decoded_frames: queue.Queue[Tuple[int, int|None]] = queue.Queue()
+        self.stop_event = threading.Event()
+        # Moving average of the time spent decoding (and downscaling) a frame, in seconds
+        self.decode_time = 0.0
+
+    @property
+    def fill_level(self) -> float:
+        """Fraction of the ring buffer holding decoded frames that haven't been taken yet"""
+        return self.decoded_frames.qsize() / self.lookahead
+
+    def run(self):
+        # The capture is owned by the decoder while it is running, so there is no need to take misc_helpers.lock
+        self.media_capture.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+        frame_number = self.start_frame
+        while frame_number <= self.end_frame and not self.stop_event.is_set():
+            try:
+                slot = self.free_slots.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            decode_start_time = time.perf_counter()
+            if self.preview_resolution:
+                ret, frame = self.media_capture.read(self.decode_buffer)
+                if ret:
+                    frame = cv2.resize(frame, self.preview_resolution, dst=self.buffers[slot], interpolation=cv2.INTER_AREA)
+            else:
+                ret, frame = self.media_capture.read(self.buffers[slot])
+            if not ret:
+                self.free_slots.put(slot)
+                self.decoded_frames.put((frame_number, None))
+                break
+            if frame is not self.buffers[slot]:
+                # The decoder couldn't write into the buffer (eg: the stream changed resolution), keep the new array for this slot
+                self.buffers[slot] = frame
+            decode_time = time.perf_counter() - decode_start_time
+            self.decode_time = decode_time if self.decode_time == 0.0 else self.decode_time + 0.1 * (decode_time - self.decode_time)
+            profiler.record('decode', decode_time)
+            tracer.record('decode', 'io', decode_start_time, decode_start_time + decode_time, frame_number)
+            self.decoded_frames.put((frame_number, slot))
+            frame_number += 1
+
+    def get_frame(self, block=False, timeout=None) -> Tuple[int, int|None, np.ndarray|None]|None:
+        """
+        Return (frame_number, slot, BGR frame) of the next decoded frame, or None if it isn't decoded yet.
+        slot and frame are None if the frame could not be read. The frame must not be used after release(slot)
+        """
+        try:
+            frame_number, slot = self.decoded_frames.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return None
+        if slot is None:
+            return frame_number, None, None
+        return frame_number, slot, self.buffers[slot]
+
+    def release(self, slot: int):
+        self.free_slots.put(slot)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
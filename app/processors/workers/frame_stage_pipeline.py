@@ -0,0 +1,184 @@
+import queue
+import threading
+import traceback
+from typing import TYPE_CHECKING, Any, Callable, List, Tuple
+
+import numpy as np
+
+from app.processors.workers.frame_worker import FrameWorker
+from app.helpers.trace_recorder import tracer
+
+if TYPE_CHECKING:
+    from app.ui.main_ui import MainWindow
+
+class FrameJob:
+    """A frame moving through the stages of FrameStagePipeline, with the state it is processed with"""
+    def __init__(self, frame_number: int, frame: np.ndarray, on_done: Callable|None):
+        self.frame_number = frame_number
+        self.frame = frame
+        self.on_done = on_done
+        self.state: dict = {}
+        self.cache_key = None
+        self.img = None # Frame tensor (CxHxW) between the stages, None when the frame is not processed with the models
+        self.det_faces_data: list = []
+        self.result: np.ndarray|None = None
+        self.done = False # Set when the result is known (cache hit, failure), the next stages skip the job
+
+def detect_stage(worker: FrameWorker, job: FrameJob):
+    worker.frame = job.frame
+    worker.frame_number = job.frame_number
+    worker.load_state_from_main_window()
+    # The state is taken once per frame, so that all the stages process the frame with the same parameters
+    job.state = worker.get_state()
+    job.cache_key = worker.get_processed_frame_cache_key()
+    if job.cache_key is not None:
+        cached_frame = worker.video_processor.processed_frame_cache.get(job.cache_key)
+        if cached_frame is not None:
+            job.result = cached_frame
+            job.done = True
+            return
+    if worker.needs_processing():
+        job.img, job.det_faces_data = worker.detect_faces_in_frame()
+
+def swap_stage(worker: FrameWorker, job: FrameJob):
+    if job.img is None:
+        return
+    worker.load_state(**job.state)
+    job.img = worker.swap_faces_in_frame(job.img, job.det_faces_data)
+    job.det_faces_data = []
+
+def finish_stage(worker: FrameWorker, job: FrameJob):
+    worker.load_state(**job.state)
+    if job.img is not None:
+        frame = worker.finish_frame(job.img)
+        job.img = None
+    else:
+        # Img must be in BGR format. Copy it, since the input frame can be a decode buffer that gets reused
+        frame = job.frame[..., ::-1].copy()
+    frame = worker.enforce_output_resolution(np.ascontiguousarray(frame))
+    if job.cache_key is not None:
+        worker.video_processor.processed_frame_cache.put(job.cache_key, frame)
+    job.result = frame
+    job.done = True
+
+class FrameStage:
+    """One stage of FrameStagePipeline: num_threads threads, each with its own FrameWorker, taking the jobs from input_queue"""
+    def __init__(self, name: str, function: Callable[[FrameWorker, FrameJob], None], num_threads: int):
+        self.name = name
+        self.function = function
+        self.num_threads = max(1, num_threads)
+        # Bounded, so that a slow stage holds back the previous ones instead of piling up frames (and VRAM) in between
+        self.input_queue: queue.Queue[FrameJob|None] = queue.Queue(maxsize=self.num_threads)
+        self.threads: List[threading.Thread] = []
+
+class FrameStagePipeline:
+    """
+    Drop-in replacement of FrameWorkerPool that splits FrameWorker.process_frame() into stages (detection + recognition,
+    swap/edit + enhance, readback + beauty), each run by its own threads and connected by bounded queues.
+    Consecutive frames are processed concurrently in different stages, eg the faces of frame N+1 are detected while
+    frame N is swapped and frame N-1 is copied back to the host.
+    """
+    def __init__(self, main_window: 'MainWindow', detect_threads=1, swap_threads=1, finish_threads=1, worker_class=FrameWorker):
+        self.main_window = main_window
+        self.stages = [
+            FrameStage('detect', detect_stage, detect_threads),
+            FrameStage('swap', swap_stage, swap_threads),
+            FrameStage('finish', finish_stage, finish_threads),
+        ]
+        # Frames that can be in the pipeline at once: one per stage thread
+        self.num_workers = sum(stage.num_threads for stage in self.stages)
+        self.completion_queue: queue.Queue[Tuple[int, Any]] = queue.Queue()
+        self._pending = 0 # Number of frames submitted but not yet processed
+        self._pending_condition = threading.Condition()
+        for index, stage in enumerate(self.stages):
+            next_queue = self.stages[index + 1].input_queue if index + 1 < len(self.stages) else None
+            for _ in range(stage.num_threads):
+                thread = threading.Thread(target=self.run_stage, args=(stage, worker_class(main_window), next_queue), daemon=True)
+                thread.start()
+                stage.threads.append(thread)
+
+    def run_stage(self, stage: FrameStage, worker: FrameWorker, next_queue: queue.Queue|None):
+        while True:
+            job = stage.input_queue.get()
+            # None is used as the signal to stop the stage
+            if job is None:
+                break
+            if not job.done:
+                tracer.set_frame(job.frame_number)
+                try:
+                    stage.function(worker, job)
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    print(f"Error in FrameStagePipeline ({stage.name} stage): {e}")
+                    traceback.print_exc()
+                    job.result = None
+                    job.img = None
+                    job.done = True
+            if next_queue is not None:
+                next_queue.put(job)
+            else:
+                self._complete(job)
+
+    def _complete(self, job: FrameJob):
+        if job.on_done:
+            job.on_done()
+        self.completion_queue.put((job.frame_number, job.result))
+        with self._pending_condition:
+            self._pending -= 1
+            self._pending_condition.notify_all()
+
+    @property
+    def pending(self) -> int:
+        with self._pending_condition:
+            return self._pending
+
+    def is_busy(self) -> bool:
+        """True when every stage thread already has a frame to process"""
+        return self.pending >= self.num_workers
+
+    def wait_for_free_worker(self, timeout=None) -> bool:
+        """Block until a stage thread is free (is_busy() is False) or the timeout expires. Returns True if one is free"""
+        with self._pending_condition:
+            return self._pending_condition.wait_for(lambda: self._pending < self.num_workers, timeout)
+
+    def submit(self, frame_number: int, frame: np.ndarray, on_done: Callable|None = None):
+        """Queue the RGB frame for processing. on_done is called once the pipeline doesn't need the frame anymore"""
+        with self._pending_condition:
+            self._pending += 1
+        self.stages[0].input_queue.put(FrameJob(frame_number, frame, on_done))
+
+    def get_completed(self, block=False, timeout=None) -> Tuple[int, Any]|None:
+        try:
+            return self.completion_queue.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def wait_until_idle(self):
+        with self._pending_condition:
+            self._pending_condition.wait_for(lambda: self._pending == 0)
+
+    def clear(self):
+        """Drop the frames waiting for the first stage, wait for the ones already in the pipeline and discard all the results"""
+        while True:
+            try:
+                job = self.stages[0].input_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                if job.on_done:
+                    job.on_done()
+                with self._pending_condition:
+                    self._pending -= 1
+                    self._pending_condition.notify_all()
+        self.wait_until_idle()
+        with self.completion_queue.mutex:
+            self.completion_queue.queue.clear()
+
+    def shutdown(self):
+        self.clear()
+        # The pipeline is empty, so each stage can be stopped in turn
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.input_queue.put(None)
+            for thread in stage.threads:
+                thread.join()
+            stage.threads.clear()
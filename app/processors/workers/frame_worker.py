@@ -1,6 +1,7 @@
 import traceback
-from typing import TYPE_CHECKING, Dict, Union
+from typing import TYPE_CHECKING, Callable, Dict, Tuple, Union
 import threading
+import queue
 from math import floor, ceil
 
 import torch
@@ -14,9 +15,14 @@ import numpy as np
 import cv2
 
 from app.processors.utils import faceutil
-import app.ui.widgets.actions.common_actions as common_widget_actions
 from app.ui.widgets.actions import video_control_actions
 from app.helpers.miscellaneous import t512,t384,t256,t128, ParametersDict
+from app.processors.processed_frame_cache import get_frame_state_hash
+from app.processors.frame_transfer import get_frame_transfer
+from app.processors.tensor_arena import get_tensor_arena
+from app.processors.face_matcher import FaceMatcher
+from app.helpers.stage_profiler import profiler, profile_stage
+from app.helpers.trace_recorder import tracer
 from app.beauty.pixel_free_engine import PFBeautyFiterType
 
 if TYPE_CHECKING:
@@ -25,146 +31,193 @@ if TYPE_CHECKING:
 torchvision.disable_beta_transforms_warning()
 
 class FrameWorker(threading.Thread):
-    def __init__(self, frame, main_window: 'MainWindow', frame_number, frame_queue, is_single_frame=False):
-        super().__init__()
-        self.frame_queue = frame_queue
-        self.frame = frame
+    """
+    Long-lived frame processing thread (see FrameWorkerPool).
+    It takes (frame_number, frame, on_done) jobs from work_queue and puts (frame_number, processed BGR frame) on completion_queue.
+    A FrameWorker that is not started can also be used directly to process single frames with process_job()
+    """
+    def __init__(self, main_window: 'MainWindow', work_queue: queue.Queue|None = None, completion_queue: queue.Queue|None = None, on_job_done: Callable|None = None):
+        super().__init__(daemon=True)
+        self.work_queue = work_queue
+        self.completion_queue = completion_queue
+        self.on_job_done = on_job_done
+        self.frame = None
         self.main_window = main_window
-        self.frame_number = frame_number
+        self.frame_number = 0
         self.models_processor = main_window.models_processor
         self.video_processor = main_window.video_processor
-        self.is_single_frame = is_single_frame
+        # Tracker of the faces of the video being processed, replaced by the renderers that have their own
+        self.face_tracker = self.models_processor.face_tracker
+        self.is_single_frame = False
         self.parameters = {}
+        self.control = {}
         self.target_faces = main_window.target_faces
         self.compare_images = []
         self.is_view_face_compare: bool = False
         self.is_view_face_mask: bool = False
+        self.is_swap_faces_enabled: bool = False
+        self.is_edit_faces_enabled: bool = False
+
+    def load_state(self, parameters, control, swap_faces=True, edit_faces=False, view_face_compare=False, view_face_mask=False):
+        """Set the parameters, control and toggles used to process the current frame."""
+        self.parameters = parameters
+        self.control = control
+        self.is_swap_faces_enabled = swap_faces
+        self.is_edit_faces_enabled = edit_faces
+        self.is_view_face_compare = view_face_compare
+        self.is_view_face_mask = view_face_mask
+
+    def load_state_from_main_window(self):
+        # Update parameters from markers (if exists) without concurrent access from other threads
+        with self.main_window.models_processor.model_lock:
+            video_control_actions.update_parameters_and_control_from_marker(self.main_window, self.frame_number)
+        self.load_state(self.main_window.parameters.copy(),
+                        self.main_window.control.copy(),
+                        swap_faces=self.main_window.swapfacesButton.isChecked(),
+                        edit_faces=self.main_window.editFacesButton.isChecked(),
+                        # Check if view mask or face compare checkboxes are checked
+                        view_face_compare=self.main_window.faceCompareCheckBox.isChecked(),
+                        view_face_mask=self.main_window.faceMaskCheckBox.isChecked())
+
+    def get_state(self) -> dict:
+        """Keyword arguments of load_state() for the current state, used to hand the frame over to another worker"""
+        return {'parameters': self.parameters, 'control': self.control,
+                'swap_faces': self.is_swap_faces_enabled, 'edit_faces': self.is_edit_faces_enabled,
+                'view_face_compare': self.is_view_face_compare, 'view_face_mask': self.is_view_face_mask}
+
+    def needs_processing(self) -> bool:
+        """False when the frame is only converted to BGR, without model inference"""
+        return self.is_swap_faces_enabled or self.is_edit_faces_enabled or self.control['FrameEnhancerEnableToggle']
+
+    def get_processed_frame_cache_key(self):
+        """
+        Key of the current frame in the processed frames cache, or None when the cache is not used. The cache only serves
+        the interactive seeking: the recorded frames are never revisited, hashing and storing them would only evict the preview frames
+        """
+        video_processor = self.video_processor
+        if video_processor.processed_frame_cache.max_bytes <= 0 or video_processor.file_type == 'webcam' or video_processor.recording:
+            return None
+        # The resolution is part of the key, since the same frame can be processed at the proxy preview resolution or at full resolution
+        return (self.video_processor.media_path, self.frame_number, self.frame.shape, get_frame_state_hash(self))
+
+    def render_frame(self) -> np.ndarray:
+        """Process self.frame (RGB) and return the final BGR frame, without creating any Qt objects."""
+        # Process the frame with model inference
+        if self.needs_processing():
+            with tracer.span('frame', 'pipeline', self.frame_number):
+                frame = self.process_frame()
+        else:
+            # Img must be in BGR format. Copy it, since the input frame can be a decode buffer that gets reused
+            frame = self.frame[..., ::-1].copy()  # Swap the channels from RGB to BGR
+        frame = np.ascontiguousarray(frame)
+        return self.enforce_output_resolution(frame)
 
-    def run(self):
+    def enforce_output_resolution(self, frame: np.ndarray) -> np.ndarray:
+        # Enforce strict output resolution using WebcamMaxResSelection via center-crop + resize (no rotation)
         try:
-            # Update parameters from markers (if exists) without concurrent access from other threads
-            with self.main_window.models_processor.model_lock:
-                video_control_actions.update_parameters_and_control_from_marker(self.main_window, self.frame_number)
-            self.parameters = self.main_window.parameters.copy()
-            # Check if view mask or face compare checkboxes are checked
-            self.is_view_face_compare = self.main_window.faceCompareCheckBox.isChecked() 
-            self.is_view_face_mask = self.main_window.faceMaskCheckBox.isChecked() 
-
-            # Process the frame with model inference
-            # print(f"Processing frame {self.frame_number}")
-            if self.main_window.swapfacesButton.isChecked() or self.main_window.editFacesButton.isChecked() or self.main_window.control['FrameEnhancerEnableToggle']:
-                self.frame = self.process_frame()
-            else:
-                # Img must be in BGR format
-                self.frame = self.frame[..., ::-1]  # Swap the channels from RGB to BGR
-            self.frame = np.ascontiguousarray(self.frame)
+            res_text = str(self.control.get('WebcamMaxResSelection', '1280x720'))
+            if 'x' in res_text:
+                t_w_str, t_h_str = res_text.split('x')
+                t_w, t_h = int(t_w_str), int(t_h_str)
+                if t_w > 0 and t_h > 0:
+                    h, w, _ = frame.shape
+                    target_ratio = float(t_w) / float(t_h)
+                    cur_ratio = float(w) / float(h) if h > 0 else target_ratio
+
+                    def to_even(x: int) -> int:
+                        return x if (x % 2 == 0) else (x - 1 if x > 1 else 2)
+
+                    # center crop to target aspect ratio
+                    if cur_ratio > target_ratio:
+                        new_w = to_even(int(h * target_ratio))
+                        x0 = max((w - new_w) // 2, 0)
+                        frame = frame[:, x0:x0 + new_w, :]
+                    elif cur_ratio < target_ratio:
+                        new_h = to_even(int(w / target_ratio))
+                        y0 = max((h - new_h) // 2, 0)
+                        frame = frame[y0:y0 + new_h, :, :]
+                    # else already matching aspect
+
+                    # resize to exact target resolution
+                    frame = cv2.resize(
+                        frame,
+                        (t_w, t_h),
+                        interpolation=cv2.INTER_AREA
+                        if (frame.shape[1] >= t_w and frame.shape[0] >= t_h)
+                        else cv2.INTER_LINEAR,
+                    )
+                    frame = np.ascontiguousarray(frame)
+        except Exception:
+            # Fail-safe: keep original frame if anything goes wrong
+            pass
+        return frame
 
-            # Enforce strict output resolution using WebcamMaxResSelection via center-crop + resize (no rotation)
+    def run(self):
+        while True:
+            job = self.work_queue.get()
             try:
-                res_text = str(self.main_window.control.get('WebcamMaxResSelection', '1280x720'))
-                if 'x' in res_text:
-                    t_w_str, t_h_str = res_text.split('x')
-                    t_w, t_h = int(t_w_str), int(t_h_str)
-                    if t_w > 0 and t_h > 0:
-                        h, w, _ = self.frame.shape
-                        target_ratio = float(t_w) / float(t_h)
-                        cur_ratio = float(w) / float(h) if h > 0 else target_ratio
-
-                        def to_even(x: int) -> int:
-                            return x if (x % 2 == 0) else (x - 1 if x > 1 else 2)
-
-                        # center crop to target aspect ratio
-                        if cur_ratio > target_ratio:
-                            new_w = to_even(int(h * target_ratio))
-                            x0 = max((w - new_w) // 2, 0)
-                            self.frame = self.frame[:, x0:x0 + new_w, :]
-                        elif cur_ratio < target_ratio:
-                            new_h = to_even(int(w / target_ratio))
-                            y0 = max((h - new_h) // 2, 0)
-                            self.frame = self.frame[y0:y0 + new_h, :, :]
-                        # else already matching aspect
-
-                        # resize to exact target resolution
-                        self.frame = cv2.resize(
-                            self.frame,
-                            (t_w, t_h),
-                            interpolation=cv2.INTER_AREA
-                            if (self.frame.shape[1] >= t_w and self.frame.shape[0] >= t_h)
-                            else cv2.INTER_LINEAR,
-                        )
-                        self.frame = np.ascontiguousarray(self.frame)
-            except Exception:
-                # Fail-safe: keep original frame if anything goes wrong
-                pass
-
-            # Display the frame if processing is still active
-
-            pixmap = common_widget_actions.get_pixmap_from_frame(self.main_window, self.frame)
-
-            # Output processed Webcam frame
-            if self.video_processor.file_type=='webcam' and not self.is_single_frame:
-                self.video_processor.webcam_frame_processed_signal.emit(pixmap, self.frame)
-
-            #Output Video frame (while playing)
-            elif not self.is_single_frame:
-                self.video_processor.frame_processed_signal.emit(self.frame_number, pixmap, self.frame)
-            # Output Image/Video frame (Single frame)
-            else:
-                # print('Emitted single_frame_processed_signal')
-                self.video_processor.single_frame_processed_signal.emit(self.frame_number, pixmap, self.frame)
-
-
-            # Mark the frame as done in the queue
-            self.video_processor.frame_queue.get()
-            self.video_processor.frame_queue.task_done()
-
-            # Check if playback is complete
-            if self.video_processor.frame_queue.empty() and not self.video_processor.processing and self.video_processor.next_frame_to_display >= self.video_processor.max_frame_number:
-                self.video_processor.stop_processing()
+                # None is used as the signal to stop the worker
+                if job is None:
+                    break
+                frame_number, frame, on_done = job
+                try:
+                    result = self.process_job(frame_number, frame)
+                finally:
+                    if on_done:
+                        on_done()
+                self.completion_queue.put((frame_number, result))
+            finally:
+                if job is not None and self.on_job_done:
+                    self.on_job_done()
+                self.work_queue.task_done()
+
+    def process_job(self, frame_number, frame, is_single_frame=False) -> np.ndarray|None:
+        """Process the RGB frame using the current state of the MainWindow and return the BGR frame, or None on failure"""
+        self.frame = frame
+        self.frame_number = frame_number
+        self.is_single_frame = is_single_frame
+        tracer.set_frame(frame_number)
+        try:
+            self.load_state_from_main_window()
+            # Revisited frames with unchanged parameters are taken from the processed frames cache
+            cache = self.video_processor.processed_frame_cache
+            cache_key = self.get_processed_frame_cache_key()
+            if cache_key is not None:
+                cached_frame = cache.get(cache_key)
+                if cached_frame is not None:
+                    self.frame = cached_frame
+                    return self.frame
+            self.frame = self.render_frame()
+            if cache_key is not None:
+                cache.put(cache_key, self.frame)
+            return self.frame
 
         except Exception as e: # pylint: disable=broad-exception-caught
             print(f"Error in FrameWorker: {e}")
             traceback.print_exc()
-    
+            return None
+
     # @misc_helpers.benchmark
     def process_frame(self):
+        # The stages are run one after the other here, FrameStagePipeline runs them on consecutive frames concurrently
+        img, det_faces_data = self.detect_faces_in_frame()
+        img = self.swap_faces_in_frame(img, det_faces_data)
+        return self.finish_frame(img)
+
+    def detect_faces_in_frame(self):
+        """First stage of process_frame(): load self.frame into VRAM, detect the faces and compute their embeddings"""
         # Load frame into VRAM
-        img = torch.from_numpy(self.frame.astype('uint8')).to(self.models_processor.device) #HxWxc
-        img = img.permute(2,0,1)#cxHxW
+        img = get_frame_transfer(self.models_processor.device).upload(self.frame) #cxHxW
 
         #Scale up frame if it is smaller than 512
         img_x = img.size()[2]
         img_y = img.size()[1]
-
-        # det_scale = 1.0
-        if img_x<512 and img_y<512:
-            # if x is smaller, set x to 512
-            if img_x <= img_y:
-                new_height = int(512*img_y/img_x)
-                tscale = v2.Resize((new_height, 512), antialias=True)
-            else:
-                new_height = 512
-                tscale = v2.Resize((new_height, int(512*img_x/img_y)), antialias=True)
-
-            img = tscale(img)
-
-            # det_scale = torch.div(new_height, img_y)
-
-        elif img_x<512:
-            new_height = int(512*img_y/img_x)
-            tscale = v2.Resize((new_height, 512), antialias=True)
-            img = tscale(img)
-
-            # det_scale = torch.div(new_height, img_y)
-
-        elif img_y<512:
-            new_height = 512
-            tscale = v2.Resize((new_height, int(512*img_x/img_y)), antialias=True)
+        new_width, new_height = self.get_processing_size(img_x, img_y)
+        if (new_width, new_height) != (img_x, img_y):
+            tscale = v2.Resize((new_height, new_width), antialias=True)
             img = tscale(img)
 
-            # det_scale = torch.div(new_height, img_y)
-
-        control = self.main_window.control.copy()
+        control = self.control.copy()
         # Rotate the frame
         if control['ManualRotationEnableToggle']:
             img = v2.functional.rotate(img, angle=control['ManualRotationAngleSlider'], interpolation=v2.InterpolationMode.BILINEAR, expand=True)
@@ -172,7 +225,7 @@ class FrameWorker(threading.Thread):
         use_landmark_detection=control['LandmarkDetectToggle']
         landmark_detect_mode=control['LandmarkDetectModelSelection']
         from_points = control["DetectFromPointsToggle"]
-        if self.main_window.editFacesButton.isChecked():
+        if self.is_edit_faces_enabled:
             if not use_landmark_detection or landmark_detect_mode=="5":
                 # force to use landmark detector when edit face is enabled.
                 use_landmark_detection = True
@@ -181,46 +234,75 @@ class FrameWorker(threading.Thread):
             # force to use from_points in landmark detector when edit face is enabled.
             from_points = True
 
+        # Follow the faces of the previous frames instead of detecting and recognizing them again
+        face_tracker = self.face_tracker
+        media_path = self.video_processor.media_path if self.video_processor is not None else ''
+        tracking_key = face_tracker.get_tracking_key(img, control, self.is_edit_faces_enabled, media_path)
+        if control['FaceTrackingEnableToggle']:
+            det_faces_data = face_tracker.track_faces(img, self.frame_number, control, tracking_key, landmark_detect_mode if use_landmark_detection else '203', control["LandmarkDetectScoreSlider"]/100.0, use_landmark_detection)
+            if det_faces_data is not None:
+                return img, det_faces_data
+
         bboxes, kpss_5, kpss = self.models_processor.run_detect(img, control['DetectorModelSelection'], max_num=control['MaxFacesToDetectSlider'], score=control['DetectorScoreSlider']/100.0, input_size=(512, 512), use_landmark_detection=use_landmark_detection, landmark_detect_mode=landmark_detect_mode, landmark_score=control["LandmarkDetectScoreSlider"]/100.0, from_points=from_points, rotation_angles=[0] if not control["AutoRotationToggle"] else [0, 90, 180, 270])
         
         det_faces_data = []
         if len(kpss_5)>0:
+            # All the faces of the frame are recognized as one batch
+            embeddings = self.models_processor.run_recognize_batch(img, kpss_5, control['SimilarityTypeSelection'], control['RecognitionModelSelection'])
             for i in range(kpss_5.shape[0]):
                 face_kps_5 = kpss_5[i]
                 face_kps_all = kpss[i]
-                face_emb, _ = self.models_processor.run_recognize_direct(img, face_kps_5, control['SimilarityTypeSelection'], control['RecognitionModelSelection'])
-                det_faces_data.append({'kps_5': face_kps_5, 'kps_all': face_kps_all, 'embedding': face_emb, 'bbox': bboxes[i]})
+                det_faces_data.append({'kps_5': face_kps_5, 'kps_all': face_kps_all, 'embedding': embeddings[i], 'bbox': bboxes[i]})
+        if control['FaceTrackingEnableToggle']:
+            face_tracker.start_tracks(img, self.frame_number, det_faces_data, tracking_key)
+        return img, det_faces_data
 
+    def get_target_matches(self, det_faces_data: list, control: dict) -> list:
+        """
+        Target faces matched by each detected face, in the order of the target faces. The similarities of all the faces
+        are computed once per frame by the FaceMatcher, and used by all the stages drawing or swapping the matched faces
+        """
+        target_faces = dict(self.target_faces)
+        if not det_faces_data or not target_faces:
+            return [[] for _ in det_faces_data]
+        face_ids, similarities = self.models_processor.face_matcher.get_similarities([fface['embedding'] for fface in det_faces_data], target_faces, control['RecognitionModelSelection'])
+        thresholds = np.array([ParametersDict(self.parameters[face_id], self.main_window.default_parameters)['SimilarityThresholdSlider'] for face_id in face_ids], dtype=np.float32)
+        matches = FaceMatcher.match_faces(similarities, thresholds, control['OneToOneMatchingToggle'])
+        return [[target_faces[face_ids[j]] for j in np.flatnonzero(face_matches)] for face_matches in matches]
+
+    def swap_faces_in_frame(self, img: torch.Tensor, det_faces_data: list) -> torch.Tensor:
+        """Second stage of process_frame(): swap/edit the faces matching the target faces, draw the overlays and enhance the frame"""
+        control = self.control.copy()
         compare_mode = self.is_view_face_mask or self.is_view_face_compare
-        
+        target_matches = self.get_target_matches(det_faces_data, control)
+        keypoints_scale = self.get_keypoints_scale(img)
+
         if det_faces_data:
-            # Loop through target faces to see if they match our found face embeddings
-            for i, fface in enumerate(det_faces_data):
-                    for _, target_face in self.main_window.target_faces.items():
+            # Swap/edit each face with the target faces it matches
+            for fface, matched_target_faces in zip(det_faces_data, target_matches):
+                    for target_face in matched_target_faces:
                         parameters = ParametersDict(self.parameters[target_face.face_id], self.main_window.default_parameters) #Use the parameters of the target face
 
-                        if self.main_window.swapfacesButton.isChecked() or self.main_window.editFacesButton.isChecked():
-                            sim = self.models_processor.findCosineDistance(fface['embedding'], target_face.get_embedding(control['RecognitionModelSelection'])) # Recognition for comparing
-                            if sim>=parameters['SimilarityThresholdSlider']:
-                                s_e = None
-                                fface['kps_5'] = self.keypoints_adjustments(fface['kps_5'], parameters) #Make keypoints adjustments
-                                arcface_model = self.models_processor.get_arcface_model(parameters['SwapModelSelection'])
-                                dfm_model=parameters['DFMModelSelection']
-                                if self.main_window.swapfacesButton.isChecked():
-                                    if parameters['SwapModelSelection'] != 'DeepFaceLive (DFM)':
-                                        s_e = target_face.assigned_input_embedding.get(arcface_model, None)
-                                    if s_e is not None and np.isnan(s_e).any():
-                                        s_e = None
-                                else:
-                                    dfm_model = None
+                        if self.is_swap_faces_enabled or self.is_edit_faces_enabled:
+                            s_e = None
+                            fface['kps_5'] = self.keypoints_adjustments(fface['kps_5'], parameters, keypoints_scale) #Make keypoints adjustments
+                            arcface_model = self.models_processor.get_arcface_model(parameters['SwapModelSelection'])
+                            dfm_model=parameters['DFMModelSelection']
+                            if self.is_swap_faces_enabled:
+                                if parameters['SwapModelSelection'] != 'DeepFaceLive (DFM)':
+                                    s_e = target_face.assigned_input_embedding.get(arcface_model, None)
+                                if s_e is not None and np.isnan(s_e).any():
                                     s_e = None
+                            else:
+                                dfm_model = None
+                                s_e = None
 
-                                # swap_core function is executed even if 'Swap Faces' button is disabled,
-                                # because it also returns the original face and face mask 
-                                img, fface['original_face'], fface['swap_mask'] = self.swap_core(img, fface['kps_5'], s_e=s_e, t_e=target_face.get_embedding(arcface_model), parameters=parameters, control=control, dfm_model=dfm_model)
-                                        # cv2.imwrite('temp_swap_face.png', swapped_face.permute(1,2,0).cpu().numpy())
-                                if self.main_window.editFacesButton.isChecked():
-                                    img = self.swap_edit_face_core(img, fface['kps_all'], parameters, control)
+                            # swap_core function is executed even if 'Swap Faces' button is disabled,
+                            # because it also returns the original face and face mask 
+                            img, fface['original_face'], fface['swap_mask'] = self.swap_core(img, fface['kps_5'], s_e=s_e, t_e=target_face.get_embedding(arcface_model), parameters=parameters, control=control, dfm_model=dfm_model)
+                                    # cv2.imwrite('temp_swap_face.png', swapped_face.permute(1,2,0).cpu().numpy())
+                            if self.is_edit_faces_enabled:
+                                img = self.swap_edit_face_core(img, fface['kps_all'], parameters, control)
 
         if control['ManualRotationEnableToggle']:
             img = v2.functional.rotate(img, angle=-control['ManualRotationAngleSlider'], interpolation=v2.InterpolationMode.BILINEAR, expand=True)
@@ -230,19 +312,21 @@ class FrameWorker(threading.Thread):
 
         if control["ShowLandmarksEnableToggle"] and det_faces_data:
             img = img.permute(1,2,0)
-            img = self.paint_face_landmarks(img, det_faces_data, control)
+            img = self.paint_face_landmarks(img, det_faces_data, target_matches)
             img = img.permute(2,0,1)
 
         if compare_mode:
-            img = self.get_compare_faces_image(img, det_faces_data, control)
+            img = self.get_compare_faces_image(img, det_faces_data, target_matches, control)
 
         if control['FrameEnhancerEnableToggle'] and not compare_mode:
-            img = self.enhance_core(img, control=control)
+            with profiler.stage('enhance', control['FrameEnhancerTypeSelection']):
+                img = self.enhance_core(img, control=control)
+        return img
 
-        img = img.permute(1,2,0)
-        img = img.cpu().numpy()
-        img = img[..., ::-1]  # RGB to BGR
-        return self.apply_pixel_free_beauty(img, control)
+    def finish_frame(self, img: torch.Tensor) -> np.ndarray:
+        """Last stage of process_frame(): copy the frame back to the host and apply the beauty filter"""
+        img = get_frame_transfer(self.models_processor.device).download(img, swap_channels=True)  # RGB to BGR
+        return self.apply_pixel_free_beauty(img, self.control)
 
     def apply_pixel_free_beauty(self, frame: np.ndarray, control: dict) -> np.ndarray:
         worker = getattr(self.main_window, "pixel_free_worker", None)
@@ -288,7 +372,8 @@ class FrameWorker(threading.Thread):
                 except (TypeError, ValueError):
                     continue
             rotation = int(control.get("BeautyRotationSelection", 0) or 0)
-            result = worker.process(frame, params, rotation)
+            with profiler.stage('beauty'):
+                result = worker.process(frame, params, rotation)
             if result is None:
                 return frame
             return result
@@ -296,61 +381,82 @@ class FrameWorker(threading.Thread):
             print(f"PixelFree 美颜失败: {exc}")
             return frame
     
-    def keypoints_adjustments(self, kps_5: np.ndarray, parameters: dict) -> np.ndarray:
+    @staticmethod
+    def get_processing_size(width: int, height: int) -> Tuple[int, int]:
+        """(width, height) of a frame once scaled up for the models, that need both sides to be at least 512"""
+        if width < 512 and (width <= height or height >= 512):
+            return 512, int(512*height/width)
+        if height < 512:
+            return int(512*width/height), 512
+        return width, height
+
+    def get_keypoints_scale(self, img: torch.Tensor) -> float:
+        """
+        Scale of the pixel offsets of keypoints_adjustments() for the CxHxW img. The offsets are pixels of the frame
+        processed at full resolution, so they are scaled down on the proxy preview frames to move the keypoints as far
+        as in the recording
+        """
+        video_processor = self.video_processor
+        if video_processor is None or video_processor.file_type != 'video' or not video_processor.media_capture or video_processor.get_preview_height() is None:
+            return 1.0
+        full_resolution_size = max(self.get_processing_size(*video_processor.get_source_frame_size()))
+        # The larger side, since the frame can be rotated (ManualRotation)
+        return min(1.0, max(img.size()[1:]) / full_resolution_size) if full_resolution_size > 0 else 1.0
+
+    def keypoints_adjustments(self, kps_5: np.ndarray, parameters: dict, scale=1.0) -> np.ndarray:
+        """Apply the keypoints adjustments, whose offsets (in pixels of the full resolution frame) are multiplied by scale, see get_keypoints_scale()"""
         # Change the ref points
         if parameters['FaceAdjEnableToggle']:
-            kps_5[:,0] += parameters['KpsXSlider']
-            kps_5[:,1] += parameters['KpsYSlider']
-            kps_5[:,0] -= 255
+            kps_5[:,0] += parameters['KpsXSlider'] * scale
+            kps_5[:,1] += parameters['KpsYSlider'] * scale
+            kps_5[:,0] -= 255 * scale
             kps_5[:,0] *= (1+parameters['KpsScaleSlider']/100)
-            kps_5[:,0] += 255
-            kps_5[:,1] -= 255
+            kps_5[:,0] += 255 * scale
+            kps_5[:,1] -= 255 * scale
             kps_5[:,1] *= (1+parameters['KpsScaleSlider']/100)
-            kps_5[:,1] += 255
+            kps_5[:,1] += 255 * scale
 
         # Face Landmarks
         if parameters['LandmarksPositionAdjEnableToggle']:
-            kps_5[0][0] += parameters['EyeLeftXAmountSlider']
-            kps_5[0][1] += parameters['EyeLeftYAmountSlider']
-            kps_5[1][0] += parameters['EyeRightXAmountSlider']
-            kps_5[1][1] += parameters['EyeRightYAmountSlider']
-            kps_5[2][0] += parameters['NoseXAmountSlider']
-            kps_5[2][1] += parameters['NoseYAmountSlider']
-            kps_5[3][0] += parameters['MouthLeftXAmountSlider']
-            kps_5[3][1] += parameters['MouthLeftYAmountSlider']
-            kps_5[4][0] += parameters['MouthRightXAmountSlider']
-            kps_5[4][1] += parameters['MouthRightYAmountSlider']
+            kps_5[0][0] += parameters['EyeLeftXAmountSlider'] * scale
+            kps_5[0][1] += parameters['EyeLeftYAmountSlider'] * scale
+            kps_5[1][0] += parameters['EyeRightXAmountSlider'] * scale
+            kps_5[1][1] += parameters['EyeRightYAmountSlider'] * scale
+            kps_5[2][0] += parameters['NoseXAmountSlider'] * scale
+            kps_5[2][1] += parameters['NoseYAmountSlider'] * scale
+            kps_5[3][0] += parameters['MouthLeftXAmountSlider'] * scale
+            kps_5[3][1] += parameters['MouthLeftYAmountSlider'] * scale
+            kps_5[4][0] += parameters['MouthRightXAmountSlider'] * scale
+            kps_5[4][1] += parameters['MouthRightYAmountSlider'] * scale
         return kps_5
     
-    def paint_face_landmarks(self, img: torch.Tensor, det_faces_data: list, control: dict) -> torch.Tensor:
+    def paint_face_landmarks(self, img: torch.Tensor, det_faces_data: list, target_matches: list) -> torch.Tensor:
         # if img_y <= 720:
         #     p = 1
         # else:
         #     p = 2
         p = 2 #Point thickness
-        for i, fface in enumerate(det_faces_data):
-            for _, target_face in self.main_window.target_faces.items():
+        for fface, matched_target_faces in zip(det_faces_data, target_matches):
+            for target_face in matched_target_faces:
                 parameters = self.parameters[target_face.face_id] #Use the parameters of the target face
-                sim = self.models_processor.findCosineDistance(fface['embedding'], target_face.get_embedding(control['RecognitionModelSelection']))
-                if sim>=parameters['SimilarityThresholdSlider']:
-                    if parameters['LandmarksPositionAdjEnableToggle']:
-                        kcolor = tuple((255, 0, 0))
-                        keypoints = fface['kps_5']
-                    else:
-                        kcolor = tuple((0, 255, 255))
-                        keypoints = fface['kps_all']
-
-                    for kpoint in keypoints:
-                        for i in range(-1, p):
-                            for j in range(-1, p):
-                                try:
-                                    img[int(kpoint[1])+i][int(kpoint[0])+j][0] = kcolor[0]
-                                    img[int(kpoint[1])+i][int(kpoint[0])+j][1] = kcolor[1]
-                                    img[int(kpoint[1])+i][int(kpoint[0])+j][2] = kcolor[2]
-
-                                except ValueError:
-                                    #print("Key-points value {} exceed the image size {}.".format(kpoint, (img_x, img_y)))
-                                    continue
+                if parameters['LandmarksPositionAdjEnableToggle']:
+                    kcolor = tuple((255, 0, 0))
+                    keypoints = fface['kps_5']
+                else:
+                    kcolor = tuple((0, 255, 255))
+                    keypoints = fface['kps_all']
+
+                for kpoint in keypoints:
+                    for i in range(-1, p):
+                        for j in range(-1, p):
+                            try:
+                                img[int(kpoint[1])+i][int(kpoint[0])+j][0] = kcolor[0]
+                                img[int(kpoint[1])+i][int(kpoint[0])+j][1] = kcolor[1]
+                                img[int(kpoint[1])+i][int(kpoint[0])+j][2] = kcolor[2]
+
+                            except ValueError:
+                                #print("Key-points value {} exceed the image size {}.".format(kpoint, (img_x, img_y)))
+                                continue
         return img
     
     def draw_bounding_boxes_on_detected_faces(self, img: torch.Tensor, det_faces_data: list, control: dict):
@@ -377,46 +483,41 @@ class FrameWorker(threading.Thread):
             img[:, y_min:y_max + 1, x_max - thickness + 1:x_max + 1] = color_tensor.expand(-1, y_max - y_min + 1, thickness)   
         return img
 
-    def get_compare_faces_image(self, img: torch.Tensor, det_faces_data: dict, control: dict) -> torch.Tensor:
+    def get_compare_faces_image(self, img: torch.Tensor, det_faces_data: dict, target_matches: list, control: dict) -> torch.Tensor:
         imgs_to_vstack = []  # Renamed for vertical stacking
-        for _, fface in enumerate(det_faces_data):
-            for _, target_face in self.main_window.target_faces.items():
+        for fface, matched_target_faces in zip(det_faces_data, target_matches):
+            for target_face in matched_target_faces:
                 parameters = self.parameters[target_face.face_id]  # Use the parameters of the target face
-                sim = self.models_processor.findCosineDistance(
-                    fface['embedding'], 
-                    target_face.get_embedding(control['RecognitionModelSelection'])
-                )
-                if sim >= parameters['SimilarityThresholdSlider']:
-                    modified_face = self.get_cropped_face_using_kps(img, fface['kps_5'], parameters)
-                    # Apply frame enhancer
-                    if control['FrameEnhancerEnableToggle']:
-                        # Enhance the face and resize it to the original size for stacking
-                        modified_face_enhance = self.enhance_core(modified_face, control=control)
-                        modified_face_enhance = modified_face_enhance.float() / 255.0
-                        # Resize source_tensor to match the size of target_tensor
-                        modified_face = torch.functional.F.interpolate(
-                            modified_face_enhance.unsqueeze(0),  # Add batch dimension
-                            size=modified_face.shape[1:],  # Target size: [H, W]
-                            mode='bilinear',  # Interpolation mode
-                            align_corners=False  # Avoid alignment artifacts
-                        ).squeeze(0)  # Remove batch dimension
-                        
-                        modified_face = (modified_face * 255).clamp(0, 255).to(dtype=torch.uint8)
-                    imgs_to_cat = []
+                modified_face = self.get_cropped_face_using_kps(img, fface['kps_5'], parameters)
+                # Apply frame enhancer
+                if control['FrameEnhancerEnableToggle']:
+                    # Enhance the face and resize it to the original size for stacking
+                    modified_face_enhance = self.enhance_core(modified_face, control=control)
+                    modified_face_enhance = modified_face_enhance.float() / 255.0
+                    # Resize source_tensor to match the size of target_tensor
+                    modified_face = torch.functional.F.interpolate(
+                        modified_face_enhance.unsqueeze(0),  # Add batch dimension
+                        size=modified_face.shape[1:],  # Target size: [H, W]
+                        mode='bilinear',  # Interpolation mode
+                        align_corners=False  # Avoid alignment artifacts
+                    ).squeeze(0)  # Remove batch dimension
                     
-                    # Append tensors to imgs_to_cat
-                    if fface['original_face'] is not None:
-                        imgs_to_cat.append(fface['original_face'].permute(2, 0, 1))
-                    imgs_to_cat.append(modified_face)
-                    if fface['swap_mask'] is not None:
-                        fface['swap_mask'] = 255-fface['swap_mask']
-                        imgs_to_cat.append(fface['swap_mask'].permute(2, 0, 1))
+                    modified_face = (modified_face * 255).clamp(0, 255).to(dtype=torch.uint8)
+                imgs_to_cat = []
+                
+                # Append tensors to imgs_to_cat
+                if fface['original_face'] is not None:
+                    imgs_to_cat.append(fface['original_face'].permute(2, 0, 1))
+                imgs_to_cat.append(modified_face)
+                if fface['swap_mask'] is not None:
+                    fface['swap_mask'] = 255-fface['swap_mask']
+                    imgs_to_cat.append(fface['swap_mask'].permute(2, 0, 1))
   
-                    # Concatenate horizontally for comparison
-                    img_compare = torch.cat(imgs_to_cat, dim=2)
+                # Concatenate horizontally for comparison
+                img_compare = torch.cat(imgs_to_cat, dim=2)
 
-                    # Add horizontally concatenated image to vertical stack list
-                    imgs_to_vstack.append(img_compare)
+                # Add horizontally concatenated image to vertical stack list
+                imgs_to_vstack.append(img_compare)
     
         if imgs_to_vstack:
             # Find the maximum width
@@ -536,9 +637,12 @@ class FrameWorker(threading.Thread):
             dim = 4
         return input_face_affined, dfm_model, dim, latent
     
+    @profile_stage('swap', model_arg='swapper_model')
     def get_swapped_and_prev_face(self, output, input_face_affined, original_face_512, latent, itex, dim, swapper_model, dfm_model, parameters, ):
         # original_face_512, original_face_384, original_face_256, original_face_128 = original_faces
         prev_face = input_face_affined.clone()
+        # The swapper outputs are borrowed from the arena of the worker and given back once copied
+        arena = get_tensor_arena()
         if swapper_model == 'Inswapper128':
             with torch.no_grad():  # Disabilita il calcolo del gradiente se è solo per inferenza
                 for _ in range(itex):
@@ -548,13 +652,14 @@ class FrameWorker(threading.Thread):
                             input_face_disc = input_face_disc.permute(2, 0, 1)
                             input_face_disc = torch.unsqueeze(input_face_disc, 0).contiguous()
 
-                            swapper_output = torch.empty((1,3,128,128), dtype=torch.float32, device=self.models_processor.device).contiguous()
-                            self.models_processor.run_inswapper(input_face_disc, latent, swapper_output)
+                            swapper_output_buffer = arena.borrow((1,3,128,128), device=self.models_processor.device)
+                            self.models_processor.run_inswapper(input_face_disc, latent, swapper_output_buffer)
 
-                            swapper_output = torch.squeeze(swapper_output)
+                            swapper_output = torch.squeeze(swapper_output_buffer)
                             swapper_output = swapper_output.permute(1, 2, 0)
 
-                            output[j::dim, i::dim] = swapper_output.clone()
+                            output[j::dim, i::dim] = swapper_output
+                            arena.give_back(swapper_output_buffer)
                     prev_face = input_face_affined.clone()
                     input_face_affined = output.clone()
                     output = torch.mul(output, 255)
@@ -567,13 +672,14 @@ class FrameWorker(threading.Thread):
                     input_face_disc = input_face_affined.permute(2, 0, 1)
                     input_face_disc = torch.unsqueeze(input_face_disc, 0).contiguous()
 
-                    swapper_output = torch.empty((1,3,256,256), dtype=torch.float32, device=self.models_processor.device).contiguous()
-                    self.models_processor.run_iss_swapper(input_face_disc, latent, swapper_output, version)
+                    swapper_output_buffer = arena.borrow((1,3,256,256), device=self.models_processor.device)
+                    self.models_processor.run_iss_swapper(input_face_disc, latent, swapper_output_buffer, version)
 
-                    swapper_output = torch.squeeze(swapper_output)
+                    swapper_output = torch.squeeze(swapper_output_buffer)
                     swapper_output = swapper_output.permute(1, 2, 0)
 
                     output = swapper_output.clone()
+                    arena.give_back(swapper_output_buffer)
                     prev_face = input_face_affined.clone()
                     input_face_affined = output.clone()
                     output = torch.mul(output, 255)
@@ -583,14 +689,15 @@ class FrameWorker(threading.Thread):
             for k in range(itex):
                 input_face_disc = input_face_affined.permute(2, 0, 1)
                 input_face_disc = torch.unsqueeze(input_face_disc, 0).contiguous()
-                swapper_output = torch.empty((1,3,512,512), dtype=torch.float32, device=self.models_processor.device).contiguous()
-                self.models_processor.run_swapper_simswap512(input_face_disc, latent, swapper_output)
-                swapper_output = torch.squeeze(swapper_output)
+                swapper_output_buffer = arena.borrow((1,3,512,512), device=self.models_processor.device)
+                self.models_processor.run_swapper_simswap512(input_face_disc, latent, swapper_output_buffer)
+                swapper_output = torch.squeeze(swapper_output_buffer)
                 swapper_output = swapper_output.permute(1, 2, 0)
                 prev_face = input_face_affined.clone()
                 input_face_affined = swapper_output.clone()
 
                 output = swapper_output.clone()
+                arena.give_back(swapper_output_buffer)
                 output = torch.mul(output, 255)
                 output = torch.clamp(output, 0, 255)
 
@@ -601,11 +708,12 @@ class FrameWorker(threading.Thread):
                 input_face_disc = torch.sub(input_face_disc, 1)
                 #input_face_disc = input_face_disc[[2, 1, 0], :, :] # Inverte i canali da BGR a RGB (assumendo che l'input sia BGR)
                 input_face_disc = torch.unsqueeze(input_face_disc, 0).contiguous()
-                swapper_output = torch.empty((1,3,256,256), dtype=torch.float32, device=self.models_processor.device).contiguous()
-                self.models_processor.run_swapper_ghostface(input_face_disc, latent, swapper_output, swapper_model)
-                swapper_output = swapper_output[0]
+                swapper_output_buffer = arena.borrow((1,3,256,256), device=self.models_processor.device)
+                self.models_processor.run_swapper_ghostface(input_face_disc, latent, swapper_output_buffer, swapper_model)
+                swapper_output = swapper_output_buffer[0]
                 swapper_output = swapper_output.permute(1, 2, 0)
                 swapper_output = torch.mul(swapper_output, 127.5)
+                arena.give_back(swapper_output_buffer)
                 swapper_output = torch.add(swapper_output, 127.5)
                 #swapper_output = swapper_output[:, :, [2, 1, 0]] # Inverte i canali da RGB a BGR (assumendo che l'input sia RGB)
                 prev_face = input_face_affined.clone()
@@ -620,10 +728,11 @@ class FrameWorker(threading.Thread):
                 input_face_disc = input_face_affined.permute(2, 0, 1)
                 input_face_disc = v2.functional.normalize(input_face_disc, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=False)
                 input_face_disc = torch.unsqueeze(input_face_disc, 0).contiguous()
-                swapper_output = torch.empty((1,3,256,256), dtype=torch.float32, device=self.models_processor.device).contiguous()
-                self.models_processor.run_swapper_cscs(input_face_disc, latent, swapper_output)
-                swapper_output = torch.squeeze(swapper_output)
+                swapper_output_buffer = arena.borrow((1,3,256,256), device=self.models_processor.device)
+                self.models_processor.run_swapper_cscs(input_face_disc, latent, swapper_output_buffer)
+                swapper_output = torch.squeeze(swapper_output_buffer)
                 swapper_output = torch.add(torch.mul(swapper_output, 0.5), 0.5)
+                arena.give_back(swapper_output_buffer)
                 swapper_output = swapper_output.permute(1, 2, 0)
                 prev_face = input_face_affined.clone()
                 input_face_affined = swapper_output.clone()
@@ -872,6 +981,12 @@ class FrameWorker(threading.Thread):
             swap_mask_clone = swap_mask_clone.permute(1, 2, 0)
             swap_mask_clone = torch.mul(swap_mask_clone, 255.).type(torch.uint8)
 
+        img = self.paste_back_swapped_face(img, swap, swap_mask, tform)
+        return img, original_face_512_clone, swap_mask_clone
+
+    @profile_stage('paste-back')
+    def paste_back_swapped_face(self, img, swap, swap_mask, tform):
+        """Untransform the 512 swapped face and its mask and blend them back into the frame"""
         # Calculate the area to be mergerd back to the original frame
         IM512 = tform.inverse.params[0:2, :]
         corners = np.array([[0,0], [0,511], [511, 0], [511, 511]])
@@ -915,9 +1030,7 @@ class FrameWorker(threading.Thread):
         swap = swap.type(torch.uint8)
         swap = swap.permute(2,0,1)
         img[0:3, top:bottom, left:right] = swap
-
-
-        return img, original_face_512_clone, swap_mask_clone
+        return img
 
     def enhance_core(self, img, control):
         enhancer_type = control['FrameEnhancerTypeSelection']
@@ -1071,6 +1184,7 @@ class FrameWorker(threading.Thread):
 
         return img
 
+    @profile_stage('expression')
     def apply_face_expression_restorer(self, driving, target, parameters):
         """ Apply face expression restorer from driving to target.
 
@@ -1283,6 +1397,7 @@ class FrameWorker(threading.Thread):
 
         return out
 
+    @profile_stage('edit')
     def swap_edit_face_core(self, img, kps, parameters, control, **kwargs): # img = RGB
         # Grab 512 face from image and create 256 and 128 copys
         if parameters['FaceEditorEnableToggle']:
@@ -0,0 +1,86 @@
+import queue
+import threading
+from typing import TYPE_CHECKING, Any, Callable, List, Tuple
+
+import numpy as np
+
+from app.processors.workers.frame_worker import FrameWorker
+
+if TYPE_CHECKING:
+    from app.ui.main_ui import MainWindow
+
+class FrameWorkerPool:
+    """
+    Fixed pool of long-lived FrameWorker threads.
+    Frames are submitted to a bounded work queue and the results are put on the completion queue as (frame_number, result) tuples.
+    result is None when processing of the frame failed, so that the consumer can skip it instead of waiting for it forever.
+    """
+    def __init__(self, main_window: 'MainWindow', num_workers=2, worker_class=FrameWorker):
+        self.num_workers = num_workers
+        self.work_queue: queue.Queue[Tuple[int, np.ndarray, Callable|None]|None] = queue.Queue(maxsize=num_workers)
+        self.completion_queue: queue.Queue[Tuple[int, Any]] = queue.Queue()
+        self._pending = 0 # Number of frames submitted but not yet processed
+        self._pending_condition = threading.Condition()
+        self.workers: List[FrameWorker] = []
+        for _ in range(num_workers):
+            worker = worker_class(main_window, self.work_queue, self.completion_queue, self._on_job_done)
+            worker.start()
+            self.workers.append(worker)
+
+    def _on_job_done(self):
+        with self._pending_condition:
+            self._pending -= 1
+            self._pending_condition.notify_all()
+
+    @property
+    def pending(self) -> int:
+        with self._pending_condition:
+            return self._pending
+
+    def is_busy(self) -> bool:
+        """True when every worker already has a frame to process, ie submit() would block"""
+        return self.pending >= self.num_workers
+
+    def wait_for_free_worker(self, timeout=None) -> bool:
+        """Block until a worker is free (is_busy() is False) or the timeout expires. Returns True if a worker is free"""
+        with self._pending_condition:
+            return self._pending_condition.wait_for(lambda: self._pending < self.num_workers, timeout)
+
+    def submit(self, frame_number: int, frame: np.ndarray, on_done: Callable|None = None):
+        """Queue the RGB frame for processing. on_done is called once the worker doesn't need the frame anymore"""
+        with self._pending_condition:
+            self._pending += 1
+        self.work_queue.put((frame_number, frame, on_done))
+
+    def get_completed(self, block=False, timeout=None) -> Tuple[int, Any]|None:
+        try:
+            return self.completion_queue.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def wait_until_idle(self):
+        self.work_queue.join()
+
+    def clear(self):
+        """Drop the frames waiting to be processed, wait for the running ones and discard all the results"""
+        while True:
+            try:
+                job = self.work_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                if job[2]:
+                    job[2]()
+                self._on_job_done()
+            self.work_queue.task_done()
+        self.wait_until_idle()
+        with self.completion_queue.mutex:
+            self.completion_queue.queue.clear()
+
+    def shutdown(self):
+        self.clear()
+        for _ in self.workers:
+            self.work_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers.clear()
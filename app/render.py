@@ -0,0 +1,187 @@
+# Headless batch render, driving the swap pipeline without the Qt GUI
+# Usage Example
+# 'python -m app.render last_workspace.json --media input.mp4 --output output.mp4 --provider CPU'
+# 'python -m app.render last_workspace.json --processes 4' (Render the video in segments, in 4 worker processes)
+# 'python -m app.render last_workspace.json --checkpoint' and after an interruption 'python -m app.render last_workspace.json --resume'
+# 'python -m app.render last_workspace.json --images photos/ --output swapped/' (Process all the images of a folder)
+
+import os
+import sys
+import argparse
+
+# No display server is needed, but make sure Qt never tries to connect to one
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import torch
+
+from app.processors.render_session import load_render_session
+from app.processors.video_renderer import VideoRenderer, create_models_processor
+from app.processors.image_batch_renderer import ImageBatchRenderer
+from app.processors.segmented_renderer import SegmentedRenderer, get_workspace_hash, get_model_selections
+import app.helpers.miscellaneous as misc_helpers
+from app.helpers.stage_profiler import profiler
+from app.helpers.trace_recorder import tracer
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser("VisoMaster Headless Render")
+    parser.add_argument("workspace_file", help="Workspace file saved from the GUI", type=str)
+    parser.add_argument("--media", help="Target video to render (default: the selected media of the workspace)", type=str)
+    parser.add_argument("--output", help="Output video file (default: timestamped file in the workspace output folder)", type=str)
+    parser.add_argument("--provider", help="Execution provider (default: the workspace provider, or CPU when CUDA is not available)", choices=('CUDA', 'TensorRT', 'TensorRT-Engine', 'CPU'), type=str)
+    parser.add_argument("--threads", help="Number of execution threads for the models", type=int)
+    parser.add_argument("--start", help="First frame to render", default=0, type=int)
+    parser.add_argument("--end", help="Last frame to render (inclusive)", type=int)
+    parser.add_argument("--edit-faces", help="Enable the face editor, like the 'Edit Faces' button", action='store_true')
+    parser.add_argument("--no-swap", help="Disable face swapping, like un-checking the 'Swap Faces' button", action='store_true')
+    parser.add_argument("--processes", help="Number of worker processes rendering keyframe aligned segments of the video in parallel, each with its own models (default: 1, render in this process)", default=1, type=int)
+    parser.add_argument("--segments", help="Number of segments to split the video into when using --processes (default: 4 per process)", type=int)
+    parser.add_argument("--checkpoint", help="Render in segments and keep the finished ones with a manifest, so that an interrupted render can be resumed", action='store_true')
+    parser.add_argument("--resume", help="Resume the render from the segments of the checkpoint (refused if the workspace or the models changed since)", action='store_true')
+    parser.add_argument("--checkpoint-dir", help="Folder of the checkpoint (default: hidden folder named after the media, in the output folder)", type=str)
+    parser.add_argument("--images", help="Process still images instead of a video: the images of the given folder, or without a folder the images of the workspace target media list. --output is then the output folder", nargs='?', const='', type=str)
+    parser.add_argument("--decode-threads", help="Number of threads decoding the images ahead of the frame workers, with --images", default=4, type=int)
+    parser.add_argument("--stage-stats", help="Record the time of every processing stage (decode, detect, swap, restore, encode...) and save their stats to this .json or .csv file. Not recorded by the worker processes of --processes", type=str)
+    parser.add_argument("--stage-stats-sync", help="With --stage-stats, synchronize the GPU around every stage for accurate GPU timings", action='store_true')
+    parser.add_argument("--trace", help="Record a timeline of the processing (model calls, stages, lock waits, decode, encode per thread) and save it to this Chrome trace .json file, for ui.perfetto.dev or chrome://tracing. Not recorded by the worker processes of --processes", type=str)
+    parser.add_argument("--trace-frames", help="With --trace, the frames to record as START:END (inclusive, default: all the frames)", type=str)
+    parser.add_argument("--overwrite", help="With --images, also process the images that already have an output file in the output folder", action='store_true')
+    return parser.parse_args(argv)
+
+def print_progress(frames_rendered, total_frames):
+    print(f"\rRendered {frames_rendered}/{total_frames} frames", end='', flush=True)
+
+def print_image_progress(images_done, total_images):
+    print(f"\rProcessed {images_done}/{total_images} images", end='', flush=True)
+
+def get_provider(args, session):
+    provider = args.provider or session.control['ProvidersPrioritySelection']
+    if provider != 'CPU' and not torch.cuda.is_available():
+        print(f"CUDA is not available, using CPU instead of {provider}")
+        provider = 'CPU'
+    return provider
+
+def render_images(args, session):
+    if args.images:
+        if not os.path.isdir(args.images):
+            print(f"Image folder not found: {args.images}")
+            return 1
+        image_paths = sorted(misc_helpers.get_image_files(args.images))
+    else:
+        image_paths = [media_path for media_path in session.target_media_paths if misc_helpers.get_file_type(media_path) == 'image' and misc_helpers.is_file_exists(media_path)]
+    if not image_paths:
+        print("No images to process")
+        return 1
+    output_folder = args.output or session.control['OutputMediaFolder'] or args.images or misc_helpers.get_dir_of_file(image_paths[0])
+    os.makedirs(output_folder, exist_ok=True)
+
+    provider = get_provider(args, session)
+    threads = args.threads or session.control['nThreadsSlider']
+    print(f"Processing {len(image_paths)} images -> {output_folder} ({provider})")
+    models_processor = create_models_processor(session, provider, threads)
+    renderer = ImageBatchRenderer(session, num_workers=threads, num_decode_threads=args.decode_threads)
+    stats = renderer.render(image_paths, output_folder, skip_existing=not args.overwrite, progress_callback=print_image_progress)
+    models_processor.clear_gpu_memory()
+    print(f"\nProcessing completed in {renderer.processing_time} seconds")
+    print(f"Processed: {stats['processed']}, skipped (output exists): {stats['skipped']}, failed: {stats['failed']}\n")
+    return 0 if stats['failed'] == 0 else 1
+
+def save_stage_stats(args):
+    if not args.stage_stats:
+        return
+    profiler.print_stats()
+    profiler.export(args.stage_stats)
+    print(f"Stage timings saved to {args.stage_stats}")
+
+def start_trace(args):
+    if not args.trace:
+        return True
+    start_frame, end_frame = 0, None
+    if args.trace_frames:
+        try:
+            start_text, end_text = args.trace_frames.split(':')
+            start_frame = int(start_text) if start_text else 0
+            end_frame = int(end_text) if end_text else None
+        except ValueError:
+            print(f"Invalid --trace-frames: {args.trace_frames}, expected START:END")
+            return False
+    tracer.start(start_frame, end_frame)
+    return True
+
+def save_trace(args):
+    if not args.trace:
+        return
+    tracer.stop()
+    tracer.save(args.trace)
+    print(f"Trace of {len(tracer.events)} spans saved to {args.trace}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not start_trace(args):
+        return 1
+    session = load_render_session(args.workspace_file)
+    session.swap_faces = not args.no_swap
+    session.edit_faces = args.edit_faces
+    if args.stage_stats:
+        profiler.enabled = True
+        profiler.synchronize = args.stage_stats_sync
+
+    if args.images is not None:
+        result = render_images(args, session)
+        save_stage_stats(args)
+        save_trace(args)
+        return result
+    if not misc_helpers.is_ffmpeg_in_path():
+        return 1
+
+    media_path = args.media or session.selected_media_path
+    if not misc_helpers.is_file_exists(media_path) or misc_helpers.get_file_type(media_path) != 'video':
+        print(f"Target video not found: {media_path}")
+        return 1
+    output_file_path = args.output
+    if not output_file_path:
+        output_folder = session.control['OutputMediaFolder'] or misc_helpers.get_dir_of_file(media_path)
+        output_file_path = misc_helpers.get_output_file_path(media_path, output_folder)
+
+    provider = get_provider(args, session)
+    threads = args.threads or session.control['nThreadsSlider']
+    print(f"Rendering {media_path} -> {output_file_path} ({provider})")
+    if args.checkpoint or args.resume:
+        checkpoint_dir = args.checkpoint_dir or os.path.join(misc_helpers.get_dir_of_file(output_file_path), f'.{os.path.basename(media_path)}.render_checkpoint')
+        render_info = {
+            'workspace_hash': get_workspace_hash(args.workspace_file),
+            'model_selections': get_model_selections(session),
+            'swap_faces': session.swap_faces,
+            'edit_faces': session.edit_faces,
+        }
+        renderer = SegmentedRenderer(args.workspace_file, provider, threads, swap_faces=session.swap_faces, edit_faces=session.edit_faces, num_processes=args.processes, num_segments=args.segments)
+        try:
+            avg_fps = renderer.render(media_path, output_file_path, start_frame=args.start, end_frame=args.end, progress_callback=print_progress,
+                                      checkpoint_dir=checkpoint_dir, render_info=render_info, resume=args.resume)
+        except RuntimeError as e:
+            print(f"\n{e}")
+            return 1
+    elif args.processes > 1:
+        renderer = SegmentedRenderer(args.workspace_file, provider, threads, swap_faces=session.swap_faces, edit_faces=session.edit_faces, num_processes=args.processes, num_segments=args.segments)
+        try:
+            avg_fps = renderer.render(media_path, output_file_path, start_frame=args.start, end_frame=args.end, progress_callback=print_progress)
+        except RuntimeError as e:
+            print(f"\n{e}")
+            return 1
+    else:
+        models_processor = create_models_processor(session, provider, threads)
+        renderer = VideoRenderer(session)
+        try:
+            avg_fps = renderer.render(media_path, output_file_path, start_frame=args.start, end_frame=args.end, progress_callback=print_progress)
+        except RuntimeError as e:
+            print(f"\n{e}")
+            return 1
+        finally:
+            models_processor.clear_gpu_memory()
+    print(f"\nProcessing completed in {renderer.processing_time} seconds")
+    print(f'Average FPS: {avg_fps}\n')
+    save_stage_stats(args)
+    save_trace(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
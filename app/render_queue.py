@@ -0,0 +1,100 @@
+# Render queue, persisted on disk and run without the Qt GUI
+# Usage Example
+# 'python -m app.render_queue add last_workspace.json --media input1.mp4 --media input2.mp4' (Queue jobs with a snapshot of the workspace)
+# 'python -m app.render_queue list'
+# 'python -m app.render_queue run --provider CUDA --jobs 2' (Run the queued jobs, up to 2 at a time)
+
+import os
+import sys
+import argparse
+from datetime import datetime
+
+# No display server is needed, but make sure Qt never tries to connect to one
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import torch
+
+from app.processors.render_session import load_render_session
+from app.processors.render_scheduler import RenderQueue, RenderScheduler, DEFAULT_RENDER_QUEUE_DIR
+import app.helpers.miscellaneous as misc_helpers
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser("VisoMaster Render Queue")
+    parser.add_argument("--queue-dir", help="Folder of the render queue", default=DEFAULT_RENDER_QUEUE_DIR, type=str)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help="Queue target media with a snapshot of a workspace saved from the GUI")
+    add_parser.add_argument("workspace_file", help="Workspace file saved from the GUI", type=str)
+    add_parser.add_argument("--media", help="Target media to render, can be repeated (default: the selected media of the workspace)", action='append', type=str)
+    add_parser.add_argument("--output-folder", help="Output folder (default: the workspace output folder)", default='', type=str)
+    add_parser.add_argument("--edit-faces", help="Enable the face editor, like the 'Edit Faces' button", action='store_true')
+    add_parser.add_argument("--no-swap", help="Disable face swapping, like un-checking the 'Swap Faces' button", action='store_true')
+
+    subparsers.add_parser('list', help="List the jobs of the queue")
+
+    remove_parser = subparsers.add_parser('remove', help="Remove jobs from the queue")
+    remove_parser.add_argument("job_ids", nargs='+', type=str)
+
+    subparsers.add_parser('retry', help="Queue the failed jobs again")
+
+    run_parser = subparsers.add_parser('run', help="Run the queued jobs until the queue is empty")
+    run_parser.add_argument("--provider", help="Execution provider (default: CUDA, or CPU when CUDA is not available)", choices=('CUDA', 'TensorRT', 'TensorRT-Engine', 'CPU'), type=str)
+    run_parser.add_argument("--threads", help="Number of execution threads for the models", default=2, type=int)
+    run_parser.add_argument("--jobs", help="Maximum number of jobs rendered at the same time", default=1, type=int)
+    run_parser.add_argument("--min-free-memory", help="Free GPU memory (MB) needed to start another job while one is running", default=4096, type=int)
+    return parser.parse_args(argv)
+
+def add_jobs(args, render_queue: RenderQueue):
+    media_paths = args.media or [load_render_session(args.workspace_file).selected_media_path]
+    for media_path in media_paths:
+        if not misc_helpers.is_file_exists(media_path) or not misc_helpers.get_file_type(media_path):
+            print(f"Target media not found: {media_path}")
+            return 1
+    for media_path in media_paths:
+        job = render_queue.add_job(args.workspace_file, media_path, args.output_folder, swap_faces=not args.no_swap, edit_faces=args.edit_faces)
+        print(f"Queued job {job.job_id}: {job.media_path}")
+    return 0
+
+def list_jobs(render_queue: RenderQueue):
+    if not render_queue.jobs:
+        print("The render queue is empty")
+    for job in render_queue.jobs:
+        queued_time = datetime.fromtimestamp(job.queued_time).strftime('%Y-%m-%d %H:%M:%S')
+        details = job.output_file_path if job.status == 'done' else job.error
+        print(f"{job.job_id}  {job.status:<7}  {queued_time}  {job.media_path}  {details}")
+    return 0
+
+def print_progress(job, done, total):
+    print(f"\r[{job.job_id}] Rendered {done}/{total} frames", end='', flush=True)
+
+def run_jobs(args, render_queue: RenderQueue):
+    if not misc_helpers.is_ffmpeg_in_path():
+        return 1
+    provider = args.provider or 'CUDA'
+    if provider != 'CPU' and not torch.cuda.is_available():
+        print(f"CUDA is not available, using CPU instead of {provider}")
+        provider = 'CPU'
+    scheduler = RenderScheduler(render_queue, provider, args.threads, max_concurrent_jobs=args.jobs, min_free_memory_mb=args.min_free_memory)
+    stats = scheduler.run(progress_callback=print_progress)
+    print(f"\nRender queue finished: {stats['done']} done, {stats['failed']} failed")
+    return 0 if stats['failed'] == 0 else 1
+
+def main(argv=None):
+    args = parse_args(argv)
+    render_queue = RenderQueue(args.queue_dir)
+    if args.command == 'add':
+        return add_jobs(args, render_queue)
+    if args.command == 'list':
+        return list_jobs(render_queue)
+    if args.command == 'remove':
+        for job_id in args.job_ids:
+            if not render_queue.remove_job(job_id):
+                print(f"Job {job_id} not found or running")
+        return 0
+    if args.command == 'retry':
+        print(f"Queued {render_queue.requeue_failed_jobs()} failed jobs again")
+        return 0
+    return run_jobs(args, render_queue)
+
+if __name__ == "__main__":
+    sys.exit(main())
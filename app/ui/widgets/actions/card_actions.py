@@ -4,12 +4,13 @@ import uuid
 
 import numpy
 import cv2
-import torch
 from torchvision.transforms import v2
 
 import app.ui.widgets.actions.common_actions as common_widget_actions
 from app.ui.widgets.actions import list_view_actions
 import app.helpers.miscellaneous as misc_helpers
+from app.processors.frame_transfer import get_frame_transfer
+from app.processors.face_matcher import FaceMatcher
 from app.ui.widgets.settings_layout_data import SETTINGS_LAYOUT_DATA
 
 if TYPE_CHECKING:
@@ -79,12 +80,9 @@ def find_target_faces(main_window: 'MainWindow'):
             media_capture.set(cv2.CAP_PROP_POS_FRAMES, video_processor.current_frame_number)
 
         if frame is not None:
-        # Frame must be in RGB format
-            frame = frame[..., ::-1]  # Swap the channels from BGR to RGB
-
-            # print(frame)
-            img = torch.from_numpy(frame.astype('uint8')).to(main_window.models_processor.device)
-            img = img.permute(2,0,1)
+            frame_transfer = get_frame_transfer(main_window.models_processor.device)
+            # Frame must be in RGB format
+            img = frame_transfer.upload(frame, swap_channels=True)  # Swap the channels from BGR to RGB
             if control['ManualRotationEnableToggle']:
                 img = v2.functional.rotate(img, angle=control['ManualRotationAngleSlider'], interpolation=v2.InterpolationMode.BILINEAR, expand=True)
 
@@ -98,18 +96,12 @@ def find_target_faces(main_window: 'MainWindow'):
             if ret:
                 # Loop through all faces in video frame
                 for face in ret:
-                    found = False
                     # Check if this face has already been found
-                    for face_id, target_face in main_window.target_faces.items():
-                        parameters = main_window.parameters[target_face.face_id]
-                        threshhold = parameters['SimilarityThresholdSlider']
-                        if main_window.models_processor.findCosineDistance(target_face.get_embedding(control['RecognitionModelSelection']), face[1]) >= threshhold:
-                            found = True
-                            break
+                    face_ids, similarities = main_window.models_processor.face_matcher.get_similarities([face[1]], main_window.target_faces, control['RecognitionModelSelection'])
+                    thresholds = numpy.array([main_window.parameters[face_id]['SimilarityThresholdSlider'] for face_id in face_ids], dtype=numpy.float32)
+                    found = FaceMatcher.match_faces(similarities, thresholds).any()
                     if not found:
-                        face_img = face[2].cpu().numpy()
-                        face_img = face_img[..., ::-1]  # Swap the channels from RGB to BGR
-                        face_img = numpy.ascontiguousarray(face_img)
+                        face_img = frame_transfer.download(face[2].permute(2,0,1), swap_channels=True)  # Swap the channels from RGB to BGR
                         # crop = cv2.resize(face[2].cpu().numpy(), (82, 82))
                         pixmap = common_widget_actions.get_pixmap_from_frame(main_window, face_img)
 
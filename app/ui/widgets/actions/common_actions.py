@@ -11,6 +11,7 @@ from PySide6 import QtWidgets,QtCore,QtGui
 from app.ui.widgets import widget_components
 from app.ui.widgets.settings_layout_data import SETTINGS_LAYOUT_DATA
 import app.helpers.miscellaneous as misc_helpers
+from app.helpers.stage_profiler import profile_stage
 if TYPE_CHECKING:
     from app.ui.main_ui import MainWindow
     
@@ -226,6 +227,7 @@ def show_hide_related_widgets(main_window: 'MainWindow', parent_widget, parent_w
             parent_widget.start_animation()
 
 # @misc_helpers.benchmark    
+@profile_stage('pixmap')
 def get_pixmap_from_frame(main_window: 'MainWindow', frame: np.ndarray):
     height, width, channel = frame.shape
     if channel == 2:
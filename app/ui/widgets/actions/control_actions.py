@@ -10,6 +10,8 @@ except Exception:
 if TYPE_CHECKING:
     from app.ui.main_ui import MainWindow
 from app.ui.widgets.actions import common_actions as common_widget_actions
+from app.helpers.stage_profiler import profiler
+from app.helpers.trace_recorder import tracer
 
 #'''
 #    Define functions here that has to be executed when value of a control widget (In the settings tab) is changed.
@@ -58,6 +60,57 @@ def set_video_playback_fps(main_window: 'MainWindow', set_video_fps=False):
     if set_video_fps and main_window.video_processor.media_capture:
         main_window.parameter_widgets['VideoPlaybackCustomFpsSlider'].set_value(main_window.video_processor.fps)
 
+def change_processed_frame_cache_size(main_window: 'MainWindow', new_size_mb):
+    main_window.video_processor.processed_frame_cache.set_max_bytes(new_size_mb * 1024**2)
+
+def refresh_preview_resolution(main_window: 'MainWindow', _preview_resolution):
+    video_processor = main_window.video_processor
+    if not video_processor.processing:
+        video_processor.process_current_frame()
+
+def change_frame_pipeline(main_window: 'MainWindow', _value=None):
+    main_window.video_processor.stop_processing()
+    # The pool is recreated with the new stages settings when the playback/recording starts again
+    main_window.video_processor.reset_worker_pool()
+
+def toggle_stage_profiling(main_window: 'MainWindow', toggle_value=False):
+    from app.ui.widgets.widget_components import StageProfilerDialog # pylint: disable=import-outside-toplevel
+    profiler.reset()
+    profiler.synchronize = main_window.control['StageProfilingSyncToggle']
+    profiler.enabled = toggle_value
+    dialog = getattr(main_window, 'stage_profiler_dialog', None)
+    if toggle_value:
+        if dialog is None:
+            dialog = main_window.stage_profiler_dialog = StageProfilerDialog(main_window)
+        dialog.show()
+        dialog.raise_()
+    elif dialog is not None:
+        dialog.hide()
+
+def toggle_stage_profiling_sync(main_window: 'MainWindow', toggle_value=False):
+    profiler.synchronize = toggle_value
+    # Timings with and without synchronization are not comparable
+    profiler.reset()
+
+def toggle_trace_recording(main_window: 'MainWindow', toggle_value=False):
+    if toggle_value:
+        # The trace starts at the current frame of the video
+        start_frame = main_window.videoSeekSlider.value()
+        tracer.start(start_frame, start_frame + int(main_window.control['TraceFrameCountSlider']) - 1)
+        return
+    tracer.stop()
+    if not tracer.events:
+        return
+    file_path, _ = QtWidgets.QFileDialog.getSaveFileName(main_window, "Save Frame Processing Trace", 'frame_trace.json', "Trace Files (*.json)")
+    if not file_path:
+        return
+    tracer.save(file_path)
+    common_widget_actions.create_and_show_toast_message(main_window, 'Trace Saved', f'Open {file_path} in ui.perfetto.dev or chrome://tracing', style_type='success')
+
+def change_trace_frame_count(main_window: 'MainWindow', frame_count=30):
+    if tracer.recording:
+        tracer.end_frame = tracer.start_frame + int(frame_count) - 1
+
 def toggle_virtualcam(main_window: 'MainWindow', toggle_value=False):
     video_processor = main_window.video_processor
     if toggle_value:
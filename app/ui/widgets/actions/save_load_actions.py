@@ -277,4 +277,26 @@ def save_current_workspace(main_window: 'MainWindow', data_filename:str|bool = F
     if data_filename:
         with open(data_filename, 'w') as data_file: #pylint: disable=unspecified-encoding
             data_as_json = json.dumps(save_data, indent=4)  # Salva con indentazione per leggibilità
-            data_file.write(data_as_json)
\ No newline at end of file
+            data_file.write(data_as_json)
+
+def add_media_to_render_queue(main_window: 'MainWindow', media_path: str):
+    """Queue a render of media_path with a snapshot of the current workspace, to be run with 'python -m app.render_queue run'"""
+    # Imported here because the render queue pulls in the headless renderers
+    from app.processors.render_scheduler import RenderQueue
+    if not main_window.outputFolderLineEdit.text():
+        common_widget_actions.create_and_show_messagebox(main_window, 'No Output Folder Selected','Please select an Output folder to save the Images/Videos before Saving/Recording!', main_window)
+        return
+    render_queue = RenderQueue()
+    snapshot_file = str(Path(render_queue.queue_dir) / f'{uuid.uuid1().hex[:8]}.snapshot.json')
+    save_current_workspace(main_window, snapshot_file)
+    if main_window.video_processor.media_path != media_path:
+        # The markers belong to the media that is currently loaded, not to this one
+        with open(snapshot_file, 'r') as data_file: #pylint: disable=unspecified-encoding
+            data = json.load(data_file)
+        data['markers'] = {}
+        with open(snapshot_file, 'w') as data_file: #pylint: disable=unspecified-encoding
+            data_file.write(json.dumps(data, indent=4))
+    job = render_queue.add_job(snapshot_file, media_path, output_folder=main_window.control['OutputMediaFolder'],
+                               swap_faces=main_window.swapfacesButton.isChecked(), edit_faces=main_window.editFacesButton.isChecked())
+    Path(snapshot_file).unlink()
+    common_widget_actions.create_and_show_toast_message(main_window, 'Added to Render Queue', f'Queued render job {job.job_id}: {Path(media_path).name}')
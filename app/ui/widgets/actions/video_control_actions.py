@@ -470,8 +470,10 @@ def save_current_frame_to_file(main_window: 'MainWindow'):
     if not main_window.outputFolderLineEdit.text():
         common_widget_actions.create_and_show_messagebox(main_window, 'No Output Folder Selected','Please select an Output folder to save the Images/Videos before Saving/Recording!', main_window)
         return
-    frame = main_window.video_processor.current_frame.copy()
+    # The displayed frame can be at the proxy preview resolution, always save it at full resolution
+    frame = main_window.video_processor.process_full_resolution_frame()
     if isinstance(frame, numpy.ndarray):
+        frame = frame.copy()
         # save_filename, _ = os.path.splitext(main_window.video_processor.media_path)
         # save_filename, _ = QtWidgets.QFileDialog.getSaveFileName(main_window, 'Save Frame as Image', f'{save_filename}.png', filter='PNG (*.png)',)
         save_filename = misc_helpers.get_output_file_path(main_window.video_processor.media_path, main_window.control['OutputMediaFolder'], media_type='image')
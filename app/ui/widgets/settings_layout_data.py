@@ -35,6 +35,92 @@ SETTINGS_LAYOUT_DATA: LayoutDictTypes = {
             'exec_function': control_actions.change_threads_number,
             'exec_function_args': [],
         },
+        'FrameStagePipelineEnableToggle': {
+            'level': 1,
+            'label': '分阶段流水线处理',
+            'default': False,
+            'help': '播放和录制时将每帧的处理拆分为检测、换脸/增强、回传/美颜三个阶段，各阶段由独立线程执行，相邻帧在不同阶段同时处理。启用后使用下面的各阶段线程数代替线程数设置。',
+            'exec_function': control_actions.change_frame_pipeline,
+            'exec_function_args': [],
+        },
+        'DetectStageThreadsSlider': {
+            'level': 2,
+            'label': '检测阶段线程数',
+            'min_value': '1',
+            'max_value': '8',
+            'default': '1',
+            'step': 1,
+            'parentToggle': 'FrameStagePipelineEnableToggle',
+            'requiredToggleValue': True,
+            'help': '人脸检测和识别阶段的线程数。',
+            'exec_function': control_actions.change_frame_pipeline,
+            'exec_function_args': [],
+        },
+        'SwapStageThreadsSlider': {
+            'level': 2,
+            'label': '换脸阶段线程数',
+            'min_value': '1',
+            'max_value': '8',
+            'default': '2',
+            'step': 1,
+            'parentToggle': 'FrameStagePipelineEnableToggle',
+            'requiredToggleValue': True,
+            'help': '换脸、编辑和帧增强阶段的线程数。此阶段通常最慢，强烈依赖GPU显存。',
+            'exec_function': control_actions.change_frame_pipeline,
+            'exec_function_args': [],
+        },
+        'FinishStageThreadsSlider': {
+            'level': 2,
+            'label': '输出阶段线程数',
+            'min_value': '1',
+            'max_value': '8',
+            'default': '1',
+            'step': 1,
+            'parentToggle': 'FrameStagePipelineEnableToggle',
+            'requiredToggleValue': True,
+            'help': '将帧复制回内存并进行美颜处理阶段的线程数。',
+            'exec_function': control_actions.change_frame_pipeline,
+            'exec_function_args': [],
+        },
+        'StageProfilingEnableToggle': {
+            'level': 1,
+            'label': '分阶段耗时统计',
+            'default': False,
+            'help': '统计解码、检测、关键点、识别、换脸、修复、遮罩、回贴、增强、美颜、显示和编码各阶段的耗时（按模型分别统计最近300次的p50/p95/最大值），并在面板中显示，可导出为JSON或CSV。关闭时几乎没有额外开销。停止处理时也会在控制台打印统计结果。',
+            'exec_function': control_actions.toggle_stage_profiling,
+            'exec_function_args': [],
+        },
+        'StageProfilingSyncToggle': {
+            'level': 2,
+            'label': '同步GPU计时',
+            'default': False,
+            'parentToggle': 'StageProfilingEnableToggle',
+            'requiredToggleValue': True,
+            'help': '在每个阶段开始和结束时同步GPU，使异步执行的GPU计算计入发起它的阶段，统计更准确，但处理速度会略有下降。',
+            'exec_function': control_actions.toggle_stage_profiling_sync,
+            'exec_function_args': [],
+        },
+        'TraceRecordingEnableToggle': {
+            'level': 1,
+            'label': '录制帧处理时间线',
+            'default': False,
+            'help': '从视频当前帧开始，录制指定帧数的处理时间线：每个线程上的模型调用、处理阶段、模型锁等待、解码和编码。关闭时保存为Chrome Trace JSON文件，可在 ui.perfetto.dev 或 chrome://tracing 中查看各线程的重叠情况。',
+            'exec_function': control_actions.toggle_trace_recording,
+            'exec_function_args': [],
+        },
+        'TraceFrameCountSlider': {
+            'level': 2,
+            'label': '录制帧数',
+            'min_value': '1',
+            'max_value': '300',
+            'default': '30',
+            'step': 1,
+            'parentToggle': 'TraceRecordingEnableToggle',
+            'requiredToggleValue': True,
+            'help': '录制时间线的帧数。',
+            'exec_function': control_actions.change_trace_frame_count,
+            'exec_function_args': [],
+        },
     },
     'Video Settings': {
         'VideoPlaybackCustomFpsToggle': {
@@ -56,6 +142,51 @@ SETTINGS_LAYOUT_DATA: LayoutDictTypes = {
             'step': 1,
             'help': '设置视频播放时的最大帧率'
         },
+        'PreviewResolutionSelection': {
+            'level': 1,
+            'label': '预览分辨率（高度）',
+            'options': ['Original', '1440', '1080', '720', '540'],
+            'default': 'Original',
+            'help': '播放和拖动预览时先将视频帧缩小到此高度再进行检测和换脸，可大幅提高高分辨率视频的预览速度。录制视频和保存当前帧始终使用原始分辨率。',
+            'exec_function': control_actions.refresh_preview_resolution,
+            'exec_function_args': [],
+        },
+        'VideoDecodeBackendSelection': {
+            'level': 1,
+            'label': '视频解码后端',
+            'options': ['OpenCV', 'PyAV'],
+            'default': 'OpenCV',
+            'help': '选择读取视频帧使用的解码后端。PyAV 会为每个视频建立一次关键帧索引（缓存在缩略图目录中），跳转帧更快更准确，并使用多线程解码。需要安装 av 包，重新加载视频后生效。'
+        },
+        'DecodeLookaheadSlider': {
+            'level': 1,
+            'label': '解码预读帧数',
+            'min_value': '1',
+            'max_value': '64',
+            'default': '8',
+            'step': 1,
+            'help': '播放和录制时在独立线程中提前解码的帧数。数值越大，解码越不容易成为瓶颈，但占用更多内存。'
+        },
+        'ReorderBufferMemorySlider': {
+            'level': 1,
+            'label': '待显示帧内存上限 (MB)',
+            'min_value': '64',
+            'max_value': '16384',
+            'default': '1024',
+            'step': 64,
+            'help': '已处理但尚未显示或写入的帧可占用的最大内存。达到上限时会暂停读取新帧，避免长时间录制时内存无限增长。'
+        },
+        'ProcessedFrameCacheMemorySlider': {
+            'level': 1,
+            'label': '已处理帧缓存 (MB)',
+            'min_value': '0',
+            'max_value': '16384',
+            'default': '1024',
+            'step': 64,
+            'help': '缓存已处理的帧，参数未改变时来回拖动进度条可直接显示，无需重新处理。参数改变后旧的缓存帧不会再被使用。设为0则禁用缓存。',
+            'exec_function': control_actions.change_processed_frame_cache_size,
+            'exec_function_args': [],
+        },
     },
     'Auto Swap': {
         'AutoSwapToggle': {
@@ -500,6 +631,45 @@ SETTINGS_LAYOUT_DATA: LayoutDictTypes = {
             'label': '显示边界框',
             'default': False,
             'help': '为帧中检测到的所有面部绘制边界框'
+        },
+        'FaceTrackingEnableToggle': {
+            'level': 1,
+            'label': '面部跟踪',
+            'default': False,
+            'help': '在视频帧之间跟踪面部：大多数帧只在预测的面部区域内运行关键点检测，并复用面部的识别特征，仅每隔N帧、场景切换或跟踪置信度下降时运行完整的面部检测和识别。可大幅提升镜头稳定的长视频的处理速度。'
+        },
+        'FaceTrackingDetectIntervalSlider': {
+            'level': 2,
+            'label': '完整检测间隔(帧)',
+            'min_value': '1',
+            'max_value': '120',
+            'default': '10',
+            'step': 1,
+            'parentToggle': 'FaceTrackingEnableToggle',
+            'requiredToggleValue': True,
+            'help': '每隔多少帧运行一次完整的面部检测和识别，以发现新出现的面部。'
+        },
+        'FaceTrackingSceneCutSlider': {
+            'level': 2,
+            'label': '场景切换阈值',
+            'min_value': '1',
+            'max_value': '100',
+            'default': '20',
+            'step': 1,
+            'parentToggle': 'FaceTrackingEnableToggle',
+            'requiredToggleValue': True,
+            'help': '相邻帧的平均亮度差超过该值时视为场景切换，并重新运行完整的面部检测。'
+        },
+        'FaceTrackingMinConfidenceSlider': {
+            'level': 2,
+            'label': '最低跟踪置信度',
+            'min_value': '1',
+            'max_value': '100',
+            'default': '50',
+            'step': 1,
+            'parentToggle': 'FaceTrackingEnableToggle',
+            'requiredToggleValue': True,
+            'help': '跟踪的面部关键点偏离预测位置或大小变化过大时，置信度下降；低于该值时重新运行完整的面部检测。'
         }
     },
     'DFM Settings': {
@@ -608,6 +778,12 @@ SETTINGS_LAYOUT_DATA: LayoutDictTypes = {
             'default': 'Opal',
             'help': '选择面部交换过程中用于面部检测和匹配的相似度计算类型。'
         },
+        'OneToOneMatchingToggle': {
+            'level': 1,
+            'label': '一对一匹配',
+            'default': False,
+            'help': '每个目标面部最多匹配一个检测到的面部，每个检测到的面部也最多匹配一个目标面部（按相似度从高到低分配），避免两个面部都被同一个目标面部匹配。'
+        },
     },
     'Embedding Merge Method': {
         'EmbMergeMethodSelection': {
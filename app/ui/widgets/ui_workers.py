@@ -11,6 +11,7 @@ from PySide6 import QtCore as qtc
 from PySide6.QtGui import QPixmap
 
 from app.processors.models_data import detection_model_mapping, landmark_model_mapping
+from app.processors.frame_transfer import get_frame_transfer
 from app.helpers import miscellaneous as misc_helpers
 from app.ui.widgets.actions import common_actions as common_widget_actions
 from app.ui.widgets.actions import filter_actions
@@ -171,11 +172,9 @@ class InputFacesLoaderWorker(qtc.QThread):
             frame = misc_helpers.read_image_file(image_file_path)
             if frame is None:
                 continue
+            frame_transfer = get_frame_transfer(self.main_window.models_processor.device)
             # Frame must be in RGB format
-            frame = frame[..., ::-1]  # Swap the channels from BGR to RGB
-
-            img = torch.from_numpy(frame.astype('uint8')).to(self.main_window.models_processor.device)
-            img = img.permute(2,0,1)
+            img = frame_transfer.upload(frame, swap_channels=True)  # Swap the channels from BGR to RGB
             _, kpss_5, _ = self.main_window.models_processor.run_detect(img, control['DetectorModelSelection'], max_num=1, score=control['DetectorScoreSlider']/100.0, input_size=(512, 512), use_landmark_detection=control['LandmarkDetectToggle'], landmark_detect_mode=control['LandmarkDetectModelSelection'], landmark_score=control["LandmarkDetectScoreSlider"]/100.0, from_points=control["DetectFromPointsToggle"], rotation_angles=[0] if not control["AutoRotationToggle"] else [0, 90, 180, 270])
 
             # If atleast one face is found
@@ -187,9 +186,7 @@ class InputFacesLoaderWorker(qtc.QThread):
                 continue
             if face_kps.any():
                 face_emb, cropped_img = self.main_window.models_processor.run_recognize_direct(img, face_kps, control['SimilarityTypeSelection'], control['RecognitionModelSelection'])
-                cropped_img = cropped_img.cpu().numpy()
-                cropped_img = cropped_img[..., ::-1]  # Swap the channels from RGB to BGR
-                face_img = numpy.ascontiguousarray(cropped_img)
+                face_img = frame_transfer.download(cropped_img.permute(2,0,1), swap_channels=True)  # Swap the channels from RGB to BGR
                 # crop = cv2.resize(face[2].cpu().numpy(), (82, 82))
                 pixmap = common_widget_actions.get_pixmap_from_frame(self.main_window, face_img)
 
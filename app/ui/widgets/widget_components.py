@@ -17,6 +17,7 @@ from app.ui.widgets.actions import card_actions
 from app.ui.widgets.actions import list_view_actions
 from app.ui.widgets.actions import save_load_actions
 import app.helpers.miscellaneous as misc_helpers
+from app.helpers.stage_profiler import profiler, STATS_FIELDS
 
 if TYPE_CHECKING:
     from app.ui.main_ui import MainWindow
@@ -180,7 +181,7 @@ class TargetMediaCardButton(CardButton):
         max_frames_number = 0  # Initialize max_frames_number for either video or image
         
         if self.file_type == 'video':
-            media_capture = cv2.VideoCapture(self.media_path)
+            media_capture = misc_helpers.open_video_capture(self.media_path, backend=main_window.control['VideoDecodeBackendSelection'])
             if not media_capture.isOpened():
                 print(f"Error opening video {self.media_path}")
                 return  # If the video cannot be opened, exit the function
@@ -314,6 +315,10 @@ class TargetMediaCardButton(CardButton):
         self.popMenu = QtWidgets.QMenu(self)
         remove_action = QtGui.QAction('Remove from list', self)
         remove_action.triggered.connect(self.remove_target_media_from_list)
+        if not self.is_webcam:
+            add_to_render_queue_action = QtGui.QAction('Add to Render Queue', self)
+            add_to_render_queue_action.triggered.connect(partial(save_load_actions.add_media_to_render_queue, self.main_window, self.media_path))
+            self.popMenu.addAction(add_to_render_queue_action)
         self.popMenu.addAction(remove_action)
 
     def on_context_menu(self, point):
@@ -822,6 +827,72 @@ class LoadingDialog(QtWidgets.QDialog):
         layout.addWidget(self.label)
         self.setLayout(layout)
 
+class StageProfilerDialog(QtWidgets.QDialog):
+    """Non modal panel showing the rolling stats of the stage profiler, refreshed every second"""
+    def __init__(self, main_window: 'MainWindow'):
+        super().__init__(main_window)
+        self.main_window = main_window
+        self.setWindowTitle("分阶段耗时统计")
+        self.setWindowIcon(QtGui.QIcon(u":/media/media/visomaster_small.png"))
+        self.setModal(False)
+        self.resize(640, 420)
+
+        self.stats_table = QtWidgets.QTableWidget(0, len(STATS_FIELDS), self)
+        self.stats_table.setHorizontalHeaderLabels(['Stage', 'Model', 'Count', 'p50 (ms)', 'p95 (ms)', 'Max (ms)', 'Mean (ms)'])
+        self.stats_table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.stats_table.verticalHeader().setVisible(False)
+        self.stats_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeMode.ResizeToContents)
+
+        reset_button = QtWidgets.QPushButton("Reset", self)
+        reset_button.clicked.connect(self.reset_stats)
+        export_json_button = QtWidgets.QPushButton("Export JSON", self)
+        export_json_button.clicked.connect(partial(self.export_stats, 'json'))
+        export_csv_button = QtWidgets.QPushButton("Export CSV", self)
+        export_csv_button.clicked.connect(partial(self.export_stats, 'csv'))
+
+        buttons_layout = QtWidgets.QHBoxLayout()
+        buttons_layout.addWidget(reset_button)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(export_json_button)
+        buttons_layout.addWidget(export_csv_button)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.stats_table)
+        layout.addLayout(buttons_layout)
+        self.setLayout(layout)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh_stats)
+        self.refresh_timer.start(1000)
+        self.refresh_stats()
+
+    def refresh_stats(self):
+        if not self.isVisible():
+            return
+        stats = profiler.get_stats()
+        self.stats_table.setRowCount(len(stats))
+        for row, row_stats in enumerate(stats):
+            for column, field in enumerate(STATS_FIELDS):
+                value = row_stats[field]
+                item = QtWidgets.QTableWidgetItem(f'{value:.1f}' if isinstance(value, float) else str(value))
+                if column >= 2:
+                    item.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter)
+                self.stats_table.setItem(row, column, item)
+
+    def reset_stats(self):
+        profiler.reset()
+        self.refresh_stats()
+
+    def export_stats(self, file_format: str):
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Stage Timings", f'stage_timings.{file_format}', f"{file_format.upper()} Files (*.{file_format})")
+        if not file_path:
+            return
+        if file_format == 'csv':
+            profiler.export_csv(file_path)
+        else:
+            profiler.export_json(file_path)
+        common_widget_actions.create_and_show_toast_message(self.main_window, 'Stage Timings Exported', f'Saved to {file_path}', style_type='success')
+
 # Custom progress dialog
 class ProgressDialog(QtWidgets.QProgressDialog):
     pass
@@ -0,0 +1,195 @@
+import numpy as np
+import pytest
+import torch
+
+from app.processors.utils import detector_decode, faceutil
+
+INPUT_SIZE = 64
+STRIDES = (8, 16, 32)
+
+def get_reference_anchor_centers(stride, num_anchors):
+    """Anchor centers of one stride, as the detectors computed them before the decoding moved to the device"""
+    size = INPUT_SIZE // stride
+    anchor_centers = np.stack(np.mgrid[:size, :size][::-1], axis=-1).astype(np.float32)
+    anchor_centers = (anchor_centers * stride).reshape((-1, 2))
+    if num_anchors > 1:
+        anchor_centers = np.stack([anchor_centers] * num_anchors, axis=1).reshape((-1, 2))
+    return anchor_centers
+
+def reference_decode_distance(net_outs, score):
+    scores_list, bboxes_list, kpss_list = [], [], []
+    for idx, stride in enumerate(STRIDES):
+        scores = net_outs[idx].reshape(-1)
+        bbox_preds = net_outs[idx + 3] * stride
+        kps_preds = net_outs[idx + 6] * stride
+        anchor_centers = get_reference_anchor_centers(stride, 2)
+        pos_inds = np.where(scores >= score)[0]
+        bboxes = np.stack([anchor_centers[:, 0] - bbox_preds[:, 0], anchor_centers[:, 1] - bbox_preds[:, 1],
+                           anchor_centers[:, 0] + bbox_preds[:, 2], anchor_centers[:, 1] + bbox_preds[:, 3]], axis=-1)
+        kpss = (kps_preds.reshape(-1, 5, 2) + anchor_centers[:, None, :])
+        scores_list.append(scores[pos_inds])
+        bboxes_list.append(bboxes[pos_inds])
+        kpss_list.append(kpss[pos_inds])
+    return np.concatenate(scores_list), np.concatenate(bboxes_list), np.concatenate(kpss_list)
+
+def reference_decode_yunet(net_outs, score):
+    scores_list, bboxes_list, kpss_list = [], [], []
+    for idx, stride in enumerate(STRIDES):
+        scores = (net_outs[idx].reshape(-1, 1) * net_outs[idx + 3].reshape(-1, 1)).reshape(-1)
+        reg_pred = net_outs[idx + 6].reshape(-1, 4)
+        kps_pred = net_outs[idx + 9].reshape(-1, 10)
+        anchor_centers = get_reference_anchor_centers(stride, 1)
+        pos_inds = np.where(scores >= score)[0]
+        bbox_cxy = reg_pred[:, :2] * stride + anchor_centers
+        bbox_wh = np.exp(reg_pred[:, 2:]) * stride
+        bboxes = np.concatenate((bbox_cxy - bbox_wh / 2, bbox_cxy + bbox_wh / 2), axis=-1)
+        kpss = np.concatenate([kps_pred[:, [2 * i, 2 * i + 1]] * stride + anchor_centers for i in range(5)], axis=-1).reshape(-1, 5, 2)
+        scores_list.append(scores[pos_inds])
+        bboxes_list.append(bboxes[pos_inds])
+        kpss_list.append(kpss[pos_inds])
+    return np.concatenate(scores_list), np.concatenate(bboxes_list), np.concatenate(kpss_list)
+
+def reference_nms(dets, thresh):
+    """Greedy NMS of the Nx5 (x1, y1, x2, y2, score) detections, with the areas counting the last row and column of pixels"""
+    x1, y1, x2, y2, scores = dets.T
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        w = np.maximum(0.0, np.minimum(x2[i], x2[order[1:]]) - np.maximum(x1[i], x1[order[1:]]) + 1)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[order[1:]]) - np.maximum(y1[i], y1[order[1:]]) + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[np.where(ovr <= thresh)[0] + 1]
+    return keep
+
+def make_distance_outputs(rng):
+    num_anchors = [(INPUT_SIZE // stride) ** 2 * 2 for stride in STRIDES]
+    return ([rng.random((n, 1), dtype=np.float32) for n in num_anchors] +
+            [rng.random((n, 4), dtype=np.float32) * 4 for n in num_anchors] +
+            [rng.standard_normal((n, 10), dtype=np.float32) for n in num_anchors])
+
+def to_tensors(net_outs):
+    return [torch.from_numpy(net_out) for net_out in net_outs]
+
+def test_anchor_centers():
+    centers, strides = detector_decode.get_anchor_centers(INPUT_SIZE, INPUT_SIZE, STRIDES, 2, 'cpu')
+    assert np.array_equal(centers.numpy(), np.concatenate([get_reference_anchor_centers(stride, 2) for stride in STRIDES]))
+    assert strides.tolist() == [float(stride) for stride in STRIDES for _ in range((INPUT_SIZE // stride) ** 2 * 2)]
+
+def test_decode_distance_outputs():
+    net_outs = make_distance_outputs(np.random.default_rng(0))
+    scores, bboxes, kpss = detector_decode.decode_distance_outputs(to_tensors(net_outs), INPUT_SIZE, INPUT_SIZE, 0.7)
+    reference_scores, reference_bboxes, reference_kpss = reference_decode_distance(net_outs, 0.7)
+    assert len(scores) > 0
+    assert np.allclose(scores.numpy(), reference_scores)
+    assert np.allclose(bboxes.numpy(), reference_bboxes, atol=1e-4)
+    assert np.allclose(kpss.numpy(), reference_kpss, atol=1e-4)
+
+def test_decode_distance_outputs_without_detections():
+    net_outs = make_distance_outputs(np.random.default_rng(1))
+    scores, bboxes, kpss = detector_decode.decode_distance_outputs(to_tensors(net_outs), INPUT_SIZE, INPUT_SIZE, 2.0)
+    assert scores.shape == (0,)
+    assert bboxes.shape == (0, 4)
+    assert kpss.shape == (0, 5, 2)
+
+def test_decode_yolo_outputs():
+    rng = np.random.default_rng(2)
+    output = rng.random((1, 20, 50), dtype=np.float32) * 10
+    output[0, 4] = rng.random(50, dtype=np.float32)
+    scores, bboxes, kpss = detector_decode.decode_yolo_outputs(torch.from_numpy(output), 0.5)
+    outputs = output[0].T
+    keep = np.where(outputs[:, 4] > 0.5)[0]
+    assert np.allclose(scores.numpy(), outputs[keep, 4])
+    cx, cy, w, h = outputs[keep, :4].T
+    assert np.allclose(bboxes.numpy(), np.stack((cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2), axis=-1))
+    # The visibility of each keypoint is dropped
+    assert np.allclose(kpss.numpy(), np.stack([outputs[keep, 5 + 3 * i:7 + 3 * i] for i in range(5)], axis=1))
+
+def test_decode_yunet_outputs():
+    rng = np.random.default_rng(3)
+    num_anchors = [(INPUT_SIZE // stride) ** 2 for stride in STRIDES]
+    net_outs = ([rng.random((1, n, 1), dtype=np.float32) for n in num_anchors] +
+                [rng.random((1, n, 1), dtype=np.float32) for n in num_anchors] +
+                [rng.standard_normal((1, n, 4), dtype=np.float32) for n in num_anchors] +
+                [rng.standard_normal((1, n, 10), dtype=np.float32) for n in num_anchors])
+    scores, bboxes, kpss = detector_decode.decode_yunet_outputs(to_tensors(net_outs), INPUT_SIZE, INPUT_SIZE, 0.4)
+    reference_scores, reference_bboxes, reference_kpss = reference_decode_yunet(net_outs, 0.4)
+    assert len(scores) > 0
+    assert np.allclose(scores.numpy(), reference_scores)
+    assert np.allclose(bboxes.numpy(), reference_bboxes, atol=1e-4)
+    assert np.allclose(kpss.numpy(), reference_kpss, atol=1e-4)
+
+def rotate_points(points, angle, center=(32.0, 32.0)):
+    rad = np.deg2rad(angle)
+    rotation = np.array([[np.cos(rad), -np.sin(rad)], [np.sin(rad), np.cos(rad)]], dtype=np.float32)
+    return (points - center) @ rotation.T + center
+
+def test_face_orientations():
+    rng = np.random.default_rng(4)
+    kpss = (faceutil.arcface_src[0][None] * 0.5 + rng.standard_normal((8, 5, 2)) * 2).astype(np.float32)
+    kpss = np.stack([rotate_points(kps, angle) for kps, angle in zip(kpss, range(-150, 170, 40))])
+    orientations = detector_decode.get_face_orientations(torch.from_numpy(kpss)).numpy()
+    assert np.allclose(orientations, [faceutil.get_face_orientation(112, kps) for kps in kpss], atol=1e-3)
+
+def test_to_frame_detections_drops_the_faces_that_are_not_upright():
+    upright_kps = (faceutil.arcface_src[0] * 0.3).astype(np.float32)
+    kpss = np.stack([upright_kps, rotate_points(upright_kps, 90), rotate_points(upright_kps, 30)])
+    scores = torch.tensor([0.9, 0.8, 0.7])
+    bboxes = torch.tensor([[0.0, 0.0, 10.0, 10.0], [1.0, 1.0, 11.0, 11.0], [2.0, 2.0, 12.0, 12.0]])
+    kept_scores, kept_bboxes, kept_kpss = detector_decode.to_frame_detections(scores, bboxes, torch.from_numpy(kpss), None, 0, 0.5, True)
+    assert np.allclose(kept_scores.numpy(), [0.9, 0.7])
+    assert np.allclose(kept_bboxes.numpy(), bboxes.numpy()[[0, 2]])
+    assert np.allclose(kept_kpss.numpy(), kpss[[0, 2]])
+    # Without AutoRotation every face is kept
+    assert len(detector_decode.to_frame_detections(scores, bboxes, torch.from_numpy(kpss), None, 0, 0.5, False)[0]) == 3
+
+@pytest.mark.parametrize('angle', [90, 180, 270, -90, -180, -270])
+def test_to_frame_detections_of_rotated_inputs(angle):
+    rng = np.random.default_rng(5)
+    xy1 = rng.random((6, 2), dtype=np.float32) * 30
+    bboxes = np.concatenate((xy1, xy1 + 5 + rng.random((6, 2), dtype=np.float32) * 20), axis=1)
+    kpss = rng.random((6, 5, 2), dtype=np.float32) * 60
+    scores = rng.random(6, dtype=np.float32)
+    # Inverse of the rotation of the input by angle around its center
+    IM = np.concatenate((np.eye(2), np.zeros((2, 1))), axis=1).astype(np.float32)
+    rad = np.deg2rad(-angle)
+    IM[:, :2] = [[np.cos(rad), -np.sin(rad)], [np.sin(rad), np.cos(rad)]]
+    IM[:, 2] = np.array([32.0, 32.0]) - IM[:, :2] @ np.array([32.0, 32.0])
+
+    _, frame_bboxes, frame_kpss = detector_decode.to_frame_detections(torch.from_numpy(scores), torch.from_numpy(bboxes), torch.from_numpy(kpss), IM, angle, 0.0, False)
+    points1 = faceutil.trans_points2d(bboxes[:, :2], IM)
+    points2 = faceutil.trans_points2d(bboxes[:, 2:], IM)
+    # Every box is still given by its top left and bottom right corners in the frame
+    assert np.allclose(frame_bboxes.numpy()[:, :2], np.minimum(points1, points2), atol=1e-4)
+    assert np.allclose(frame_bboxes.numpy()[:, 2:], np.maximum(points1, points2), atol=1e-4)
+    # The keypoints are only mapped back with AutoRotation
+    assert np.allclose(frame_kpss.numpy(), kpss)
+
+def test_nms_detections():
+    rng = np.random.default_rng(6)
+    xy1 = rng.random((40, 2), dtype=np.float32) * 100
+    bboxes = np.concatenate((xy1, xy1 + 10 + rng.random((40, 2), dtype=np.float32) * 40), axis=1)
+    scores = rng.random(40, dtype=np.float32)
+    kpss = rng.random((40, 5, 2), dtype=np.float32) * 100
+    det_scale = 0.5
+    # The detections of two inputs (two rotation angles)
+    det, det_kpss = detector_decode.nms_detections([torch.from_numpy(scores[:25]), torch.from_numpy(scores[25:])],
+                                                   [torch.from_numpy(bboxes[:25]), torch.from_numpy(bboxes[25:])],
+                                                   [torch.from_numpy(kpss[:25]), torch.from_numpy(kpss[25:])], det_scale)
+    keep = reference_nms(np.concatenate((bboxes / det_scale, scores[:, None]), axis=1), 0.4)
+    assert 0 < len(keep) < 40
+    assert det.shape == (len(keep), 5)
+    assert np.allclose(det[:, :4], bboxes[keep] / det_scale)
+    assert np.allclose(det[:, 4], scores[keep])
+    assert np.allclose(det_kpss, kpss[keep] / det_scale)
+
+def test_nms_detections_without_detections():
+    det, kpss = detector_decode.nms_detections([], [], [], 1.0)
+    assert det.shape == (0, 5)
+    assert kpss.shape == (0, 5, 2)
+    det, kpss = detector_decode.nms_detections([torch.zeros(0)], [torch.zeros((0, 4))], [torch.zeros((0, 5, 2))], 1.0)
+    assert det.shape == (0, 5)
+    assert kpss.shape == (0, 5, 2)
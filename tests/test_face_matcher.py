@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from app.processors.face_matcher import FaceMatcher, normalize_embeddings
+
+class TargetFace:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def get_embedding(self, recognition_model):
+        return self.embeddings.get(recognition_model, np.array([]))
+
+def make_target_faces(*embeddings):
+    return {str(i): TargetFace({'ArcFace': np.asarray(embedding, dtype=np.float32)}) for i, embedding in enumerate(embeddings)}
+
+def test_normalize_embeddings():
+    embeddings = np.array([[3.0, 4.0], [0.0, 0.0], [np.nan, 1.0], [0.0, -2.0]], dtype=np.float32)
+    normalized, valid = normalize_embeddings(embeddings)
+    assert valid.tolist() == [True, False, False, True]
+    assert np.allclose(normalized, [[0.6, 0.8], [0.0, 0.0], [0.0, 0.0], [0.0, -1.0]])
+
+def test_similarities_are_on_the_cosine_distance_scale():
+    matcher = FaceMatcher()
+    target_faces = make_target_faces([1.0, 0.0], [0.0, 2.0])
+    face_ids, similarities = matcher.get_similarities([np.array([3.0, 0.0]), np.array([-1.0, 0.0]), np.array([1.0, 1.0])], target_faces, 'ArcFace')
+    assert face_ids == ['0', '1']
+    cos_45 = np.cos(np.pi / 4)
+    assert np.allclose(similarities, [[100.0, 50.0], [0.0, 50.0], [100 - (1 - cos_45) * 50, 100 - (1 - cos_45) * 50]])
+
+def test_faces_that_can_not_be_compared_never_match():
+    matcher = FaceMatcher()
+    target_faces = make_target_faces([1.0, 0.0], [0.0, 0.0])
+    target_faces['2'] = TargetFace({})
+    _, similarities = matcher.get_similarities([np.array([1.0, 0.0]), np.array([0.0, 0.0])], target_faces, 'ArcFace')
+    assert similarities[0, 0] == pytest.approx(100.0)
+    assert np.isneginf(similarities[0, 1:]).all()
+    assert np.isneginf(similarities[1]).all()
+    # Embeddings of another size than the ones of the target faces
+    _, similarities = matcher.get_similarities([np.array([1.0, 0.0, 0.0])], target_faces, 'ArcFace')
+    assert np.isneginf(similarities).all()
+    _, similarities = matcher.get_similarities([], target_faces, 'ArcFace')
+    assert similarities.shape == (0, 3)
+
+def test_target_matrix_is_built_again_when_the_embeddings_change():
+    matcher = FaceMatcher()
+    target_faces = make_target_faces([1.0, 0.0], [0.0, 1.0])
+    _, matrix, _ = matcher.get_target_matrix(target_faces, 'ArcFace')
+    assert matcher.get_target_matrix(target_faces, 'ArcFace')[1] is matrix
+    target_faces['1'].embeddings['ArcFace'] = np.array([1.0, 1.0], dtype=np.float32)
+    _, new_matrix, _ = matcher.get_target_matrix(target_faces, 'ArcFace')
+    assert new_matrix is not matrix
+    assert np.allclose(new_matrix[1], [np.cos(np.pi / 4), np.sin(np.pi / 4)])
+    del target_faces['0']
+    face_ids, matrix, _ = matcher.get_target_matrix(target_faces, 'ArcFace')
+    assert face_ids == ['1']
+    assert matrix.shape == (1, 2)
+
+def test_match_faces_thresholds():
+    similarities = np.array([[90.0, 40.0], [70.0, -np.inf]])
+    matches = FaceMatcher.match_faces(similarities, np.array([80.0, 40.0]))
+    assert matches.tolist() == [[True, True], [False, False]]
+
+def test_match_faces_one_to_one():
+    similarities = np.array([[90.0, 80.0], [85.0, 70.0], [95.0, 60.0]])
+    thresholds = np.array([50.0, 50.0])
+    assert FaceMatcher.match_faces(similarities, thresholds).all()
+    # Pairs are assigned by decreasing similarity: face 2 takes target 0, face 0 takes target 1, face 1 is left
+    matches = FaceMatcher.match_faces(similarities, thresholds, one_to_one=True)
+    assert matches.tolist() == [[False, True], [False, False], [True, False]]
+
+def test_match_faces_one_to_one_respects_the_thresholds():
+    similarities = np.array([[90.0, 45.0], [85.0, 55.0]])
+    matches = FaceMatcher.match_faces(similarities, np.array([80.0, 60.0]), one_to_one=True)
+    # Face 1 is free once target 0 is taken, but is below the threshold of target 1
+    assert matches.tolist() == [[True, False], [False, False]]
+    assert not FaceMatcher.match_faces(np.full((2, 2), -np.inf), np.array([50.0, 50.0]), one_to_one=True).any()
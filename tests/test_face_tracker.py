@@ -0,0 +1,165 @@
+import numpy as np
+import torch
+
+from app.processors.face_tracker import TRACKING_CONTROLS, FaceTracker, get_face_size
+
+KPS_5 = np.array([[40.0, 50.0], [70.0, 50.0], [55.0, 65.0], [45.0, 80.0], [65.0, 80.0]], dtype=np.float32)
+BBOX = np.array([30.0, 35.0, 80.0, 95.0], dtype=np.float32)
+
+class StubModelsProcessor:
+    """run_detect_landmark() returning the keypoints set by the test (kps_5, empty when the face is lost)"""
+    def __init__(self):
+        self.kps_5 = KPS_5.copy()
+        self.calls = []
+
+    def run_detect_landmark(self, img, bbox, kps_5, landmark_detect_mode, landmark_score, from_points=False):
+        self.calls.append({'bbox': bbox.copy(), 'kps_5': kps_5.copy(), 'from_points': from_points})
+        if self.kps_5 is None:
+            return [], [], []
+        return self.kps_5.copy(), self.kps_5.copy(), [1.0]
+
+def make_control(**values):
+    control = {name: 0 for name in TRACKING_CONTROLS}
+    control.update(FaceTrackingDetectIntervalSlider=10, FaceTrackingSceneCutSlider=20, FaceTrackingMinConfidenceSlider=50)
+    control.update(values)
+    return control
+
+def make_img(value=100):
+    return torch.full((3, 72, 128), value, dtype=torch.uint8)
+
+def make_faces():
+    return [{'bbox': BBOX.copy(), 'kps_5': KPS_5.copy(), 'kps_all': KPS_5.copy(), 'embedding': np.ones(4, dtype=np.float32)}]
+
+def make_tracker(frame_number=10, control=None, media_path='video.mp4'):
+    tracker = FaceTracker(StubModelsProcessor())
+    control = control or make_control()
+    tracking_key = FaceTracker.get_tracking_key(make_img(), control, False, media_path)
+    tracker.start_tracks(make_img(), frame_number, make_faces(), tracking_key)
+    return tracker, control, tracking_key
+
+def track(tracker, frame_number, control, tracking_key, img=None):
+    return tracker.track_faces(make_img() if img is None else img, frame_number, control, tracking_key, '203', 0.5, False)
+
+def test_frames_without_tracks_are_detected():
+    tracker = FaceTracker(StubModelsProcessor())
+    control = make_control()
+    assert track(tracker, 0, control, FaceTracker.get_tracking_key(make_img(), control, False, 'video.mp4')) is None
+
+def test_next_frames_are_tracked():
+    tracker, control, tracking_key = make_tracker()
+    faces = track(tracker, 11, control, tracking_key)
+    assert len(faces) == 1
+    assert np.allclose(faces[0]['kps_5'], KPS_5)
+    # The embedding of the detected frame is kept
+    assert np.array_equal(faces[0]['embedding'], np.ones(4))
+    assert tracker.models_processor.calls[0]['from_points']
+    assert tracker.frame_number == 11
+    assert tracker.detect_frame_number == 10
+
+def test_face_data_are_copies():
+    tracker, control, tracking_key = make_tracker()
+    faces = track(tracker, 11, control, tracking_key)
+    faces[0]['kps_5'] += 100
+    assert np.allclose(tracker.tracks[0].kps_5, KPS_5)
+
+def test_frames_that_are_not_close_after_the_tracks_are_detected():
+    tracker, control, tracking_key = make_tracker()
+    assert track(tracker, 10, control, tracking_key) is None
+    assert track(tracker, 9, control, tracking_key) is None
+    assert track(tracker, 10 + FaceTracker.max_frame_gap + 1, control, tracking_key) is None
+    assert track(tracker, 10 + FaceTracker.max_frame_gap, control, tracking_key) is not None
+
+def test_detect_interval():
+    tracker, control, tracking_key = make_tracker(control=make_control(FaceTrackingDetectIntervalSlider=3))
+    assert track(tracker, 11, control, tracking_key) is not None
+    assert track(tracker, 12, control, tracking_key) is not None
+    assert track(tracker, 13, control, tracking_key) is None
+
+def test_tracks_are_dropped_when_the_tracking_key_changes():
+    tracker, control, tracking_key = make_tracker()
+    other_control = make_control(DetectorScoreSlider=60)
+    assert track(tracker, 11, other_control, FaceTracker.get_tracking_key(make_img(), other_control, False, 'video.mp4')) is None
+    assert track(tracker, 11, control, FaceTracker.get_tracking_key(make_img(), control, True, 'video.mp4')) is None
+    # The tracks of a video are never used for another one
+    assert track(tracker, 11, control, FaceTracker.get_tracking_key(make_img(), control, False, 'other.mp4')) is None
+    assert track(tracker, 11, control, tracking_key) is not None
+
+def test_scene_cuts_are_detected():
+    tracker, control, tracking_key = make_tracker()
+    assert track(tracker, 11, control, tracking_key, img=make_img(200)) is None
+    assert track(tracker, 11, control, tracking_key, img=make_img(110)) is not None
+
+def test_late_frames_do_not_replace_the_tracks():
+    tracker, control, tracking_key = make_tracker(frame_number=10)
+    track(tracker, 11, control, tracking_key)
+    track(tracker, 12, control, tracking_key)
+    # Frame 11 detected by another worker after frame 12 was tracked
+    late_faces = make_faces()
+    late_faces[0]['kps_5'] += 5
+    tracker.start_tracks(make_img(), 11, late_faces, tracking_key)
+    assert tracker.frame_number == 12
+    assert np.allclose(tracker.tracks[0].kps_5, KPS_5)
+    # A frame tracked late doesn't either
+    track(tracker, 11, control, tracking_key)
+    assert tracker.frame_number == 12
+
+def test_detected_frames_replace_the_tracks():
+    tracker, control, tracking_key = make_tracker(frame_number=10)
+    new_faces = make_faces()
+    new_faces[0]['kps_5'] += 5
+    tracker.start_tracks(make_img(), 11, new_faces, tracking_key)
+    assert tracker.frame_number == 11
+    assert np.allclose(tracker.tracks[0].kps_5, KPS_5 + 5)
+    # After a seek backwards, or with another key
+    tracker.start_tracks(make_img(), 2, make_faces(), tracking_key)
+    assert tracker.frame_number == 2
+    other_key = FaceTracker.get_tracking_key(make_img(), control, False, 'other.mp4')
+    tracker.start_tracks(make_img(), 1, make_faces(), other_key)
+    assert tracker.frame_number == 1
+    assert tracker.tracking_key == other_key
+
+def test_reset():
+    tracker, control, tracking_key = make_tracker()
+    tracker.reset()
+    assert not tracker.tracks
+    assert track(tracker, 11, control, tracking_key) is None
+
+def test_moving_faces_are_predicted():
+    tracker, control, tracking_key = make_tracker()
+    tracker.models_processor.kps_5 = KPS_5 + [2.0, 1.0]
+    faces = track(tracker, 11, control, tracking_key)
+    assert np.allclose(faces[0]['bbox'], BBOX + [2.0, 1.0, 2.0, 1.0])
+    assert np.allclose(tracker.tracks[0].velocity, [2.0, 1.0])
+    # The landmarks of the next frames are searched where the face is predicted to be
+    tracker.models_processor.kps_5 = KPS_5 + [8.0, 4.0]
+    track(tracker, 14, control, tracking_key)
+    assert np.allclose(tracker.models_processor.calls[-1]['kps_5'], KPS_5 + [8.0, 4.0])
+    assert np.allclose(tracker.models_processor.calls[-1]['bbox'], BBOX + [8.0, 4.0, 8.0, 4.0])
+
+def test_lost_faces_are_detected():
+    tracker, control, tracking_key = make_tracker()
+    tracker.models_processor.kps_5 = None
+    assert track(tracker, 11, control, tracking_key) is None
+    # The tracks are kept for the full detection of the frame
+    assert tracker.frame_number == 10
+
+def test_confidence_cut_off():
+    face_size = get_face_size(KPS_5)
+    tracker, control, tracking_key = make_tracker(control=make_control(FaceTrackingMinConfidenceSlider=50))
+    # The landmarks drifted away from the prediction by 60% of the face size
+    tracker.models_processor.kps_5 = KPS_5 + [face_size * 0.6, 0.0]
+    assert track(tracker, 11, control, tracking_key) is None
+    # Or collapsed to less than half the size of the face
+    tracker.models_processor.kps_5 = (KPS_5 - KPS_5.mean(axis=0)) * 0.4 + KPS_5.mean(axis=0)
+    assert track(tracker, 11, control, tracking_key) is None
+    # A shift of 40% of the face size keeps a confidence of 60%
+    tracker.models_processor.kps_5 = KPS_5 + [face_size * 0.4, 0.0]
+    assert track(tracker, 11, control, tracking_key) is not None
+
+def test_resized_faces_resize_the_box():
+    tracker, control, tracking_key = make_tracker()
+    center = KPS_5.mean(axis=0)
+    tracker.models_processor.kps_5 = (KPS_5 - center) * 1.25 + center
+    faces = track(tracker, 11, control, tracking_key)
+    bbox_center = (BBOX[:2] + BBOX[2:]) / 2
+    assert np.allclose(faces[0]['bbox'], np.concatenate((bbox_center - (BBOX[2:] - BBOX[:2]) / 2 * 1.25, bbox_center + (BBOX[2:] - BBOX[:2]) / 2 * 1.25)))
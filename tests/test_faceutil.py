@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import torch
+from skimage import transform as trans
+
+from app.processors.utils import faceutil
+
+# ModelsProcessor.arcface_dst
+ARCFACE_DST = np.array([[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]], dtype=np.float32)
+
+def make_keypoints(num_faces, seed=0):
+    """Keypoints of faces at random positions, sizes and rotations in a frame"""
+    rng = np.random.default_rng(seed)
+    kpss = []
+    for _ in range(num_faces):
+        rad = rng.uniform(-np.pi, np.pi)
+        rotation = np.array([[np.cos(rad), -np.sin(rad)], [np.sin(rad), np.cos(rad)]])
+        kps = (ARCFACE_DST - 56.0) @ rotation.T * rng.uniform(0.5, 4.0) + rng.uniform(100, 1000, size=2)
+        kpss.append(kps + rng.standard_normal((5, 2)) * 2)
+    return np.array(kpss, dtype=np.float32)
+
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_similarity_transforms_match_estimate_norm():
+    kpss = make_keypoints(6)
+    Ms = faceutil.estimate_similarity_transforms(kpss, ARCFACE_DST)
+    assert Ms.shape == (6, 2, 3)
+    for kps, M in zip(kpss, Ms):
+        assert np.allclose(M, faceutil.estimate_norm(kps, 112, mode='arcface112')[0], atol=1e-4)
+
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_similarity_transforms_match_similarity_transform():
+    # The dst points of the 'Pearl' similarity type, estimated with SimilarityTransform by FaceSwappers.recognize()
+    dst = ARCFACE_DST.copy()
+    dst[:, 0] += 8.0
+    kpss = make_keypoints(4, seed=1)
+    Ms = faceutil.estimate_similarity_transforms(kpss, dst)
+    for kps, M in zip(kpss, Ms):
+        tform = trans.SimilarityTransform()
+        tform.estimate(kps, dst)
+        assert np.allclose(M, tform.params[0:2], atol=1e-4)
+
+def test_similarity_transforms_map_the_keypoints():
+    kpss = make_keypoints(3, seed=2)
+    kpss[0] = ARCFACE_DST * 2.0 + 10.0
+    Ms = faceutil.estimate_similarity_transforms(kpss, ARCFACE_DST)
+    assert np.allclose(Ms[0], [[0.5, 0.0, -5.0], [0.0, 0.5, -5.0]], atol=1e-5)
+    for kps, M in zip(kpss, Ms):
+        mapped = kps @ M[:, :2].T + M[:, 2]
+        assert np.abs(mapped - ARCFACE_DST).max() < 10.0
+
+def test_warp_faces_by_transforms():
+    img = torch.arange(3 * 20 * 30, dtype=torch.float32).reshape(3, 20, 30)
+    Ms = np.array([[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], [[1.0, 0.0, -5.0], [0.0, 1.0, -2.0]]])
+    crops = faceutil.warp_faces_by_transforms(img, Ms, 8)
+    assert crops.shape == (2, 3, 8, 8)
+    assert torch.equal(crops[0], img[:, :8, :8])
+    assert torch.equal(crops[1], img[:, 2:10, 5:13])
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.processors import frame_pacer
+from app.processors.frame_pacer import FramePacer
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        return self.now
+
+@pytest.fixture(name='clock')
+def fixture_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(frame_pacer, 'time', SimpleNamespace(perf_counter=clock.perf_counter))
+    return clock
+
+def make_pacer(target_fps=25.0, max_in_flight=4):
+    pacer = FramePacer()
+    pacer.reset(target_fps, max_in_flight)
+    return pacer
+
+def complete_frame(pacer, clock, frame_number, latency):
+    pacer.on_submitted(frame_number)
+    clock.now += latency
+    pacer.on_completed(frame_number)
+
+def test_frame_interval():
+    assert FramePacer(target_fps=25.0).frame_interval == pytest.approx(0.04)
+    assert FramePacer(target_fps=0).frame_interval == pytest.approx(1 / 30)
+
+def test_frames_in_flight_follow_the_worker_latency(clock):
+    pacer = make_pacer()
+    # Before any measurement, as many frames as allowed are read
+    assert pacer.can_submit(3)
+    assert not pacer.can_submit(4)
+    complete_frame(pacer, clock, 0, 0.06)
+    assert pacer.worker_latency == pytest.approx(0.06)
+    # 0.06 s at 25 FPS is 1.5 frames, plus the frame being displayed
+    assert pacer.frames_in_flight == 3
+    assert pacer.can_submit(2)
+    assert not pacer.can_submit(3)
+
+def test_frames_in_flight_are_bounded(clock):
+    pacer = make_pacer(max_in_flight=4)
+    complete_frame(pacer, clock, 0, 1.0)
+    assert pacer.frames_in_flight == 4
+    pacer = make_pacer(max_in_flight=4)
+    complete_frame(pacer, clock, 0, 0.0)
+    assert pacer.frames_in_flight == 1
+    assert make_pacer(max_in_flight=0).max_in_flight == 1
+
+def test_worker_latency_is_smoothed(clock):
+    pacer = make_pacer()
+    complete_frame(pacer, clock, 0, 0.05)
+    complete_frame(pacer, clock, 1, 0.15)
+    assert pacer.worker_latency == pytest.approx(0.05 + FramePacer.smoothing * 0.1)
+    # Frames that weren't submitted are not measured
+    pacer.on_completed(5)
+    assert pacer.worker_latency == pytest.approx(0.05 + FramePacer.smoothing * 0.1)
+
+def test_display_schedule(clock):
+    pacer = make_pacer(target_fps=25.0)
+    clock.now = 1.0
+    assert pacer.is_display_due()
+    pacer.on_submitted(0)
+    clock.now = 1.1
+    pacer.on_displayed(0)
+    assert pacer.pipeline_latency == pytest.approx(0.1)
+    assert 0 not in pacer.submit_times
+    # The first frame was late, the schedule restarts from its display time
+    assert pacer.next_display_time == pytest.approx(1.14)
+    clock.now = 1.13
+    assert not pacer.is_display_due()
+    clock.now = 1.145
+    assert pacer.is_display_due()
+    pacer.on_displayed(1)
+    # On time frames keep the schedule
+    assert pacer.next_display_time == pytest.approx(1.18)
+    assert pacer.display_interval == pytest.approx(0.045)
+    assert pacer.display_fps == pytest.approx(1 / 0.045)
+
+def test_reset(clock):
+    pacer = make_pacer()
+    complete_frame(pacer, clock, 0, 0.06)
+    pacer.on_submitted(1)
+    pacer.on_displayed(1)
+    pacer.reset(30.0, 2)
+    assert pacer.target_fps == 30.0
+    assert pacer.frames_in_flight == 2
+    assert not pacer.submit_times
+    assert pacer.worker_latency == 0.0
+    assert pacer.display_fps == 0.0
+    assert pacer.is_display_due()
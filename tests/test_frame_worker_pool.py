@@ -0,0 +1,114 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.processors.reorder_buffer import ReorderBuffer
+
+# FrameWorkerPool imports FrameWorker, which needs the full application environment
+frame_worker_pool = pytest.importorskip('app.processors.workers.frame_worker_pool')
+
+class FakeWorker(threading.Thread):
+    """Worker with the job loop of FrameWorker, where processing a frame is sleeping for frame[0] milliseconds"""
+    def __init__(self, main_window, work_queue, completion_queue, on_job_done):
+        super().__init__(daemon=True)
+        self.main_window = main_window
+        self.work_queue = work_queue
+        self.completion_queue = completion_queue
+        self.on_job_done = on_job_done
+
+    def run(self):
+        while True:
+            job = self.work_queue.get()
+            try:
+                if job is None:
+                    break
+                frame_number, frame, on_done = job
+                try:
+                    result = self.process_job(frame_number, frame)
+                finally:
+                    if on_done:
+                        on_done()
+                self.completion_queue.put((frame_number, result))
+            finally:
+                if job is not None and self.on_job_done:
+                    self.on_job_done()
+                self.work_queue.task_done()
+
+    def process_job(self, frame_number, frame):
+        if frame[0] < 0:
+            return None
+        time.sleep(frame[0] / 1000)
+        return frame
+
+def make_pool(num_workers=3):
+    return frame_worker_pool.FrameWorkerPool(None, num_workers=num_workers, worker_class=FakeWorker)
+
+def test_every_frame_completes_once():
+    pool = make_pool()
+    try:
+        delays = [30, 5, 20, 0, 10, 25, 0, 15]
+        on_done_calls = []
+        for frame_number, delay in enumerate(delays):
+            pool.submit(frame_number, np.array([delay]), on_done=lambda frame_number=frame_number: on_done_calls.append(frame_number))
+        completed = [pool.get_completed(block=True, timeout=5) for _ in delays]
+        assert sorted(frame_number for frame_number, _ in completed) == list(range(len(delays)))
+        assert sorted(on_done_calls) == list(range(len(delays)))
+        assert pool.get_completed() is None
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+def test_out_of_order_results_are_displayed_in_order():
+    pool = make_pool()
+    try:
+        # The first frames are the slowest, so they finish last
+        delays = [40, 30, 20, 10, 0, 0]
+        frames_to_display = ReorderBuffer(max_bytes=1 << 20)
+        displayed = []
+        next_frame_number = 0
+        for frame_number, delay in enumerate(delays):
+            pool.submit(frame_number, np.array([delay]))
+        while len(displayed) < len(delays):
+            frame_number, result = pool.get_completed(block=True, timeout=5)
+            frames_to_display.put(frame_number, result)
+            while next_frame_number in frames_to_display:
+                displayed.append((next_frame_number, frames_to_display.pop(next_frame_number)))
+                next_frame_number += 1
+        assert [frame_number for frame_number, _ in displayed] == list(range(len(delays)))
+        assert [int(frame[0]) for _, frame in displayed] == delays
+    finally:
+        pool.shutdown()
+
+def test_failed_frames_complete_with_none():
+    pool = make_pool()
+    try:
+        pool.submit(0, np.array([-1]))
+        assert pool.get_completed(block=True, timeout=5) == (0, None)
+    finally:
+        pool.shutdown()
+
+def test_wait_for_free_worker():
+    pool = make_pool(num_workers=2)
+    try:
+        assert pool.wait_for_free_worker(timeout=0)
+        pool.submit(0, np.array([100]))
+        pool.submit(1, np.array([100]))
+        assert pool.is_busy()
+        assert not pool.wait_for_free_worker(timeout=0.01)
+        assert pool.wait_for_free_worker(timeout=5)
+        assert not pool.is_busy()
+    finally:
+        pool.shutdown()
+
+def test_clear_discards_the_results():
+    pool = make_pool(num_workers=1)
+    try:
+        for frame_number in range(3):
+            pool.submit(frame_number, np.array([10]))
+        pool.clear()
+        assert pool.pending == 0
+        assert pool.get_completed() is None
+    finally:
+        pool.shutdown()
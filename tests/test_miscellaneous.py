@@ -0,0 +1,36 @@
+import numpy as np
+
+from app.helpers.miscellaneous import get_preview_resolution, read_frame
+
+class FakeCapture:
+    def __init__(self, frame):
+        self.frame = frame
+
+    def read(self):
+        return True, self.frame.copy()
+
+def test_preview_resolution_keeps_the_aspect_ratio():
+    assert get_preview_resolution(3840, 2160, 720) == (1280, 720)
+    assert get_preview_resolution(1920, 1080, 540) == (960, 540)
+    # Portrait videos are scaled by their height too
+    assert get_preview_resolution(1080, 1920, 720) == (404, 720)
+
+def test_preview_resolution_is_even():
+    width, height = get_preview_resolution(1001, 1000, 480)
+    assert (width, height) == (480, 480)
+    width, _ = get_preview_resolution(1000, 999, 480)
+    assert width % 2 == 0
+    assert get_preview_resolution(1, 1000, 100) == (2, 100)
+
+def test_no_preview_resolution_for_small_media():
+    assert get_preview_resolution(1280, 720, 720) is None
+    assert get_preview_resolution(640, 360, 720) is None
+    assert get_preview_resolution(3840, 2160, 0) is None
+
+def test_read_frame_downscales_in_preview_mode():
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    ret, preview_frame = read_frame(FakeCapture(frame), preview_mode=True, preview_height=540)
+    assert ret
+    assert preview_frame.shape == (540, 960, 3)
+    _, full_frame = read_frame(FakeCapture(frame), preview_mode=False, preview_height=540)
+    assert full_frame.shape == frame.shape
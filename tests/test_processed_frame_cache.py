@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.processors.processed_frame_cache import ProcessedFrameCache, get_frame_state_hash
+
+def make_key(frame_number, state_hash='state'):
+    return ('video.mp4', frame_number, (4, 4, 3), state_hash)
+
+def make_frame(value=0):
+    # 48 bytes
+    return np.full((4, 4, 3), value, dtype=np.uint8)
+
+def test_get_returns_a_copy():
+    cache = ProcessedFrameCache(max_bytes=1000)
+    frame = make_frame(1)
+    cache.put(make_key(0), frame)
+    cached_frame = cache.get(make_key(0))
+    assert np.array_equal(cached_frame, frame)
+    cached_frame[:] = 2
+    assert np.array_equal(cache.get(make_key(0)), frame)
+
+def test_hits_and_misses():
+    cache = ProcessedFrameCache(max_bytes=1000)
+    assert cache.get(make_key(0)) is None
+    cache.put(make_key(0), make_frame())
+    assert cache.get(make_key(0)) is not None
+    # A frame processed with other parameters is a different entry
+    assert cache.get(make_key(0, 'other state')) is None
+    assert cache.get_stats() == {'frames': 1, 'bytes': 48, 'hits': 1, 'misses': 2}
+
+def test_least_recently_used_frames_are_evicted():
+    cache = ProcessedFrameCache(max_bytes=48 * 3)
+    for frame_number in range(3):
+        cache.put(make_key(frame_number), make_frame(frame_number))
+    # Frame 0 becomes the most recently used one
+    assert cache.get(make_key(0)) is not None
+    cache.put(make_key(3), make_frame(3))
+    assert cache.get(make_key(1)) is None
+    for frame_number in (0, 2, 3):
+        assert cache.get(make_key(frame_number))[0, 0, 0] == frame_number
+    assert cache.nbytes == 48 * 3
+
+def test_byte_accounting():
+    cache = ProcessedFrameCache(max_bytes=1000)
+    cache.put(make_key(0), make_frame())
+    cache.put(make_key(1), np.zeros(100, dtype=np.uint8))
+    assert cache.nbytes == 148
+    # Replacing a frame only counts the new one
+    cache.put(make_key(1), np.zeros(10, dtype=np.uint8))
+    assert cache.nbytes == 58
+    cache.set_max_bytes(48)
+    assert cache.nbytes == 10
+    assert cache.get(make_key(0)) is None
+    cache.clear()
+    assert cache.nbytes == 0
+    assert cache.get_stats()['frames'] == 0
+
+def test_frames_larger_than_the_cache_are_not_stored():
+    cache = ProcessedFrameCache(max_bytes=47)
+    cache.put(make_key(0), make_frame())
+    assert cache.nbytes == 0
+    assert cache.get(make_key(0)) is None
+
+def test_disabled_cache_stores_nothing():
+    cache = ProcessedFrameCache(max_bytes=0)
+    cache.put(make_key(0), make_frame())
+    assert cache.get_stats()['frames'] == 0
+
+def make_frame_worker(parameters, embedding):
+    return SimpleNamespace(
+        main_window=SimpleNamespace(default_parameters={'Strength': 100, 'Blur': 0}),
+        control={'SwapModelSelection': 'Inswapper128'},
+        is_swap_faces_enabled=True, is_edit_faces_enabled=False,
+        is_view_face_compare=False, is_view_face_mask=False,
+        parameters={'1': parameters},
+        target_faces={'1': SimpleNamespace(assigned_input_embedding={'Inswapper128ArcFace': embedding})},
+    )
+
+def test_frame_state_hash():
+    embedding = np.ones(512, dtype=np.float32)
+    state_hash = get_frame_state_hash(make_frame_worker({'Strength': 100}, embedding))
+    # The missing parameters are the defaults
+    assert get_frame_state_hash(make_frame_worker({'Strength': 100, 'Blur': 0}, embedding)) == state_hash
+    assert get_frame_state_hash(make_frame_worker({'Strength': 50}, embedding)) != state_hash
+    assert get_frame_state_hash(make_frame_worker({'Strength': 100}, embedding * 2)) != state_hash
@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+from app.processors.reorder_buffer import ReorderBuffer
+
+def make_frame(nbytes=100):
+    return np.zeros(nbytes, dtype=np.uint8)
+
+def test_frames_are_popped_by_frame_number():
+    buffer = ReorderBuffer(max_bytes=1000)
+    buffer.put(2, make_frame())
+    buffer.put(0, make_frame())
+    buffer.put(1, None)
+    assert len(buffer) == 3
+    assert 0 in buffer and 1 in buffer and 2 in buffer
+    assert buffer.pop(0) is not None
+    # A failed frame is kept as None, so that the reader can skip it
+    assert buffer.pop(1) is None
+    assert buffer.pop(2) is not None
+    assert len(buffer) == 0
+    assert 0 not in buffer
+
+def test_byte_accounting():
+    buffer = ReorderBuffer(max_bytes=1000)
+    buffer.put(0, make_frame(100))
+    buffer.put(1, make_frame(200))
+    buffer.put(2, None)
+    assert buffer.nbytes == 300
+    # Replacing a frame only counts the new one
+    buffer.put(1, make_frame(50))
+    assert buffer.nbytes == 150
+    buffer.put(0, None)
+    assert buffer.nbytes == 50
+    buffer.pop(1)
+    assert buffer.nbytes == 0
+    buffer.put(3, make_frame(100))
+    buffer.clear()
+    assert buffer.nbytes == 0
+    assert len(buffer) == 0
+
+def test_is_full():
+    buffer = ReorderBuffer(max_bytes=200)
+    buffer.put(0, make_frame(100))
+    assert not buffer.is_full()
+    buffer.put(1, make_frame(100))
+    assert buffer.is_full()
+    buffer.pop(0)
+    assert not buffer.is_full()
+
+def test_wait_until_not_full_times_out():
+    buffer = ReorderBuffer(max_bytes=100)
+    assert buffer.wait_until_not_full(timeout=0)
+    buffer.put(0, make_frame(100))
+    assert not buffer.wait_until_not_full(timeout=0.01)
+
+def test_wait_until_not_full_is_woken_by_pop():
+    buffer = ReorderBuffer(max_bytes=100)
+    buffer.put(0, make_frame(100))
+    timer = threading.Timer(0.05, buffer.pop, args=(0,))
+    timer.start()
+    try:
+        assert buffer.wait_until_not_full(timeout=5)
+    finally:
+        timer.join()
+
+def test_wait_until_not_full_is_woken_by_clear():
+    buffer = ReorderBuffer(max_bytes=100)
+    buffer.put(0, make_frame(100))
+    timer = threading.Timer(0.05, buffer.clear)
+    timer.start()
+    try:
+        assert buffer.wait_until_not_full(timeout=5)
+    finally:
+        timer.join()
@@ -0,0 +1,145 @@
+import os
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import pytest
+
+from app.processors import segmented_renderer
+from app.processors.segmented_renderer import RenderCheckpoint, SegmentedRenderer, get_workspace_hash, split_into_segments
+
+def assert_covers(segments, start_frame, end_frame):
+    assert segments[0][0] == start_frame
+    assert segments[-1][1] == end_frame
+    for (_, previous_end), (start, end) in zip(segments, segments[1:]):
+        assert start == previous_end + 1
+        assert start <= end
+
+def test_split_without_keyframes():
+    assert split_into_segments(0, 99, [], 4) == [(0, 24), (25, 49), (50, 74), (75, 99)]
+    assert split_into_segments(10, 19, [], 3) == [(10, 12), (13, 16), (17, 19)]
+
+def test_segments_start_at_the_closest_keyframe():
+    assert split_into_segments(0, 99, [0, 20, 45, 80], 4) == [(0, 19), (20, 44), (45, 79), (80, 99)]
+
+def test_segments_sharing_a_keyframe_are_merged():
+    assert split_into_segments(0, 99, [0, 30, 60, 90], 4) == [(0, 29), (30, 59), (60, 99)]
+    assert split_into_segments(0, 99, [50], 4) == [(0, 49), (50, 99)]
+
+def test_keyframes_outside_the_range_are_ignored():
+    assert split_into_segments(100, 199, [0, 50, 100, 150, 250], 2) == [(100, 149), (150, 199)]
+    # Without a keyframe in the range, the segments are split evenly as without keyframes
+    assert split_into_segments(100, 199, [0, 100, 250], 2) == [(100, 149), (150, 199)]
+
+def test_at_most_one_segment_per_frame():
+    assert split_into_segments(5, 7, [], 8) == [(5, 5), (6, 6), (7, 7)]
+    assert split_into_segments(5, 5, [], 4) == [(5, 5)]
+    assert split_into_segments(0, 99, [], 0) == [(0, 99)]
+
+@pytest.mark.parametrize('num_segments', [1, 2, 3, 7, 16])
+def test_segments_cover_the_range(num_segments):
+    keyframe_numbers = list(range(3, 1000, 48))
+    segments = split_into_segments(17, 950, keyframe_numbers, num_segments)
+    assert len(segments) <= num_segments
+    assert_covers(segments, 17, 950)
+    assert all(start in keyframe_numbers for start, _ in segments[1:])
+
+class SynchronousExecutor:
+    """ProcessPoolExecutor running the segments in the calling process"""
+    def __init__(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e: # pylint: disable=broad-exception-caught
+            future.set_exception(e)
+        return future
+
+def make_checkpoint(checkpoint_dir, segments=((0, 49), (50, 99))):
+    return RenderCheckpoint(str(checkpoint_dir), {'workspace_hash': 'abc', 'start_frame': 0}, list(segments))
+
+def touch_segment_file(checkpoint, segment):
+    with open(checkpoint.get_segment_file_path(segment), 'wb'):
+        pass
+
+def test_checkpoint_manifest_round_trip(tmp_path):
+    assert RenderCheckpoint.load(str(tmp_path)) is None
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.save()
+    checkpoint.mark_done((50, 99))
+    loaded = RenderCheckpoint.load(str(tmp_path))
+    assert loaded.render_info == checkpoint.render_info
+    assert loaded.segments == [(0, 49), (50, 99)]
+    assert loaded.done_segments == {(50, 99)}
+    assert not os.path.exists(os.path.join(tmp_path, f'{RenderCheckpoint.manifest_filename}.tmp'))
+
+def test_segment_is_done_only_with_its_file(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.mark_done((0, 49))
+    assert not checkpoint.is_done((0, 49))
+    touch_segment_file(checkpoint, (0, 49))
+    assert checkpoint.is_done((0, 49))
+    touch_segment_file(checkpoint, (50, 99))
+    assert not checkpoint.is_done((50, 99))
+
+def test_changed_keys():
+    checkpoint = make_checkpoint('checkpoint')
+    assert not checkpoint.get_changed_keys({'workspace_hash': 'abc', 'start_frame': 0})
+    assert checkpoint.get_changed_keys({'workspace_hash': 'def', 'start_frame': 0}) == ['workspace_hash']
+    assert checkpoint.get_changed_keys({'workspace_hash': 'abc', 'end_frame': 99}) == ['end_frame', 'start_frame']
+
+def test_workspace_hash(tmp_path):
+    workspace_file = tmp_path / 'workspace.json'
+    workspace_file.write_text('{"a": 1}', encoding='utf-8')
+    workspace_hash = get_workspace_hash(str(workspace_file))
+    assert workspace_hash == get_workspace_hash(str(workspace_file))
+    workspace_file.write_text('{"a": 2}', encoding='utf-8')
+    assert get_workspace_hash(str(workspace_file)) != workspace_hash
+
+def test_resume_is_refused_with_another_workspace(tmp_path):
+    media_path = str(tmp_path / 'video.avi')
+    writer = cv2.VideoWriter(media_path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (32, 32))
+    if not writer.isOpened():
+        pytest.skip('OpenCV can not write videos')
+    for _ in range(10):
+        writer.write(np.zeros((32, 32, 3), dtype=np.uint8))
+    writer.release()
+
+    checkpoint_dir = tmp_path / 'checkpoint'
+    checkpoint_dir.mkdir()
+    render_info = {'workspace_hash': 'abc', 'media_path': os.path.abspath(media_path), 'start_frame': 0, 'end_frame': 9}
+    RenderCheckpoint(str(checkpoint_dir), render_info, [(0, 9)]).save()
+
+    renderer = SegmentedRenderer('workspace.json', 'CPU', 1)
+    with pytest.raises(RuntimeError, match='workspace_hash'):
+        renderer.render(media_path, str(tmp_path / 'output.mp4'), checkpoint_dir=str(checkpoint_dir),
+                        render_info={'workspace_hash': 'def'}, resume=True)
+    # The checkpoint is kept for a resume with the right workspace
+    assert RenderCheckpoint.load(str(checkpoint_dir)).render_info == render_info
+
+def test_only_complete_segments_are_marked_done(tmp_path, monkeypatch):
+    def render_segment(media_path, segment_file_path, start_frame, end_frame):
+        if start_frame == 50:
+            raise ValueError('decode error')
+        if start_frame == 100:
+            # The video ended early
+            return end_frame - start_frame, 1.0
+        return end_frame - start_frame + 1, 1.0
+    monkeypatch.setattr(segmented_renderer, 'ProcessPoolExecutor', SynchronousExecutor)
+    monkeypatch.setattr(segmented_renderer, 'render_segment', render_segment)
+
+    segments = [(0, 49), (50, 99), (100, 149), (150, 199)]
+    checkpoint = make_checkpoint(tmp_path, segments)
+    renderer = SegmentedRenderer('workspace.json', 'CPU', 1)
+    with pytest.raises(RuntimeError, match='50-99, 100-149'):
+        renderer.render_segments('video.mp4', segments, [checkpoint.get_segment_file_path(segment) for segment in segments],
+                                 on_segment_done=checkpoint.mark_done)
+    assert RenderCheckpoint.load(str(tmp_path)).done_segments == {(0, 49), (150, 199)}